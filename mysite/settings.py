@@ -55,11 +55,15 @@ EMAIL_PORT = 587
 ACCOUNT_EMAIL_VERIFICATION = 'none'
 
 MIDDLEWARE = [
+    'trello.metrics.MetricsMiddleware',
+    'trello.timing.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     #'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'trello.profiling.ProfilingMiddleware',
+    'trello.routing.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -88,13 +92,72 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
 
+# SQLite with WAL, a busy timeout and BEGIN IMMEDIATE transactions, see
+# trello/backends/sqlite3/base.py. Connections are kept for CONN_MAX_AGE
+# seconds instead of being opened for every request.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'trello.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 600,
     }
 }
 
+# Read replicas of 'default', used by the read-only pages (see
+# trello/routing.py). TRELLO_REPLICAS=2 sets up two SQLite copies of the
+# database, refreshed by 'manage.py sync_replicas'.
+REPLICA_DATABASES = []
+for number in range(1, int(os.environ.get('TRELLO_REPLICAS', 0)) + 1):
+    alias = 'replica{}'.format(number)
+    DATABASES[alias] = dict(
+        DATABASES['default'],
+        NAME=os.path.join(BASE_DIR, 'db-{}.sqlite3'.format(alias)),
+        TEST={'MIRROR': 'default'},
+    )
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['trello.routing.ReplicaRouter']
+REPLICA_URL_NAMES = {'dashboard', 'board', 'archive', 'description', 'board-snapshot', 'board-changes'}
+# How long a browser that wrote keeps reading from the primary.
+REPLICA_STICKY_SECONDS = 5
+
+# Shared by all workers on the host, so a change made through one worker
+# invalidates the cached pages the others serve.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    },
+    # Rendered board fragments, a copy per worker (see trello/fragments.py).
+    # LocMem counts entries, not bytes: a card is about 1 KB and a list
+    # holds the HTML of its cards, so 5000 entries stay around 20 MB per
+    # worker for boards of a few hundred cards.
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+# Requests slower than this are logged to 'trello.slow' with their queries.
+SLOW_REQUEST_MS = 500
+
+# Per-process metric files summed by the /metrics view, and who may read it.
+METRICS_DIR = os.path.join(BASE_DIR, 'metrics')
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+
+# Staff requests with 'X-Profile: 1', or this share of them, are profiled
+# into PROFILE_DIR, see 'manage.py profile_report'.
+PROFILE_SAMPLE_RATE = 0
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# Board change events streamed to the browsers, shared by all workers on the host.
+BOARD_EVENTS_DB = os.path.join(BASE_DIR, 'board_events.sqlite3')
+# Streams hold a worker each: only turn on when '/board/<id>/events/' is
+# served by a threaded or async process (trello/events.py). Otherwise the
+# board pages poll '/board/<id>/changes/'.
+BOARD_EVENTS_STREAM = False
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -137,3 +200,6 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+
+# Processes generating the cover thumbnails, see trello/images.py
+IMAGE_WORKERS = 2
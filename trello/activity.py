@@ -0,0 +1,119 @@
+"""
+Bookkeeping shared by every view that changes what a board displays.
+
+Each board carries a 'version' counter. Every mutation bumps it, so
+clients polling the board snapshot can tell with a single indexed read
+whether anything changed since their last copy. Mutations also publish a
+small event (see trello/events.py) to the clients streaming the board and
+append it to the board's change log, which idle clients read to catch up
+with a small delta instead of the whole board.
+"""
+
+import json
+
+from django.db import router, transaction
+from django.db.models import F, Max
+
+from . import events
+from .models import Board, BoardChange, BoardSnapshot
+from .queries import board_snapshot, read_transaction
+
+
+CHANGES_PAGE_SIZE = 500
+
+
+def touch_board(*board_ids):
+    """
+    Bump the version of the given boards with one UPDATE statement.
+    """
+
+    board_ids = set(board_id for board_id in board_ids if board_id)
+    if board_ids:
+        Board.objects.filter(id__in=board_ids).update(version=F('version') + 1)
+
+
+def notify(board_id, event, **data):
+    """
+    Record a change of the board: bump its version, append 'event' with
+    'data' to its change log and publish it to the clients streaming it.
+    """
+
+    touch_board(board_id)
+    BoardChange.objects.create(board_id=board_id, event=event, data=json.dumps(data, separators=(',', ':')))
+    events.publish(board_id, event, data)
+
+
+def change_rows(board_id, since, limit=CHANGES_PAGE_SIZE):
+    rows = BoardChange.objects.filter(board_id=board_id, id__gt=since).order_by('id').values_list('id', 'event', 'data')
+    return [{'id': pk, 'event': event, 'data': json.loads(data)} for pk, event, data in rows[:limit]]
+
+
+def latest_change(board_id):
+    """
+    The cursor of the board's last change, 0 when it has none.
+    """
+
+    return BoardChange.objects.filter(board_id=board_id).aggregate(cursor=Max('id'))['cursor'] or 0
+
+
+def changes_since(board, since=None, limit=CHANGES_PAGE_SIZE):
+    """
+    What a client that has seen the board up to change 'since' needs to
+    catch up, as a dict with:
+    'cursor'   the value to send as 'since' next time,
+    'changes'  the changes after 'since', at most 'limit' of them,
+    'has_more' True when more changes are waiting,
+    'snapshot' the full board instead, when 'since' is missing or older
+               than the changes that were compacted away.
+    'board' is a dict with at least 'id', 'title' and 'version'.
+    """
+
+    # One read transaction, on the replica serving the request if any.
+    with read_transaction(using=router.db_for_read(BoardChange)):
+        compacted = BoardSnapshot.objects.filter(board_id=board['id']).values('cursor', 'floor', 'data').first()
+        snapshot = None
+
+        if since is None:
+            cursor = latest_change(board['id'])
+            snapshot = board_snapshot(board)
+            since = cursor
+        elif compacted and since < compacted['floor']:
+            snapshot = json.loads(compacted['data'])
+            since = compacted['cursor']
+
+        changes = change_rows(board['id'], since, limit + 1)
+
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    result = {
+        'cursor': changes[-1]['id'] if changes else since,
+        'changes': changes,
+        'has_more': has_more,
+    }
+    if snapshot is not None:
+        result['snapshot'] = snapshot
+    return result
+
+
+def compact_changes(board_id, before):
+    """
+    Store the current state of the board as its snapshot and delete its
+    changes older than 'before'. Returns the number of deleted changes.
+    """
+
+    with transaction.atomic():
+        board = Board.objects.filter(id=board_id).values('id', 'title', 'version').first()
+        if board is None:
+            return 0
+        cursor = latest_change(board_id)
+        old = BoardChange.objects.filter(board_id=board_id, id__lte=cursor, created_date__lt=before)
+        floor = old.aggregate(floor=Max('id'))['floor']
+        if floor is None:
+            return 0
+
+        BoardSnapshot.objects.update_or_create(
+            board_id=board_id,
+            defaults={'cursor': cursor, 'floor': floor, 'data': json.dumps(board_snapshot(board), separators=(',', ':'))},
+        )
+        deleted, _ = BoardChange.objects.filter(board_id=board_id, id__lte=floor).delete()
+    return deleted
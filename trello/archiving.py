@@ -0,0 +1,78 @@
+"""
+Archiving and restoring many cards, lists or boards at once.
+
+Every operation is a single UPDATE ... WHERE run in a transaction, whatever
+the number of rows, and returns the ids it changed so clients can patch
+their page instead of reloading it. Rows already in the requested state are
+left alone and not returned.
+
+Flags are not cascaded: archiving a list hides its cards without touching
+their own 'archived' flag, so restoring the list brings back exactly the
+cards it had.
+"""
+
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .activity import notify
+from .models import Board, BoardMembers, Card, List, invalidate_dashboards
+
+
+def accessible_boards(user):
+    """
+    Boards the user made or joined.
+    """
+
+    joined = BoardMembers.objects.filter(members=user, deactivate=False).values('board_id')
+    return Board.objects.filter(Q(author=user) | Q(id__in=joined))
+
+
+def set_archived(queryset, archived, board_field):
+    """
+    Archive (or restore) the rows of 'queryset' that are not archived (or
+    restored) yet, with one UPDATE. Must run inside a transaction so the
+    ids read are the ids updated.
+    Returns {board id: [ids]}, 'board_field' being the path to the board id.
+    """
+
+    queryset = queryset.filter(archived=not archived)
+    by_board = defaultdict(list)
+    for pk, board_id in queryset.values_list('id', board_field).order_by('id'):
+        by_board[board_id].append(pk)
+    if by_board:
+        queryset.update(archived=archived, updated_date=timezone.now())
+    return dict(by_board)
+
+
+def archive_cards(queryset, archived=True):
+    event = 'cards.archived' if archived else 'cards.restored'
+    with transaction.atomic():
+        by_board = set_archived(queryset, archived, 'board_list__board_id')
+        for board_id, ids in by_board.items():
+            notify(board_id, event, ids=ids)
+    return sorted(pk for ids in by_board.values() for pk in ids)
+
+
+def archive_lists(queryset, archived=True):
+    event = 'lists.archived' if archived else 'lists.restored'
+    with transaction.atomic():
+        by_board = set_archived(queryset, archived, 'board_id')
+        for board_id, ids in by_board.items():
+            notify(board_id, event, ids=ids)
+    return sorted(pk for ids in by_board.values() for pk in ids)
+
+
+def archive_boards(queryset, archived=True):
+    event = 'board.archived' if archived else 'board.restored'
+    with transaction.atomic():
+        ids = list(set_archived(queryset, archived, 'id'))
+        for board_id in ids:
+            notify(board_id, event)
+        # update() sends no post_save, drop the cached dashboards here.
+        authors = Board.objects.filter(id__in=ids).values_list('author_id', flat=True)
+        members = BoardMembers.objects.filter(board_id__in=ids).values_list('members_id', flat=True)
+        invalidate_dashboards(*authors, *members)
+    return sorted(ids)
@@ -0,0 +1,50 @@
+"""
+SQLite backend tuned for several web workers writing to one file.
+
+- The pragmas in SQLITE_PRAGMAS (overridable in settings) are set on every
+  new connection: WAL journaling, so readers never wait for the writer and
+  the writer never waits for readers; a busy timeout, so a writer waits
+  for the lock instead of failing at once with "database is locked";
+  synchronous=NORMAL, safe with WAL; and a bigger page cache.
+- Transactions start with BEGIN IMMEDIATE. A deferred transaction that
+  reads and then writes cannot wait for the write lock: SQLite fails it
+  at once since waiting could deadlock, whatever the busy timeout. Taking
+  the lock upfront makes writers queue instead, so keep transactions short
+  and do slow work (files, email, rendering) outside them. Read-only
+  transactions use trello.queries.read_transaction(), a plain BEGIN that
+  never takes the write lock.
+
+Use with CONN_MAX_AGE so the pragmas and the page cache are set up once
+per worker rather than per request.
+"""
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.backends.sqlite3 import base
+
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'cache_size': -16000,
+    'temp_store': 'MEMORY',
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # Set by trello.queries.read_transaction() for the next BEGIN only.
+    begin_deferred = False
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN' if self.begin_deferred else 'BEGIN IMMEDIATE')
+
+
+def set_pragmas(sender, connection, **kwargs):
+    pragmas = dict(SQLITE_PRAGMAS, **getattr(settings, 'SQLITE_PRAGMAS', {}))
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {}={}'.format(name, value))
+
+
+connection_created.connect(set_pragmas, sender=DatabaseWrapper)
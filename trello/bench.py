@@ -0,0 +1,222 @@
+"""
+In-process load test of the board views.
+
+Every thread logs in as one of the users made by seed_scale and runs
+scenarios picked at random by weight, each one a request made with the
+Django test client against the configured database. Latency, errors and
+the queries run are recorded per scenario; report() turns them into
+p50/p95/p99, requests per second and queries per request.
+
+Mutation scenarios change the data, run the bench on a seeded copy.
+The 'contention' mix only moves and adds cards, to see how the database
+copes with concurrent writers; failures are counted by reason, e.g.
+'OperationalError: database is locked'.
+"""
+
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from .models import BoardMembers, Card, List
+
+
+class Fixture:
+    """
+    The ids a thread works with: its user, the boards the user made and
+    their visible lists and cards.
+    """
+
+    def __init__(self, user, rng):
+        self.user = user
+        self.random = rng
+        self.boards = list(BoardMembers.objects.filter(
+            members=user, owner=True, board__archived=False, board__deleted_date__isnull=True
+        ).values_list('board_id', flat=True))
+        self.lists = list(List.objects.filter(board_id__in=self.boards, archived=False).values_list('id', flat=True))
+        self.cards = list(Card.objects.filter(board_list_id__in=self.lists, archived=False).values_list('id', flat=True))
+
+    def board(self):
+        return self.random.choice(self.boards)
+
+    def list(self):
+        return self.random.choice(self.lists)
+
+    def card(self):
+        return self.random.choice(self.cards)
+
+
+def dashboard(client, fixture):
+    return client.get('/dashboard/')
+
+
+def board(client, fixture):
+    return client.get('/board/{}/'.format(fixture.board()))
+
+
+def archive(client, fixture):
+    return client.get('/archive/', {'type': fixture.random.choice(['boards', 'lists', 'cards'])})
+
+
+def description(client, fixture):
+    return client.get('/description/{}/'.format(fixture.card()))
+
+
+def add_card(client, fixture):
+    return client.post('/board/{}/list/'.format(fixture.list()), {'card_title': 'Bench card'})
+
+
+def move_card(client, fixture):
+    card = fixture.card()
+    return client.post('/drag-and-drop/{}/'.format(card), {
+        'blist': fixture.list(), 'card': card, 'before': '', 'after': '',
+    })
+
+
+def edit_card(client, fixture):
+    return client.post('/description/{}/'.format(fixture.card()), {
+        'card_title': 'Bench card', 'card_description': 'Edited by the bench.',
+    })
+
+
+SCENARIOS = {
+    'dashboard': dashboard,
+    'board': board,
+    'archive': archive,
+    'description': description,
+    'add_card': add_card,
+    'move_card': move_card,
+    'edit_card': edit_card,
+}
+
+DEFAULT_MIX = {
+    'dashboard': 4,
+    'board': 4,
+    'archive': 1,
+    'description': 2,
+    'add_card': 1,
+    'move_card': 1,
+    'edit_card': 1,
+}
+
+MIXES = {
+    'default': DEFAULT_MIX,
+    # Writers only, to measure lock contention ("database is locked").
+    'contention': {'move_card': 3, 'add_card': 1},
+}
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.failures = defaultdict(int)
+
+    def add(self, name, seconds, queries, failure=None):
+        with self.lock:
+            self.latencies[name].append(seconds)
+            self.queries[name] += queries
+            if failure:
+                self.errors[name] += 1
+                self.failures[failure] += 1
+
+
+def login(user_id, seed):
+    """
+    A logged in client and the fixture of the user. Done before the threads
+    start, so the session writes do not compete with the measured requests.
+    """
+
+    user = User.objects.get(id=user_id)
+    client = Client()
+    client.force_login(user)
+    return client, Fixture(user, random.Random(seed))
+
+
+def worker(client, fixture, mix, deadline, requests, recorder):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    done = 0
+    try:
+        while time.time() < deadline and (not requests or done < requests):
+            name = fixture.random.choices(names, weights)[0]
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                try:
+                    status = SCENARIOS[name](client, fixture).status_code
+                    failure = 'status {}'.format(status) if status >= 400 else None
+                except Exception as error:
+                    failure = '{}: {}'.format(type(error).__name__, error)
+                elapsed = time.perf_counter() - started
+            recorder.add(name, elapsed, len(queries), failure)
+            done += 1
+    finally:
+        connection.close()
+
+
+def run(users, threads=4, duration=10, requests=0, mix=None, seed=0):
+    """
+    Run 'threads' threads, each as one of 'users' (ids), for 'duration'
+    seconds or 'requests' requests per thread, whichever comes first.
+    Users without cards are skipped. Returns the report.
+    """
+
+    sessions = [login(users[n % len(users)], seed + n) for n in range(threads)]
+    sessions = [(client, fixture) for client, fixture in sessions if fixture.cards]
+    recorder = Recorder()
+    deadline = time.time() + duration
+    workers = [
+        threading.Thread(target=worker, args=(client, fixture, mix or DEFAULT_MIX, deadline, requests, recorder))
+        for client, fixture in sessions
+    ]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return report(recorder, time.perf_counter() - started, len(workers))
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, queries, errors, elapsed):
+    ordered = sorted(latencies)
+    count = len(ordered)
+    milliseconds = lambda seconds: None if seconds is None else round(seconds * 1000, 2)
+    return {
+        'requests': count,
+        'errors': errors,
+        'rps': round(count / elapsed, 2) if elapsed else None,
+        'p50_ms': milliseconds(percentile(ordered, 0.50)),
+        'p95_ms': milliseconds(percentile(ordered, 0.95)),
+        'p99_ms': milliseconds(percentile(ordered, 0.99)),
+        'queries_per_request': round(queries / count, 2) if count else None,
+    }
+
+
+def report(recorder, elapsed, threads):
+    scenarios = {
+        name: summarize(latencies, recorder.queries[name], recorder.errors[name], elapsed)
+        for name, latencies in sorted(recorder.latencies.items())
+    }
+    every = [seconds for latencies in recorder.latencies.values() for seconds in latencies]
+    total = summarize(every, sum(recorder.queries.values()), sum(recorder.errors.values()), elapsed)
+    return {
+        'threads': threads,
+        'seconds': round(elapsed, 2),
+        'total': total,
+        'scenarios': scenarios,
+        'failures': dict(recorder.failures),
+    }
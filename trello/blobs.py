@@ -0,0 +1,132 @@
+"""
+Content addressed storage of card cover images.
+
+Uploads are stored under the SHA-256 of their bytes, so identical images
+are kept once whatever they were called, and their thumbnails (named after
+the same hash) are generated once too. Every stored image has an
+ImageBlob row counting the cards pointing at it; views acquire and release
+references as covers are set, replaced and deleted. The 'collect_images'
+command walks the storage and deletes the files nobody references.
+"""
+
+import hashlib
+import os
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .images import DERIVATIVES, derivative_name
+from .models import Card, ImageBlob
+
+
+def image_storage():
+    return Card._meta.get_field('image').storage
+
+
+def blob_name(digest, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return 'images/{}/{}/{}{}'.format(digest[:2], digest[2:4], digest, extension)
+
+
+def store_upload(upload):
+    """
+    Store the uploaded file under its content hash, unless the same bytes
+    are stored already, and take a reference to it.
+    Returns the storage name to assign to 'Card.image'.
+    """
+
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    digest = digest.hexdigest()
+    name = blob_name(digest, upload.name)
+
+    storage = image_storage()
+    if not storage.exists(name):
+        upload.seek(0)
+        saved = storage.save(name, upload)
+        if saved != name:
+            # Another request stored the same bytes in the meantime.
+            storage.delete(saved)
+
+    try:
+        with transaction.atomic():
+            blob, created = ImageBlob.objects.get_or_create(
+                digest=digest, defaults={'name': name, 'size': upload.size, 'refcount': 1}
+            )
+    except IntegrityError:
+        # Another request created the blob between our lookup and insert.
+        blob, created = ImageBlob.objects.get(digest=digest), False
+    if not created:
+        ImageBlob.objects.filter(id=blob.id).update(refcount=F('refcount') + 1)
+        name = blob.name
+    return name
+
+
+def acquire(*names):
+    """
+    Take one more reference to each of the stored images 'names'.
+    """
+
+    change_refcounts(Counter(name for name in names if name), 1)
+
+
+def release(*names):
+    """
+    Drop one reference to each of the stored images 'names'. Images left
+    without references are deleted by the next 'collect_images' run.
+    """
+
+    change_refcounts(Counter(name for name in names if name), -1)
+
+
+def change_refcounts(counts, sign):
+    """
+    Apply reference count changes with one UPDATE per distinct count.
+    """
+
+    by_count = {}
+    for name, count in counts.items():
+        by_count.setdefault(count, []).append(name)
+    for count, names in by_count.items():
+        ImageBlob.objects.filter(name__in=names).update(refcount=F('refcount') + sign * count)
+
+
+def referenced_images(names):
+    """
+    The stored images among 'names' that a card uses or that still hold
+    references.
+    """
+
+    in_use = set(Card.objects.filter(image__in=names).values_list('image', flat=True))
+    in_use.update(ImageBlob.objects.filter(name__in=names, refcount__gt=0).values_list('name', flat=True))
+    return in_use
+
+
+def delete_images(names):
+    """
+    Delete the stored images 'names', their derivatives and their blobs.
+    """
+
+    storage = image_storage()
+    for name in names:
+        storage.delete(name)
+        for kind in DERIVATIVES:
+            storage.delete(derivative_name(name, kind))
+    ImageBlob.objects.filter(name__in=names).delete()
+
+
+def walk(storage, path):
+    """
+    Yield the name of every file under 'path' in the storage, one
+    directory at a time.
+    """
+
+    if not storage.exists(path):
+        return
+    directories, files = storage.listdir(path)
+    for filename in files:
+        yield '{}/{}'.format(path, filename)
+    for directory in directories:
+        yield from walk(storage, '{}/{}'.format(path, directory))
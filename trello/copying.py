@@ -0,0 +1,64 @@
+"""
+Copying boards, e.g. to start the next sprint from the same structure or to
+keep a board as a template.
+
+A copy takes the board's non-archived lists and cards, in their order,
+with a few bulk inserts whatever the size of the board: one for the lists,
+one per COPY_BATCH_SIZE cards, and one for the members when asked.
+"""
+
+from django.db import transaction
+
+from .blobs import acquire
+from .models import Board, BoardMembers, Card, List, invalidate_dashboards
+from .queries import bulk_create_ids, visible_cards, visible_lists
+
+
+COPY_BATCH_SIZE = 1000
+
+
+def copy_board(board, user, title=None, members=False, is_template=False, batch_size=COPY_BATCH_SIZE):
+    """
+    Copy the board for 'user', who owns the copy. With 'members', the active
+    members of the board are members of the copy too. Covers are shared
+    with the original, their references are taken.
+    Returns the new board.
+    """
+
+    with transaction.atomic():
+        copy = Board.objects.create(author=user, title=title or board.title, is_template=is_template)
+        new_members = [BoardMembers(board=copy, members=user, owner=True)]
+        if members:
+            member_ids = BoardMembers.objects.filter(board=board, deactivate=False).exclude(members=user).values_list(
+                'members_id', flat=True
+            )
+            new_members += [BoardMembers(board=copy, members_id=pk, deactivate=False) for pk in member_ids]
+        BoardMembers.objects.bulk_create(new_members)
+        invalidate_dashboards(*[member.members_id for member in new_members])
+
+        lists = list(visible_lists().filter(board=board).values_list('id', 'list_title', 'rank'))
+        new_ids = bulk_create_ids([
+            List(board=copy, author=user, list_title=list_title, rank=rank)
+            for pk, list_title, rank in lists
+        ], board=copy)
+        list_ids = {pk: new_id for (pk, list_title, rank), new_id in zip(lists, new_ids)}
+
+        cards = visible_cards().filter(board_list_id__in=list(list_ids)).values_list(
+            'board_list_id', 'card_title', 'card_description', 'rank', 'image', 'thumbnail', 'preview'
+        )
+        batch = []
+        for list_id, card_title, description, rank, image, thumbnail, preview in cards.iterator(chunk_size=batch_size):
+            batch.append(Card(
+                board_list_id=list_ids[list_id], author=user, card_title=card_title, card_description=description,
+                rank=rank, image=image, thumbnail=thumbnail, preview=preview,
+            ))
+            if len(batch) == batch_size:
+                copy_cards(batch)
+                batch = []
+        copy_cards(batch)
+    return copy
+
+
+def copy_cards(cards):
+    Card.objects.bulk_create(cards)
+    acquire(*[card.image.name for card in cards if card.image])
@@ -0,0 +1,139 @@
+"""
+Fan-out of small board change events to the clients streaming a board.
+
+Events are appended to a small SQLite file of their own (BOARD_EVENTS_DB),
+separate from the main database, so every gunicorn worker on the host can
+publish and every streaming connection can tail them without taking the
+main database's write lock. Streams poll the file with an indexed
+'id > last seen' read, which is cheap enough to run twice a second per
+connection. Events are only kept for EVENT_TTL seconds; a client that was
+away longer reloads the board snapshot instead.
+
+Deployment: a stream keeps its worker busy for its whole minute, so a few
+open boards exhaust a pool of synchronous gunicorn or uwsgi workers. The
+stream is therefore off unless settings.BOARD_EVENTS_STREAM is set, and
+then '/board/<id>/events/' must be routed to a separate threaded or
+async server process, e.g.
+
+    gunicorn mysite.wsgi --worker-class gthread --threads 100
+
+behind the same proxy, with buffering off. Without it, the board page
+polls the board's change log ('/board/<id>/changes/', see
+trello/activity.py) every few seconds, a short indexed read per poll.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+
+EVENT_TTL = 10 * 60
+POLL_INTERVAL = 0.5
+HEARTBEAT_INTERVAL = 15
+PRUNE_EVERY = 200
+
+_local = threading.local()
+
+
+def events_db_path():
+    return getattr(settings, 'BOARD_EVENTS_DB', os.path.join(settings.BASE_DIR, 'board_events.sqlite3'))
+
+
+def get_connection():
+    """
+    One autocommit connection per thread and per events file.
+    """
+
+    path = events_db_path()
+    connection = getattr(_local, 'connection', None)
+    if connection is None or _local.path != path:
+        connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS board_event ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, board_id INTEGER NOT NULL, '
+            'created REAL NOT NULL, event TEXT NOT NULL, data TEXT NOT NULL)'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS board_event_board_id ON board_event (board_id, id)')
+        _local.connection = connection
+        _local.path = path
+        _local.published = 0
+    return connection
+
+
+def stream_enabled():
+    return getattr(settings, 'BOARD_EVENTS_STREAM', False)
+
+
+def publish(board_id, event, data):
+    """
+    Append an event for the board. Inside a transaction the event is only
+    written once the transaction commits, so streams never announce a
+    change that was rolled back. Nothing is written while the stream is
+    off, nobody would read it.
+    """
+
+    if not stream_enabled():
+        return
+
+    def write():
+        connection = get_connection()
+        connection.execute(
+            'INSERT INTO board_event (board_id, created, event, data) VALUES (?, ?, ?, ?)',
+            (board_id, time.time(), event, json.dumps(data, separators=(',', ':'))),
+        )
+        _local.published += 1
+        if _local.published % PRUNE_EVERY == 0:
+            prune()
+
+    transaction.on_commit(write)
+
+
+def prune(ttl=EVENT_TTL):
+    get_connection().execute('DELETE FROM board_event WHERE created < ?', (time.time() - ttl,))
+
+
+def last_event_id():
+    row = get_connection().execute('SELECT MAX(id) FROM board_event').fetchone()
+    return row[0] or 0
+
+
+def read_events(board_id, after_id):
+    """
+    Events of the board published after 'after_id', oldest first, as
+    (id, event, data) with 'data' still JSON encoded.
+    """
+
+    return get_connection().execute(
+        'SELECT id, event, data FROM board_event WHERE board_id = ? AND id > ? ORDER BY id',
+        (board_id, after_id),
+    ).fetchall()
+
+
+def stream(board_id, after_id=None, duration=55):
+    """
+    Yield the board's events in Server-Sent Events format for 'duration'
+    seconds, then stop so the worker is handed back; EventSource reconnects
+    on its own and resumes from the Last-Event-ID it received.
+    """
+
+    if after_id is None:
+        after_id = last_event_id()
+
+    yield 'retry: 2000\n\n'
+    started = last_write = time.time()
+    while time.time() - started < duration:
+        for event_id, event, data in read_events(board_id, after_id):
+            after_id = event_id
+            last_write = time.time()
+            yield 'id: {}\nevent: {}\ndata: {}\n\n'.format(event_id, event, data)
+        if time.time() - last_write >= HEARTBEAT_INTERVAL:
+            last_write = time.time()
+            yield ': heartbeat\n\n'
+        time.sleep(POLL_INTERVAL)
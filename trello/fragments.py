@@ -0,0 +1,104 @@
+"""
+Cached HTML of the board page, nested like Russian dolls.
+
+The lists part of board.html is cached per board along with the board
+version, which every change of the board bumps (see trello/activity.py),
+so an unchanged board is served without loading its lists and cards at
+all. When the version moved, the lists and cards are loaded and each list
+and card is
+looked up by a key built from what it displays: a card from its id,
+updated date, rank and images, a list from its own fields and the keys of
+its cards. Keys are fetched with one get_many per level and only the
+fragments missing are rendered, so a board where one card changed
+renders that card and its list, not the other 2,000 cards.
+
+They live in the 'fragments' cache, local to each worker: a list or card
+key is never reused for other content, so nothing has to be invalidated
+across workers. The whole-board entry is the exception: there is one per
+board, overwritten when the version moves, so old versions of big boards
+do not pile up. It is only kept for BOARD_FRAGMENT_TIMEOUT because
+changes made without notify() (the admin, a shell) do not bump the
+version; such a change shows up on the board page once it expires.
+Fragments must not depend on the request: no CSRF token or user in
+them, the AJAX calls send the token in a header instead (script.js).
+"""
+
+import hashlib
+
+from django.core.cache import caches
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from .queries import visible_cards, visible_lists
+
+
+# Bump when board_card.html or board_list.html change.
+FRAGMENT_VERSION = 1
+FRAGMENT_TIMEOUT = 24 * 3600
+BOARD_FRAGMENT_TIMEOUT = 60
+
+
+def fragment_cache():
+    return caches['fragments']
+
+
+def fragment_key(kind, *parts):
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return 'fragment:{}:{}:{}'.format(FRAGMENT_VERSION, kind, digest)
+
+
+def board_key(board):
+    return fragment_key('board', board.id)
+
+
+def card_key(card):
+    return fragment_key('card', card.id, card.updated_date.isoformat(), card.rank, card.image, card.thumbnail)
+
+
+def list_key(board_list, card_keys):
+    return fragment_key('list', board_list.id, board_list.list_title, board_list.updated_date.isoformat(),
+                        board_list.rank, *card_keys)
+
+
+def render_board_lists(board):
+    """
+    HTML of the lists and cards of the board.
+    """
+
+    key = board_key(board)
+    version, html = fragment_cache().get(key, (None, None))
+    if version != board.version:
+        html = render_lists(board)
+        fragment_cache().set(key, (board.version, html), BOARD_FRAGMENT_TIMEOUT)
+    return mark_safe(html)
+
+
+def render_lists(board):
+    lists = list(visible_lists().filter(board=board))
+    cards = {}
+    for card in visible_cards().filter(board_list__in=lists):
+        cards.setdefault(card.board_list_id, []).append(card)
+
+    card_keys = {board_list.id: [card_key(card) for card in cards.get(board_list.id, [])] for board_list in lists}
+    list_keys = {board_list.id: list_key(board_list, card_keys[board_list.id]) for board_list in lists}
+    cache = fragment_cache()
+    cached_lists = cache.get_many(list(list_keys.values()))
+    missing_lists = [board_list for board_list in lists if list_keys[board_list.id] not in cached_lists]
+
+    fresh = {}
+    if missing_lists:
+        wanted = [key for board_list in missing_lists for key in card_keys[board_list.id]]
+        cached_cards = cache.get_many(wanted)
+        card_template = get_template('trello/board_card.html')
+        list_template = get_template('trello/board_list.html')
+        for board_list in missing_lists:
+            parts = []
+            for card, key in zip(cards.get(board_list.id, []), card_keys[board_list.id]):
+                if key not in cached_cards:
+                    cached_cards[key] = fresh[key] = card_template.render({'card': card})
+                parts.append(cached_cards[key])
+            key = list_keys[board_list.id]
+            cached_lists[key] = fresh[key] = list_template.render({'list': board_list, 'cards': mark_safe(''.join(parts))})
+        cache.set_many(fresh, FRAGMENT_TIMEOUT)
+
+    return ''.join(cached_lists[list_keys[board_list.id]] for board_list in lists)
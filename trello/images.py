@@ -0,0 +1,158 @@
+"""
+Derivatives of card cover images.
+
+An uploaded cover is kept as is, and two WebP derivatives are generated
+from it outside the request: a small 'thumbnail' shown on the board and a
+medium 'preview' shown in the card modal. Generation runs in a process
+pool so decoding large phone photos never blocks a web worker; the pool
+only touches files, the database is updated back in the web process once
+a job is done. The 'build_thumbnails' command catches up on covers whose
+job was lost, e.g. because the process restarted.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from PIL import Image, ImageOps
+
+from . import metrics
+from .activity import notify
+from .models import Card
+
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES = {
+    'thumbnail': (320, 320),
+    'preview': (1024, 1024),
+}
+WEBP_QUALITY = 80
+
+_executor = None
+_pending = 0
+_lock = threading.Lock()
+
+
+def derivative_name(image_name, kind):
+    """
+    Storage name of the 'kind' derivative of the image 'image_name'.
+    Images are stored under their content hash, so identical images share
+    their derivatives.
+    """
+
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return 'thumbnails/{}-{}.webp'.format(stem, kind)
+
+
+def make_derivatives(source, targets):
+    """
+    Write a WebP derivative of the image file 'source' for every
+    (path, size) in 'targets'. Runs in the worker processes, so it only
+    deals with files.
+    """
+
+    with Image.open(source) as image:
+        largest = max(max(size) for path, size in targets)
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+        for path, size in targets:
+            derivative = image.copy()
+            derivative.thumbnail(size, Image.LANCZOS)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial = path + '.part'
+            derivative.save(partial, 'WEBP', quality=WEBP_QUALITY, method=4)
+            os.replace(partial, path)
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=getattr(settings, 'IMAGE_WORKERS', 2))
+    return _executor
+
+
+def pending():
+    """
+    Number of derivative jobs queued or running in this process.
+    """
+
+    return _pending
+
+
+def derivative_jobs(card_id, image_name):
+    storage = Card._meta.get_field('image').storage
+    names = {kind: derivative_name(image_name, kind) for kind in DERIVATIVES}
+    targets = [(storage.path(names[kind]), size) for kind, size in DERIVATIVES.items()]
+    return storage.path(image_name), targets, names
+
+
+def save_derivatives(card_id, image_name, names):
+    """
+    Point the card at its derivatives, unless its cover changed meanwhile,
+    and tell the clients streaming the board.
+    """
+
+    updated = Card.objects.filter(id=card_id, image=image_name).update(updated_date=timezone.now(), **names)
+    if updated:
+        board_id = Card.objects.filter(id=card_id).values_list('board_list__board_id', flat=True).first()
+        storage = Card._meta.get_field('image').storage
+        notify(board_id, 'card.cover', id=card_id, image=storage.url(image_name), thumbnail=storage.url(names['thumbnail']))
+
+
+def queue_derivatives(card_id, image_name):
+    """
+    Generate the derivatives of the card cover in the process pool once
+    the current transaction commits.
+    """
+
+    def submit():
+        global _pending
+        source, targets, names = derivative_jobs(card_id, image_name)
+        if all(os.path.exists(path) for path, size in targets):
+            # Same image uploaded before, its derivatives are shared.
+            save_derivatives(card_id, image_name, names)
+            return
+        submitter = threading.get_ident()
+        with _lock:
+            _pending += 1
+            metrics.set_gauge('trello_image_queue_depth', _pending)
+        future = get_executor().submit(make_derivatives, source, targets)
+        future.add_done_callback(lambda future: finished(future, card_id, image_name, names, submitter))
+
+    transaction.on_commit(submit)
+
+
+def finished(future, card_id, image_name, names, submitter):
+    global _pending
+    with _lock:
+        _pending -= 1
+        metrics.set_gauge('trello_image_queue_depth', _pending)
+
+    try:
+        future.result()
+        save_derivatives(card_id, image_name, names)
+    except Exception:
+        logger.exception('Could not generate derivatives of card %s cover %s.', card_id, image_name)
+    finally:
+        if threading.get_ident() != submitter:
+            # The pool's management thread opened a connection of its own.
+            connection.close()
+
+
+def build_derivatives(card_id, image_name):
+    """
+    Generate the derivatives of the card cover in the current process.
+    """
+
+    source, targets, names = derivative_jobs(card_id, image_name)
+    make_derivatives(source, targets)
+    save_derivatives(card_id, image_name, names)
@@ -0,0 +1,60 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from trello.bench import MIXES, SCENARIOS, run
+
+
+class Command(BaseCommand):
+    """
+    Load test the board views in process with the users made by seed_scale,
+    and print the latency percentiles, throughput and queries per request
+    as JSON, per scenario and in total.
+
+    --mix weighs the scenarios, e.g. 'board=5,dashboard=2,move_card=1';
+    the ones left out are not run. '--mix contention' only moves and adds
+    cards, to measure write contention. The mutation scenarios change the
+    data, run it on a seeded copy of the database.
+    """
+
+    help = 'Benchmark the board views against seeded data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=10, metavar='SECONDS')
+        parser.add_argument('--requests', type=int, default=0, help='Stop each thread after this many requests.')
+        parser.add_argument('--prefix', default='bench', help='Username prefix given to seed_scale.')
+        parser.add_argument('--mix', default='default', help='{} or comma separated scenario=weight, from: {}.'.format(
+            ' or '.join(MIXES), ', '.join(SCENARIOS)
+        ))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('-o', '--output', help='Write the report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        mix = MIXES.get(options['mix']) or self.parse_mix(options['mix'])
+        users = list(User.objects.filter(username__startswith=options['prefix']).order_by('id').values_list('id', flat=True))
+        if not users:
+            raise CommandError("No users named '{}*', run seed_scale first.".format(options['prefix']))
+
+        report = run(users, options['threads'], options['duration'], options['requests'], mix, options['seed'])
+        report['mix'] = mix
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                out.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def parse_mix(self, value):
+        mix = {}
+        for part in value.split(','):
+            name, _, weight = part.partition('=')
+            name = name.strip()
+            if name not in SCENARIOS:
+                raise CommandError('Unknown scenario {!r}.'.format(name))
+            try:
+                mix[name] = float(weight) if weight else 1
+            except ValueError:
+                raise CommandError('Bad weight for {!r}.'.format(name))
+        return mix
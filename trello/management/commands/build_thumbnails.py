@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from trello.images import build_derivatives
+from trello.models import Card
+
+
+class Command(BaseCommand):
+    """
+    Generate the missing thumbnails of card covers, e.g. for covers
+    uploaded before thumbnails existed or whose background job was lost.
+    """
+
+    help = 'Generate the thumbnail and preview of covers that have none.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        # Cards saved without a thumbnail hold a blank name rather than NULL.
+        covers = Card.objects.filter(Q(thumbnail__isnull=True) | Q(thumbnail=''), image__isnull=False).exclude(image='')
+        built = failed = 0
+
+        for card_id, image_name in covers.values_list('id', 'image').iterator(chunk_size=options['batch_size']):
+            try:
+                build_derivatives(card_id, image_name)
+                built += 1
+            except (IOError, OSError) as error:
+                failed += 1
+                self.stderr.write('Card {}: {}'.format(card_id, error))
+        self.stdout.write('Built thumbnails of {} covers, {} failed.'.format(built, failed))
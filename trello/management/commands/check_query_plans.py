@@ -0,0 +1,105 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from trello import outbox
+from trello.models import Board, BoardChange, BoardInvite, BoardMembers, Card, ImageBlob, List
+from trello.queries import active_members, visible_cards, visible_lists
+
+
+class Command(BaseCommand):
+    """
+    Run EXPLAIN QUERY PLAN on the querysets the views run and fail when one
+    of them reads a whole table instead of using an index.
+
+    Run it against a seeded database: SQLite picks its plans from the
+    table statistics, so an empty database says little. The plans do not
+    depend on the ids used, the first user and board are taken.
+    """
+
+    help = 'Check that the views querysets are served by indexes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan, not only the failing ones.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN is only checked on SQLite.')
+
+        user = User.objects.order_by('id').first()
+        board = Board.objects.order_by('id').first()
+        if user is None or board is None:
+            raise CommandError('Seed the database first, e.g. with the seed_scale command.')
+
+        failures = []
+        for name, queryset in view_querysets(user, board):
+            plan = explain(queryset)
+            scans = [detail for detail in plan if is_table_scan(detail)]
+            if scans:
+                failures.append(name)
+            if scans or options['verbose_plans']:
+                self.stdout.write('{}{}'.format(name, ': FULL SCAN' if scans else ''))
+                for detail in plan:
+                    self.stdout.write('    {}'.format(detail))
+
+        if failures:
+            raise CommandError('{} querysets scan a whole table: {}'.format(len(failures), ', '.join(failures)))
+        self.stdout.write('All querysets use an index.')
+
+
+def view_querysets(user, board):
+    """
+    (name, queryset) for the queries the views run, with the same filters.
+    """
+
+    list_ids = list(visible_lists().filter(board=board).values_list('id', flat=True)[:10]) or [0]
+    emails = [user.email, 'invite@example.com']
+    now = timezone.now()
+    return [
+        ('DashBoardView boards', Board.objects.filter(author=user, archived=False).order_by('id')),
+        ('DashBoardView invited boards', BoardMembers.objects.filter(members=user, deactivate=False, owner=False, board__deleted_date__isnull=True).values_list('board_id', 'board__title')),
+        ('BoardView lists', visible_lists().filter(board_id=board.id)),
+        ('BoardView cards', visible_cards().filter(board_list_id__in=list_ids)),
+        ('BoardView members', active_members(board)),
+        ('BoardSnapshotView cards', visible_cards().filter(board_list__board_id=board.id, board_list__archived=False).values_list('id', 'rank')),
+        ('BoardChangesView', BoardChange.objects.filter(board=board, id__gt=0).order_by('id')),
+        ('CardDragAndDropView siblings', Card.objects.filter(board_list_id=list_ids[0]).order_by('rank')),
+        ('ListDragAndDropView siblings', List.objects.filter(board_id=board.id).order_by('rank')),
+        ('ArchiveView boards', Board.objects.filter(author=user, archived=True).order_by('created_date', 'id')),
+        ('ArchiveView lists', List.objects.filter(author=user, archived=True).order_by('created_date', 'id')),
+        ('ArchiveView cards', Card.objects.filter(author=user, archived=True).order_by('created_date', 'id')),
+        ('ArchiveView cards next page', Card.objects.filter(
+            Q(created_date__gt=now) | Q(created_date=now, id__gt=0), author=user, archived=True, created_date__gte=now,
+        ).order_by('created_date', 'id')),
+        ('InviteMemberView users', User.objects.filter(email__in=emails)),
+        ('InviteMembersView members', BoardMembers.objects.filter(board=board, members__in=[user.id])),
+        ('InviteMembersView invites', BoardInvite.objects.filter(board=board, email_member__in=emails)),
+        ('RegisterInvitedUser invites', BoardInvite.objects.filter(email_member=user.email)),
+        ('send_emails outbox', outbox.unsent().filter(next_attempt__lte=now).order_by('next_attempt', 'id')),
+        ('purge_boards pending', Board.all_objects.filter(deleted_date__isnull=False).order_by('deleted_date', 'id')),
+        ('collect_images blobs', ImageBlob.objects.filter(name__in=['images/a.png'], refcount__gt=0)),
+    ]
+
+
+def explain(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def is_table_scan(detail):
+    """
+    'SCAN TABLE x' (or 'SCAN x' in newer SQLite) without an index reads
+    every row of the table. Scanning a subquery or a list of constants
+    is fine.
+    """
+
+    words = detail.split()
+    if not words or words[0] != 'SCAN':
+        return False
+    if words[1] in ('SUBQUERY', 'CONSTANT'):
+        return False
+    return 'INDEX' not in words
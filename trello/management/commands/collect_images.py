@@ -0,0 +1,70 @@
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from trello.blobs import image_storage, referenced_images, walk
+from trello.images import DERIVATIVES, derivative_name
+from trello.models import Card, ImageBlob
+
+
+class Command(BaseCommand):
+    """
+    Delete the stored images and thumbnails no card references any more.
+    Files are checked a batch at a time, with one query per batch, and files
+    younger than the grace period are kept so uploads still in flight are
+    never collected.
+    """
+
+    help = 'Delete cover images and thumbnails that are no longer referenced.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--grace-minutes', type=int, default=60)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        self.storage = image_storage()
+        self.dry_run = options['dry_run']
+        self.cutoff = timezone.now() - timedelta(minutes=options['grace_minutes'])
+        batch_size = options['batch_size']
+
+        images = self.collect(walk(self.storage, 'images'), batch_size, referenced_images)
+        thumbnails = self.collect(walk(self.storage, 'thumbnails'), batch_size, self.referenced_thumbnails)
+        self.stdout.write('{} {} images and {} thumbnails.'.format(
+            'Would delete' if self.dry_run else 'Deleted', images, thumbnails
+        ))
+
+    def collect(self, names, batch_size, referenced):
+        deleted = 0
+        batch = []
+        for name in names:
+            if name.endswith('.part') or self.storage.get_modified_time(name) > self.cutoff:
+                continue
+            batch.append(name)
+            if len(batch) == batch_size:
+                deleted += self.delete(batch, referenced)
+                batch = []
+        if batch:
+            deleted += self.delete(batch, referenced)
+        return deleted
+
+    def referenced_thumbnails(self, names):
+        rows = Card.objects.filter(Q(thumbnail__in=names) | Q(preview__in=names)).values_list('thumbnail', 'preview')
+        in_use = {name for row in rows for name in row}
+        # Derivatives of a live image are kept even before a card points at them.
+        digests = {os.path.basename(name).rsplit('-', 1)[0] for name in names}
+        live = ImageBlob.objects.filter(digest__in=digests, refcount__gt=0).values_list('name', flat=True)
+        in_use.update(derivative_name(name, kind) for name in live for kind in DERIVATIVES)
+        return in_use
+
+    def delete(self, names, referenced):
+        in_use = referenced(names)
+        unused = [name for name in names if name not in in_use]
+        if not self.dry_run:
+            for name in unused:
+                self.storage.delete(name)
+            ImageBlob.objects.filter(name__in=unused).delete()
+        return len(unused)
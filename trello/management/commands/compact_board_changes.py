@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from trello.activity import compact_changes
+from trello.models import BoardChange
+
+
+class Command(BaseCommand):
+    """
+    Prune the board change logs.
+
+    Changes older than --hours are folded into a snapshot of their board
+    and deleted. Clients that were idle for longer download that snapshot
+    once and then only the changes made after it. Every board is compacted
+    in its own transaction.
+    """
+
+    help = 'Compact board changes older than --hours into board snapshots.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(hours=options['hours'])
+        board_ids = BoardChange.objects.filter(created_date__lt=before).values_list('board_id', flat=True).distinct()
+
+        boards = deleted = 0
+        for board_id in list(board_ids):
+            deleted += compact_changes(board_id, before)
+            boards += 1
+        self.stdout.write('Compacted {} changes of {} boards.'.format(deleted, boards))
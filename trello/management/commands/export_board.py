@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from trello.models import Board
+from trello.transfer import EXPORT_CHUNK_SIZE, export_board
+
+
+class Command(BaseCommand):
+    """
+    Write a board, its members, lists and cards as NDJSON, e.g. for a backup
+    or to move it to another instance with import_board.
+    """
+
+    help = 'Export a board as NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('board_id', type=int)
+        parser.add_argument('--output', '-o', help='File to write, standard output by default.')
+        parser.add_argument('--images', action='store_true', help='Include the cover image files.')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        board = Board.objects.filter(id=options['board_id']).select_related('author').first()
+        if board is None:
+            raise CommandError('Board {} does not exist.'.format(options['board_id']))
+
+        output = open(options['output'], 'w', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for line in export_board(board, images=options['images'], chunk_size=options['chunk_size']):
+                output.write(line)
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,43 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from trello.transfer import IMPORT_BATCH_SIZE, import_board
+
+
+class Command(BaseCommand):
+    """
+    Create a board from an export_board file. Authors and members are
+    matched by email; authors unknown here become --user.
+    """
+
+    help = 'Import a board from NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Export file, '-' for standard input.")
+        parser.add_argument('--user', required=True, help='Username owning what has no known author.')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError('User {} does not exist.'.format(options['user']))
+
+        lines = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        try:
+            importer = import_board(lines, user, options['batch_size'])
+        except (ValueError, KeyError) as error:
+            raise CommandError('Invalid export: {}'.format(error))
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+
+        counts = importer.counts
+        self.stdout.write('Imported board {} with {} lists, {} cards, {} members and {} images.'.format(
+            importer.board.id, counts['list'], counts['card'], counts['member'], counts['image']
+        ))
+        if importer.skipped_members:
+            self.stdout.write('Skipped {} members without an account here: {}.'.format(
+                len(importer.skipped_members), ', '.join(importer.skipped_members)
+            ))
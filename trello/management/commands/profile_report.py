@@ -0,0 +1,50 @@
+import io
+import os
+import pstats
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from trello.profiling import profile_dir, view_of
+
+
+class Command(BaseCommand):
+    """
+    Merge the request profiles written by ProfilingMiddleware by view and
+    print the top functions of each, by cumulative time by default, e.g.
+    to compare the time spent rendering board.html with the time spent
+    building model instances.
+    """
+
+    help = 'Print the hotspots of the profiled requests, by view.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('views', nargs='*', help='URL names to report, all by default.')
+        parser.add_argument('--dir', help='Directory of the .pstats files, settings.PROFILE_DIR by default.')
+        parser.add_argument('--limit', type=int, default=25, help='Functions shown per view.')
+        parser.add_argument('--sort', default='cumulative', help='pstats sort key: cumulative, tottime, ncalls, ...')
+        parser.add_argument('--full-paths', action='store_true', help='Keep the directories in the file names.')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or profile_dir()
+        if not os.path.isdir(directory):
+            raise CommandError('No profiles in {}.'.format(directory))
+
+        files = defaultdict(list)
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith('.pstats'):
+                files[view_of(filename)].append(os.path.join(directory, filename))
+        views = options['views'] or sorted(files)
+
+        for view in views:
+            if not files.get(view):
+                self.stderr.write('No profiles for {}.'.format(view))
+                continue
+            # pstats prints piecemeal, OutputWrapper would end every piece with a newline.
+            output = io.StringIO()
+            stats = pstats.Stats(*files[view], stream=output)
+            if not options['full_paths']:
+                stats.strip_dirs()
+            stats.sort_stats(options['sort']).print_stats(options['limit'])
+            self.stdout.write('== {}: {} requests, {:.3f}s in total'.format(view, len(files[view]), stats.total_tt))
+            self.stdout.write(output.getvalue())
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trello.purge import PURGE_BATCH_SIZE, pending_boards, purge_board
+
+
+class Command(BaseCommand):
+    """
+    Delete the boards marked for deletion, with their lists, cards, members,
+    invites, change log and images.
+
+    Meant to run in the background (cron or --loop). Rows are deleted in
+    batches of --batch-size, each in its own transaction, with --pause
+    seconds between batches so requests get the write lock in between.
+    """
+
+    help = 'Purge the boards pending deletion.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=0.05, metavar='SECONDS')
+        parser.add_argument('--loop', type=int, default=0, metavar='SECONDS',
+                            help='Keep running, checking again every SECONDS.')
+
+    def handle(self, *args, **options):
+        while True:
+            for board_id in pending_boards().values_list('id', flat=True):
+                deleted = 0
+                for deleted in purge_board(board_id, options['batch_size'], options['pause']):
+                    pass
+                self.stdout.write('Purged board {}, {} rows.'.format(board_id, deleted))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trello.activity import touch_board
+from trello.models import List
+from trello.ranking import (
+    REBALANCE_LENGTH,
+    boards_to_rebalance,
+    lists_to_rebalance,
+    rebalance_cards,
+    rebalance_lists,
+)
+
+
+class Command(BaseCommand):
+    """
+    Rewrite the ranks of the lists and boards whose ranks grew too long.
+
+    Meant to run in the background (cron or --loop). Every list or board is
+    rebalanced in its own short transaction, so a busy board is never locked
+    for longer than it takes to rewrite one of its lists.
+    """
+
+    help = 'Rebalance card and list ranks that grew longer than --length.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--length', type=int, default=REBALANCE_LENGTH)
+        parser.add_argument('--loop', type=int, default=0, metavar='SECONDS',
+                            help='Keep running, checking again every SECONDS.')
+
+    def handle(self, *args, **options):
+        while True:
+            self.rebalance(options['length'])
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
+
+    def rebalance(self, length):
+        list_ids = list(lists_to_rebalance(length))
+        for list_id in list_ids:
+            rebalance_cards(list_id)
+
+        board_ids = list(boards_to_rebalance(length))
+        for board_id in board_ids:
+            rebalance_lists(board_id)
+
+        # The ranks are part of the cached board pages and snapshots.
+        touch_board(*board_ids, *List.objects.filter(id__in=list_ids).values_list('board_id', flat=True))
+
+        self.stdout.write('Rebalanced {} lists and {} boards.'.format(len(list_ids), len(board_ids)))
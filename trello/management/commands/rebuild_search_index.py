@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from trello.search import rebuild_index
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the full-text index of the cards, e.g. after changing the
+    tokenizer or restoring cards with raw SQL while the triggers were off.
+    The index is rebuilt in one transaction, searches use the old one
+    until it is done.
+    """
+
+    help = 'Re-index every card for full-text search.'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilt the search index of {} cards.'.format(rebuild_index()))
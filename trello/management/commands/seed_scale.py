@@ -0,0 +1,99 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from trello.models import Board, BoardMembers, Card, List, UserProfile
+from trello.queries import bulk_create_ids
+from trello.ranking import spread_ranks
+
+
+class Command(BaseCommand):
+    """
+    Fill the database with synthetic users, boards, lists, cards and
+    memberships for load tests (see the bench command) and query plan
+    checks. Everything is bulk inserted, one transaction per user.
+
+    Users are named '<prefix><n>' with the password --password, so bench
+    can log in as them. A fixed --seed gives the same data every run.
+    """
+
+    help = 'Bulk generate synthetic data for benchmarks.'
+
+    WORDS = ('fix', 'review', 'deploy', 'login', 'search', 'design', 'customer', 'invoice', 'sprint', 'bug', 'release', 'api')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--boards', type=int, default=4, help='Boards per user.')
+        parser.add_argument('--lists', type=int, default=8, help='Lists per board.')
+        parser.add_argument('--cards', type=int, default=40, help='Cards per list.')
+        parser.add_argument('--members', type=int, default=3, help='Other users joining each board.')
+        parser.add_argument('--archived', type=float, default=0.1, help='Share of archived boards, lists and cards.')
+        parser.add_argument('--prefix', default='bench')
+        parser.add_argument('--password', default='bench')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.archived = options['archived']
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError("Users named '{}*' exist already, use another --prefix.".format(prefix))
+
+        password = make_password(options['password'])
+        User.objects.bulk_create([
+            User(username='{}{}'.format(prefix, n), email='{}{}@example.com'.format(prefix, n), password=password)
+            for n in range(options['users'])
+        ])
+        users = list(User.objects.filter(username__startswith=prefix).order_by('id').values_list('id', flat=True))
+        UserProfile.objects.bulk_create([UserProfile(user_id=pk) for pk in users])
+
+        totals = {'boards': 0, 'lists': 0, 'cards': 0}
+        for user_id in users:
+            with transaction.atomic():
+                counts = self.seed_user(user_id, users, options)
+            for name, count in counts.items():
+                totals[name] += count
+
+        self.stdout.write('Created {} users, {boards} boards, {lists} lists and {cards} cards.'.format(len(users), **totals))
+
+    def is_archived(self):
+        return self.random.random() < self.archived
+
+    def seed_user(self, user_id, users, options):
+        board_ids = bulk_create_ids([
+            Board(author_id=user_id, title='Board {}'.format(n), archived=self.is_archived())
+            for n in range(options['boards'])
+        ], author_id=user_id)
+
+        others = [pk for pk in users if pk != user_id]
+        members = []
+        for board_id in board_ids:
+            members.append(BoardMembers(board_id=board_id, members_id=user_id, owner=True))
+            for member_id in self.random.sample(others, min(options['members'], len(others))):
+                members.append(BoardMembers(board_id=board_id, members_id=member_id, deactivate=False))
+        BoardMembers.objects.bulk_create(members)
+
+        list_ranks = spread_ranks(options['lists'])
+        list_ids = bulk_create_ids([
+            List(board_id=board_id, author_id=user_id, list_title='List {}'.format(n), rank=rank, archived=self.is_archived())
+            for board_id in board_ids
+            for n, rank in enumerate(list_ranks)
+        ], board_id__in=board_ids)
+
+        card_ranks = spread_ranks(options['cards'])
+        cards = [
+            Card(
+                board_list_id=list_id, author_id=user_id, card_title='Card {} {}'.format(list_id, n),
+                card_description=self.description(), rank=rank, archived=self.is_archived(),
+            )
+            for list_id in list_ids
+            for n, rank in enumerate(card_ranks)
+        ]
+        Card.objects.bulk_create(cards)
+        return {'boards': len(board_ids), 'lists': len(list_ids), 'cards': len(cards)}
+
+    def description(self):
+        return ' '.join(self.random.choice(self.WORDS) for n in range(self.random.randint(0, 20)))
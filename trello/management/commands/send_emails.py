@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trello import outbox
+
+
+class Command(BaseCommand):
+    """
+    Deliver the emails waiting in the outbox.
+
+    Meant to run in the background (--loop). Each batch is sent over one
+    SMTP connection; failed emails are retried later with a growing delay.
+    Several workers may run at once, each claims its own batches, see
+    trello/outbox.py
+    """
+
+    help = 'Send the emails queued in the outbox.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE)
+        parser.add_argument('--loop', type=int, default=0, metavar='SECONDS',
+                            help='Keep running, checking again every SECONDS.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = self.drain(options['batch_size'])
+            if sent or failed or not options['loop']:
+                self.stdout.write('Sent {} emails, {} failed.'.format(sent, failed))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
+
+    def drain(self, batch_size):
+        sent = failed = 0
+        while True:
+            batch_sent, batch_failed = outbox.send_batch(batch_size)
+            sent += batch_sent
+            failed += batch_failed
+            if batch_sent + batch_failed < batch_size:
+                return sent, failed
@@ -0,0 +1,49 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    """
+    Refresh the SQLite replicas in settings.REPLICA_DATABASES from the
+    primary with SQLite's online backup API, which copies a consistent
+    snapshot while the primary keeps serving reads and writes.
+
+    Meant to run in the background (--loop) when testing replicas locally;
+    real database servers replicate by themselves.
+    """
+
+    help = 'Copy the SQLite primary database to its replicas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=1024, help='Pages copied per step, 0 for all at once.')
+        parser.add_argument('--loop', type=int, default=0, metavar='SECONDS',
+                            help='Keep running, copying again every SECONDS.')
+
+    def handle(self, *args, **options):
+        aliases = getattr(settings, 'REPLICA_DATABASES', [])
+        if not aliases:
+            raise CommandError('No REPLICA_DATABASES configured.')
+        for alias in [DEFAULT_DB_ALIAS] + aliases:
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError("'{}' is not an SQLite database.".format(alias))
+
+        while True:
+            started = time.time()
+            source = sqlite3.connect(connections[DEFAULT_DB_ALIAS].settings_dict['NAME'])
+            try:
+                for alias in aliases:
+                    target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+                    try:
+                        source.backup(target, pages=options['pages'] or -1)
+                    finally:
+                        target.close()
+            finally:
+                source.close()
+            self.stdout.write('Synced {} replicas in {:.2f}s.'.format(len(aliases), time.time() - started))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
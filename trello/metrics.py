@@ -0,0 +1,333 @@
+"""
+Prometheus metrics, served as text by the /metrics view.
+
+Every process counts into its own file in settings.METRICS_DIR, mapped in
+memory: a list of (key, float) entries appended as new label sets show up
+and updated in place afterwards, so counting costs no syscall. A scrape
+reads the files of all the processes and sums them, so the numbers are
+the same whichever worker answers. Counters and histograms must not go
+back when a worker exits, so a scrape folds the files of the processes
+that are gone into one 'metrics-merged.db' file and deletes them; their
+gauges are dropped. The directory therefore holds a file per running
+process plus the merged one, however often the workers are recycled.
+
+MetricsMiddleware counts the requests and their latency by URL name
+('board', 'add-card', ...), with the queries counted by
+trello.timing.RequestTimingMiddleware, which must come right after it.
+"""
+
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .timing import url_name
+
+
+METRICS = {
+    'trello_http_requests_total': ('counter', 'Requests handled, by URL name, method and status.'),
+    'trello_http_request_duration_seconds': ('histogram', 'Time to respond, by URL name.'),
+    'trello_db_queries_total': ('counter', 'Database queries run by the requests, by URL name.'),
+    'trello_db_query_duration_seconds_total': ('counter', 'Time spent in the database by the requests, by URL name.'),
+    'trello_image_queue_depth': ('gauge', 'Image derivative jobs queued or running.'),
+    'trello_email_outbox_depth': ('gauge', 'Emails waiting in the outbox.'),
+}
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+INITIAL_SIZE = 64 * 1024
+MERGED_FILE = 'metrics-merged.db'
+LOCK_FILE = 'metrics.lock'
+
+_lock = threading.Lock()
+_values = None
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', os.path.join(settings.BASE_DIR, 'metrics'))
+
+
+class MappedValues:
+    """
+    The (key, float) entries of one process, in a file mapped in memory.
+    The first 8 bytes hold the length in use, then each entry is the key
+    length (4 bytes), the key padded to 8 bytes and the value (8 bytes).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size == 0:
+            os.ftruncate(self.fd, INITIAL_SIZE)
+        self.map = mmap.mmap(self.fd, os.fstat(self.fd).st_size)
+        self.used = struct.unpack_from('<Q', self.map, 0)[0] or 8
+        self.offsets = {key: offset for key, value, offset in read_entries(self.map)}
+
+    def offset(self, key):
+        offset = self.offsets.get(key)
+        if offset is None:
+            offset = self.append(key)
+        return offset
+
+    def append(self, key):
+        encoded = key.encode('utf-8')
+        padded = len(encoded) + (-(4 + len(encoded)) % 8)
+        size = 4 + padded + 8
+        if self.used + size > len(self.map):
+            length = len(self.map)
+            while self.used + size > length:
+                length *= 2
+            self.map.close()
+            os.ftruncate(self.fd, length)
+            self.map = mmap.mmap(self.fd, length)
+
+        struct.pack_into('<I{}sd'.format(padded), self.map, self.used, len(encoded), encoded, 0.0)
+        offset = self.used + 4 + padded
+        self.used += size
+        # Readers stop at the length in use, so it is written last.
+        struct.pack_into('<Q', self.map, 0, self.used)
+        self.offsets[key] = offset
+        return offset
+
+    def add(self, key, amount):
+        offset = self.offset(key)
+        value = struct.unpack_from('<d', self.map, offset)[0]
+        struct.pack_into('<d', self.map, offset, value + amount)
+
+    def set(self, key, value):
+        struct.pack_into('<d', self.map, self.offset(key), value)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        os.close(self.fd)
+
+
+def read_entries(data):
+    """
+    Yield the (key, value, value offset) entries of a mapped file.
+    """
+
+    used = struct.unpack_from('<Q', data, 0)[0]
+    position = 8
+    while position < used:
+        length = struct.unpack_from('<I', data, position)[0]
+        padded = length + (-(4 + length) % 8)
+        key = bytes(data[position + 4:position + 4 + length]).decode('utf-8')
+        offset = position + 4 + padded
+        yield key, struct.unpack_from('<d', data, offset)[0], offset
+        position = offset + 8
+
+
+def values():
+    """
+    The file of this process, reopened after a fork.
+    """
+
+    global _values
+    if _values is None or _values[0] != os.getpid():
+        os.makedirs(metrics_dir(), exist_ok=True)
+        pid = os.getpid()
+        _values = (pid, MappedValues(os.path.join(metrics_dir(), 'metrics-{}.db'.format(pid))))
+    return _values[1]
+
+
+def metric_key(name, labels):
+    return json.dumps([name, sorted(labels.items())], separators=(',', ':'))
+
+
+def inc(name, amount=1, **labels):
+    with _lock:
+        values().add(metric_key(name, labels), amount)
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        values().set(metric_key(name, labels), value)
+
+
+def observe(name, value, **labels):
+    """
+    Count 'value' in the histogram 'name'. Buckets are stored one by one
+    and made cumulative when rendered.
+    """
+
+    bound = next((bound for bound in BUCKETS if value <= bound), '+Inf')
+    with _lock:
+        store = values()
+        store.add(metric_key(name + '_bucket', dict(labels, le=str(bound))), 1)
+        store.add(metric_key(name + '_sum', labels), value)
+        store.add(metric_key(name + '_count', labels), 1)
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def is_gauge(name):
+    return METRICS.get(name, ('counter',))[0] == 'gauge'
+
+
+def file_entries(path):
+    """
+    The (key, value) entries of a process file.
+    """
+
+    with open(path, 'rb') as source:
+        if os.fstat(source.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return [(key, value) for key, value, offset in read_entries(data)]
+
+
+def process_files(directory):
+    """
+    Yield the (path, pid) of every process file in 'directory'.
+    """
+
+    for filename in os.listdir(directory):
+        if not (filename.startswith('metrics-') and filename.endswith('.db')):
+            continue
+        try:
+            pid = int(filename[len('metrics-'):-len('.db')])
+        except ValueError:
+            continue
+        yield os.path.join(directory, filename), pid
+
+
+def merge_dead(directory):
+    """
+    Add the counters and histograms of the processes that exited to the
+    merged file and delete their files.
+    """
+
+    merged = None
+    try:
+        for path, pid in process_files(directory):
+            if process_alive(pid):
+                continue
+            if merged is None:
+                merged = MappedValues(os.path.join(directory, MERGED_FILE))
+            for key, value in file_entries(path):
+                if not is_gauge(json.loads(key)[0]):
+                    merged.add(key, value)
+            merged.map.flush()
+            os.unlink(path)
+    finally:
+        if merged is not None:
+            merged.close()
+
+
+def collect():
+    """
+    Sum the entries of every process file. Returns {(name, labels): value}
+    with labels as a tuple of (label, value) pairs.
+    """
+
+    totals = defaultdict(float)
+    directory = metrics_dir()
+    if not os.path.isdir(directory):
+        return totals
+    # One scrape at a time, so no file is merged twice.
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        merge_dead(directory)
+        paths = [path for path, pid in process_files(directory)]
+        if os.path.exists(os.path.join(directory, MERGED_FILE)):
+            paths.append(os.path.join(directory, MERGED_FILE))
+        for path in paths:
+            for key, value in file_entries(path):
+                name, labels = json.loads(key)
+                totals[name, tuple(tuple(label) for label in labels)] += value
+    return totals
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{}="{}"'.format(label, escape(value)) for label, value in labels) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render(extra=None):
+    """
+    The metrics of all the processes in the Prometheus text format.
+    'extra' gauges ({name: value}) are computed by the caller at scrape
+    time, e.g. from the database.
+    """
+
+    totals = collect()
+    for name, value in (extra or {}).items():
+        totals[name, ()] = value
+
+    by_name = defaultdict(dict)
+    for (name, labels), value in totals.items():
+        by_name[name][labels] = value
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        if kind == 'histogram':
+            lines += render_histogram(name, by_name)
+        else:
+            for labels, value in sorted(by_name.get(name, {}).items()):
+                lines.append('{}{} {}'.format(name, format_labels(labels), format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def render_histogram(name, by_name):
+    buckets = defaultdict(dict)
+    for labels, value in by_name.get(name + '_bucket', {}).items():
+        bound = dict(labels)['le']
+        buckets[tuple(label for label in labels if label[0] != 'le')][bound] = value
+
+    lines = []
+    for labels, count in sorted(by_name.get(name + '_count', {}).items()):
+        cumulative = 0
+        for bound in BUCKETS:
+            cumulative += buckets[labels].get(str(bound), 0)
+            lines.append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', str(bound)),)), format_value(cumulative)))
+        lines.append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', '+Inf'),)), format_value(count)))
+        lines.append('{}_sum{} {}'.format(name, format_labels(labels), format_value(by_name[name + '_sum'].get(labels, 0))))
+        lines.append('{}_count{} {}'.format(name, format_labels(labels), format_value(count)))
+    return lines
+
+
+class MetricsMiddleware:
+    """
+    Put it first in MIDDLEWARE, right before RequestTimingMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        view = url_name(request) or 'unmatched'
+        inc('trello_http_requests_total', view=view, method=request.method, status=str(response.status_code))
+        observe('trello_http_request_duration_seconds', elapsed, view=view)
+        stats = getattr(request, 'timing', None)
+        if stats is not None:
+            inc('trello_db_queries_total', stats.queries, view=view)
+            inc('trello_db_query_duration_seconds_total', stats.db_time, view=view)
+        return response
@@ -0,0 +1,82 @@
+# Generated by Django 2.0.13 on 2026-10-18 05:56
+
+from django.db import migrations, models
+from django.db.models import Case, F, Value, When
+
+
+# Copied from trello/ranking.py as it was when this migration was written,
+# so later changes to the app do not change what the migration does.
+DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+BASE = len(DIGITS)
+BATCH_SIZE = 300
+
+
+def encode(value, width):
+    digits = ''
+    for _ in range(width):
+        value, digit = divmod(value, BASE)
+        digits = DIGITS[digit] + digits
+    return digits.rstrip(DIGITS[0])
+
+
+def spread_ranks(count):
+    width = 2
+    while BASE ** width < 2 * (count + 1) * BASE:
+        width += 1
+    step = BASE ** width // (2 * (count + 1))
+    return [encode(position * step, width) for position in range(1, count + 1)]
+
+
+def rank_existing_rows(apps, schema_editor):
+    """
+    Rank existing lists and cards in their current (insertion) order, a
+    batch of rows per UPDATE.
+    """
+
+    List = apps.get_model('trello', 'List')
+    Card = apps.get_model('trello', 'Card')
+
+    for model, parent in ((List, 'board_id'), (Card, 'board_list_id')):
+        siblings = {}
+        for pk, parent_id in model.objects.order_by('id').values_list('id', parent):
+            siblings.setdefault(parent_id, []).append(pk)
+        ranks = {}
+        for ids in siblings.values():
+            ranks.update(zip(ids, spread_ranks(len(ids))))
+
+        ids = sorted(ranks)
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start:start + BATCH_SIZE]
+            whens = [When(id=pk, then=Value(ranks[pk])) for pk in batch]
+            model.objects.filter(id__in=batch).update(
+                rank=Case(*whens, default=F('rank'), output_field=models.CharField())
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello', '0004_auto_20190916_1247'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='rank',
+            field=models.CharField(default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='list',
+            name='rank',
+            field=models.CharField(default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['board_list', 'rank'], name='trello_card_board_l_11c336_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='list',
+            index=models.Index(fields=['board', 'rank'], name='trello_list_board_i_062c2f_idx'),
+        ),
+        migrations.RunPython(rank_existing_rows, migrations.RunPython.noop),
+    ]
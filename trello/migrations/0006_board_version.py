@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 05:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello', '0005_ranks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
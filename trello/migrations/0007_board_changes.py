@@ -0,0 +1,39 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello', '0006_board_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoardChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(max_length=50)),
+                ('data', models.TextField(default='{}')),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('board', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='trello.Board')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BoardSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cursor', models.PositiveIntegerField(default=0)),
+                ('floor', models.PositiveIntegerField(default=0)),
+                ('data', models.TextField(default='{}')),
+                ('created_date', models.DateTimeField(auto_now=True)),
+                ('board', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='trello.Board')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='boardchange',
+            index=models.Index(fields=['board', 'id'], name='trello_boar_board_i_65977e_idx'),
+        ),
+    ]
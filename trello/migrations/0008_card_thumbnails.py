@@ -0,0 +1,23 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello', '0007_board_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='preview',
+            field=models.ImageField(null=True, upload_to='thumbnails/'),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='thumbnail',
+            field=models.ImageField(null=True, upload_to='thumbnails/'),
+        ),
+    ]
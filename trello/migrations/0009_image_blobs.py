@@ -0,0 +1,24 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello', '0008_card_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=200, unique=True)),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('refcount', models.IntegerField(default=0)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
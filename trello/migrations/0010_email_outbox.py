@@ -0,0 +1,33 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:06
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello', '0009_image_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingEmail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('from_email', models.CharField(max_length=254)),
+                ('to_email', models.CharField(max_length=254)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_date', models.DateTimeField(blank=True, null=True)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outgoingemail',
+            index=models.Index(fields=['sent_date', 'next_attempt'], name='trello_outg_sent_da_4eece4_idx'),
+        ),
+    ]
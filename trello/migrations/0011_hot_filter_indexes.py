@@ -0,0 +1,52 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0009_alter_user_last_name_max_length'),
+        ('trello', '0010_email_outbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='boardinvite',
+            name='email_member',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='board',
+            index=models.Index(fields=['author', 'archived', 'created_date'], name='trello_boar_author__607946_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='boardmembers',
+            index=models.Index(fields=['members', 'deactivate'], name='trello_boar_members_f0293c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='boardmembers',
+            index=models.Index(fields=['board', 'deactivate'], name='trello_boar_board_i_89a904_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['board_list', 'archived'], name='trello_card_board_l_e3bee8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['author', 'archived', 'created_date'], name='trello_card_author__b4785e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='list',
+            index=models.Index(fields=['board', 'archived'], name='trello_list_board_i_5e7fe8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='list',
+            index=models.Index(fields=['author', 'archived', 'created_date'], name='trello_list_author__985ab7_idx'),
+        ),
+        # auth.User belongs to Django, index its email from here for the invite lookups.
+        migrations.RunSQL(
+            ['CREATE INDEX IF NOT EXISTS trello_auth_user_email_idx ON auth_user (email)'],
+            ['DROP INDEX IF EXISTS trello_auth_user_email_idx'],
+        ),
+    ]
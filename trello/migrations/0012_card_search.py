@@ -0,0 +1,64 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:12
+
+from django.db import migrations
+
+
+# Copied from trello/search.py as it was when this migration was written,
+# so later changes to the app do not change what the migration does.
+CREATE_SQL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS trello_card_search USING fts5("
+    "card_title, card_description, content='trello_card', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+
+    "CREATE TRIGGER IF NOT EXISTS trello_card_search_insert AFTER INSERT ON trello_card BEGIN "
+    "INSERT INTO trello_card_search (rowid, card_title, card_description) "
+    "VALUES (new.id, new.card_title, new.card_description); END",
+
+    "CREATE TRIGGER IF NOT EXISTS trello_card_search_delete AFTER DELETE ON trello_card BEGIN "
+    "INSERT INTO trello_card_search (trello_card_search, rowid, card_title, card_description) "
+    "VALUES ('delete', old.id, old.card_title, old.card_description); END",
+
+    "CREATE TRIGGER IF NOT EXISTS trello_card_search_update AFTER UPDATE OF card_title, card_description ON trello_card "
+    "WHEN old.card_title IS NOT new.card_title OR old.card_description IS NOT new.card_description BEGIN "
+    "INSERT INTO trello_card_search (trello_card_search, rowid, card_title, card_description) "
+    "VALUES ('delete', old.id, old.card_title, old.card_description); "
+    "INSERT INTO trello_card_search (rowid, card_title, card_description) "
+    "VALUES (new.id, new.card_title, new.card_description); END",
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS trello_card_search_update',
+    'DROP TRIGGER IF EXISTS trello_card_search_delete',
+    'DROP TRIGGER IF EXISTS trello_card_search_insert',
+    'DROP TABLE IF EXISTS trello_card_search',
+]
+
+
+def create_search_index(apps, schema_editor):
+    """
+    FTS5 only exists on SQLite, other databases go without search.
+    """
+
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in CREATE_SQL:
+        schema_editor.execute(statement)
+    schema_editor.execute("INSERT INTO trello_card_search (trello_card_search) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello', '0011_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
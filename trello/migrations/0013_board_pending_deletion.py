@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello', '0012_card_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='deleted_date',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello', '0013_board_pending_deletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='is_template',
+            field=models.BooleanField(default=False),
+        ),
+    ]
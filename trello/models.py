@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.core.cache import cache
 from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth.models import User
@@ -16,6 +17,9 @@ class Card(models.Model):
     'created_date' automatically set everytime a new card is created
     'updated_date automatically set everytime a card is updated
     'archived' is set to True when a user want to archive the card
+    'rank' orders the card inside its list, see trello/ranking.py
+    'thumbnail' and 'preview' are smaller WebP versions of 'image',
+    generated in the background, see trello/images.py
     """
 
     board_list = models.ForeignKey('List', on_delete=models.CASCADE)
@@ -23,10 +27,19 @@ class Card(models.Model):
     card_title = models.CharField(max_length=200)
     card_description = models.TextField(null=True)
     image = models.ImageField(upload_to='images/', null=True)
+    thumbnail = models.ImageField(upload_to='thumbnails/', null=True)
+    preview = models.ImageField(upload_to='thumbnails/', null=True)
     created_date = models.DateTimeField(auto_now_add=True)
     updated_date = models.DateTimeField(auto_now=True)
     archived = models.BooleanField(default=False)
-    
+    rank = models.CharField(max_length=64, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['board_list', 'rank']),
+            models.Index(fields=['board_list', 'archived']),
+            models.Index(fields=['author', 'archived', 'created_date']),
+        ]
 
     def __str__(self):
         return self.card_title
@@ -40,6 +53,7 @@ class List(models.Model):
     'created_date' automatically set everytime a new list is created
     'updated_date automatically set everytime a list is updated
     'archived' is set to True when a user want to archive the list
+    'rank' orders the list inside its board, see trello/ranking.py
     """
 
     board = models.ForeignKey('Board', on_delete=models.CASCADE)
@@ -48,16 +62,39 @@ class List(models.Model):
     created_date = models.DateTimeField(auto_now_add=True)
     updated_date = models.DateTimeField(auto_now=True)
     archived = models.BooleanField(default=False)
+    rank = models.CharField(max_length=64, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['board', 'rank']),
+            models.Index(fields=['board', 'archived']),
+            models.Index(fields=['author', 'archived', 'created_date']),
+        ]
 
     def __str__(self):
         return self.list_title
 
 
+class BoardManager(models.Manager):
+    """
+    Boards not pending deletion.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_date__isnull=True)
+
+
 class Board(models.Model):
     """
     'author' is the user who created the board
     Automatically assign value to 'created_date' when instance is created.
     Automatically update value to 'updated_date' when save method is called.
+    'version' is bumped by every change to the board, its lists, cards or
+    members, see trello/activity.py
+    'deleted_date' is set when the board is deleted; the board is hidden
+    right away ('objects' skips it) and purged later, see trello/purge.py
+    'is_template' boards are listed as templates to start new boards from,
+    see trello/copying.py
     """
 
     author = models.ForeignKey(User, on_delete=models.CASCADE) 
@@ -65,6 +102,17 @@ class Board(models.Model):
     created_date = models.DateTimeField(auto_now_add=True)
     updated_date = models.DateTimeField(auto_now=True, editable=True)
     archived = models.BooleanField(default=False)
+    version = models.PositiveIntegerField(default=0)
+    deleted_date = models.DateTimeField(null=True, blank=True, db_index=True)
+    is_template = models.BooleanField(default=False)
+
+    objects = BoardManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['author', 'archived', 'created_date']),
+        ]
 
     def __str__(self):
         return self.title
@@ -83,6 +131,12 @@ class BoardMembers(models.Model):
     deactivate = models.BooleanField(default=True)
     owner = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['members', 'deactivate']),
+            models.Index(fields=['board', 'deactivate']),
+        ]
+
 
 class BoardInvite(models.Model):
     """
@@ -90,7 +144,77 @@ class BoardInvite(models.Model):
     """
 
     board = models.ForeignKey('Board', on_delete=models.CASCADE)
-    email_member = models.CharField(max_length=200)
+    email_member = models.CharField(max_length=200, db_index=True)
+
+
+class BoardChange(models.Model):
+    """
+    Append-only log of the changes made to a board.
+    'id' is the cursor clients pass back to fetch only newer changes.
+    'event' and 'data' are the event published to the board's streams,
+    'data' being JSON.
+    """
+
+    board = models.ForeignKey('Board', on_delete=models.CASCADE)
+    event = models.CharField(max_length=50)
+    data = models.TextField(default='{}')
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['board', 'id']),
+        ]
+
+
+class BoardSnapshot(models.Model):
+    """
+    Compacted state of a board, written when old changes are pruned.
+    'cursor' is the last change included in 'data'.
+    'floor' is the last pruned change, clients behind it need 'data'.
+    """
+
+    board = models.OneToOneField('Board', on_delete=models.CASCADE)
+    cursor = models.PositiveIntegerField(default=0)
+    floor = models.PositiveIntegerField(default=0)
+    data = models.TextField(default='{}')
+    created_date = models.DateTimeField(auto_now=True)
+
+
+class ImageBlob(models.Model):
+    """
+    An uploaded image, stored once under the hash of its content.
+    'name' is its storage name, used as 'Card.image'.
+    'refcount' is the number of cards using it, see trello/blobs.py
+    """
+
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=200, unique=True)
+    size = models.PositiveIntegerField(default=0)
+    refcount = models.IntegerField(default=0)
+    created_date = models.DateTimeField(auto_now_add=True)
+
+
+class OutgoingEmail(models.Model):
+    """
+    Email waiting in the outbox, sent by the 'send_emails' worker.
+    'next_attempt' is when the worker may try it (again); 'attempts' and
+    'last_error' record the failed tries. 'sent_date' is set once sent.
+    """
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to_email = models.CharField(max_length=254)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    sent_date = models.DateTimeField(null=True, blank=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sent_date', 'next_attempt']),
+        ]
 
 
 class UserProfile(models.Model):
@@ -112,4 +236,35 @@ def create_user_profile(sender, instance, created, **kwargs):
     if created:
         user_profile = UserProfile.objects.create(user=instance)
 
-post_save.connect(create_user_profile, sender=User)
\ No newline at end of file
+post_save.connect(create_user_profile, sender=User)
+
+def dashboard_cache_key(user_id):
+    return 'dashboard:{}'.format(user_id)
+
+
+def invalidate_dashboards(*user_ids):
+    """
+    Drop the cached dashboards of the users once the current transaction
+    commits, so no other request caches the old rows in the meantime.
+    """
+
+    keys = [dashboard_cache_key(user_id) for user_id in set(user_ids)]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def board_changed(sender, instance, **kwargs):
+    """
+    A board is listed on the dashboard of its author and of its members.
+    """
+
+    member_ids = BoardMembers.objects.filter(board_id=instance.id).values_list('members_id', flat=True)
+    invalidate_dashboards(instance.author_id, *member_ids)
+
+
+def membership_changed(sender, instance, **kwargs):
+    invalidate_dashboards(instance.members_id)
+
+post_save.connect(board_changed, sender=Board)
+post_delete.connect(board_changed, sender=Board)
+post_save.connect(membership_changed, sender=BoardMembers)
+post_delete.connect(membership_changed, sender=BoardMembers)
@@ -0,0 +1,128 @@
+"""
+Database backed outbox for the emails the app sends.
+
+Views only insert rows, so a slow or unreachable SMTP host never holds a
+request. The 'send_emails' worker drains the outbox in batches, reusing one
+SMTP connection per batch, and reschedules failed messages with an
+exponential backoff until MAX_ATTEMPTS is reached.
+
+Several workers can run at once: a batch is claimed by moving its
+'next_attempt' LEASE seconds ahead before anything is sent, so other
+workers skip it, and each email is marked sent as soon as it went out.
+Emails of a worker that died mid batch are picked up again once the lease
+expires; only the one being sent at that moment can go out twice.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 8
+BACKOFF = 30
+MAX_BACKOFF = 60 * 60
+LEASE = 10 * 60
+
+
+def enqueue(subject, body, to_email, from_email=None):
+    """
+    Add one email to the outbox.
+    """
+
+    return enqueue_many([(subject, body, to_email)], from_email)[0]
+
+
+def enqueue_many(messages, from_email=None):
+    """
+    Add (subject, body, to_email) messages to the outbox with one INSERT.
+    """
+
+    from_email = from_email or settings.EMAIL_HOST_USER
+    return OutgoingEmail.objects.bulk_create([
+        OutgoingEmail(subject=subject, body=body, from_email=from_email, to_email=to_email)
+        for subject, body, to_email in messages
+    ])
+
+
+def unsent():
+    return OutgoingEmail.objects.filter(sent_date__isnull=True, attempts__lt=MAX_ATTEMPTS)
+
+
+def pending():
+    """
+    Number of emails still to be sent, including those waiting for a retry.
+    """
+
+    return unsent().count()
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF))
+
+
+def claim(batch_size=BATCH_SIZE):
+    """
+    Lease the oldest emails that are due to the calling worker and return
+    them. An email already claimed by another worker is not due any more.
+    """
+
+    now = timezone.now()
+    lease = now + timedelta(seconds=LEASE)
+    with transaction.atomic():
+        due = unsent().filter(next_attempt__lte=now)
+        ids = list(due.order_by('next_attempt', 'id').values_list('id', flat=True)[:batch_size])
+        due.filter(id__in=ids).update(next_attempt=lease)
+        return list(unsent().filter(id__in=ids, next_attempt=lease).order_by('id'))
+
+
+def send_batch(batch_size=BATCH_SIZE, connection=None):
+    """
+    Send the emails that are due, oldest first, over a single connection.
+    Returns the number of (sent, failed) emails.
+    """
+
+    batch = claim(batch_size)
+    if not batch:
+        return 0, 0
+
+    connection = connection or get_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        # The host is unreachable: none of the batch can go out.
+        for email in batch:
+            reschedule(email, error)
+        return 0, len(batch)
+
+    sent = failed = 0
+    try:
+        for email in batch:
+            message = EmailMessage(email.subject, email.body, email.from_email, [email.to_email], connection=connection)
+            try:
+                connection.send_messages([message])
+            except Exception as error:
+                failed += 1
+                reschedule(email, error)
+            else:
+                sent += 1
+                OutgoingEmail.objects.filter(id=email.id).update(sent_date=timezone.now())
+    finally:
+        connection.close()
+
+    return sent, failed
+
+
+def reschedule(email, error):
+    attempts = email.attempts + 1
+    OutgoingEmail.objects.filter(id=email.id).update(
+        attempts=F('attempts') + 1,
+        last_error=str(error)[:1000],
+        next_attempt=timezone.now() + backoff(attempts),
+    )
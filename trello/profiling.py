@@ -0,0 +1,78 @@
+"""
+On demand cProfile capture of requests made by staff users.
+
+ProfilingMiddleware profiles a staff request when it has the header
+'X-Profile: 1', or at random with the probability
+settings.PROFILE_SAMPLE_RATE (0 by default). It covers everything after
+it in MIDDLEWARE: the view, the ORM and the template rendering. Each
+profile is written to settings.PROFILE_DIR as
+'<url name>.<timestamp>-<pid>-<random>.pstats', its name returned in the
+'X-Profile-File' header; 'manage.py profile_report' merges them by view.
+"""
+
+import cProfile
+import os
+import random
+import time
+
+from django.conf import settings
+
+from .timing import url_name
+
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+
+def profile_dir():
+    return getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+def profile_name(view):
+    return '{}.{}-{}-{:04x}.pstats'.format(view, int(time.time() * 1000), os.getpid(), random.getrandbits(16))
+
+
+def view_of(filename):
+    """
+    The URL name a profile file was written for.
+    """
+
+    return filename.split('.', 1)[0]
+
+
+def wants_profile(request):
+    """
+    request.user is lazy, reading it loads the session and the user, so it
+    is only looked at once the header or the sampling asked for a profile.
+    """
+
+    rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+    if request.META.get(PROFILE_HEADER) != '1' and not (rate > 0 and random.random() < rate):
+        return False
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_staff
+
+
+class ProfilingMiddleware:
+    """
+    Put it right after AuthenticationMiddleware, it needs request.user.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not wants_profile(request):
+            return self.get_response(request)
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.disable()
+
+        os.makedirs(profile_dir(), exist_ok=True)
+        name = profile_name(url_name(request) or 'unmatched')
+        profile.dump_stats(os.path.join(profile_dir(), name))
+        response['X-Profile-File'] = name
+        return response
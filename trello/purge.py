@@ -0,0 +1,124 @@
+"""
+Deleting boards in the background.
+
+Deleting a board in the request made Django's collector load every list,
+card, membership and invite of the board to cascade, holding SQLite's
+write lock for minutes on the biggest boards. DeleteBoardView now only
+sets 'Board.deleted_date', which hides the board at once, and the
+'purge_boards' worker deletes the rows afterwards: children first, a
+bounded batch per transaction, so other requests get the write lock
+between batches. Images of the purged cards are released and deleted
+once nothing references them any more.
+
+The views find lists and cards through queries.live_lists() and
+live_cards(), so nothing is written to a board waiting to be purged.
+"""
+
+import time
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .activity import notify
+from .blobs import delete_images, referenced_images, release
+from .models import (
+    Board,
+    BoardChange,
+    BoardInvite,
+    BoardMembers,
+    BoardSnapshot,
+    Card,
+    List,
+    invalidate_dashboards,
+)
+
+
+PURGE_BATCH_SIZE = 500
+
+
+def mark_deleted(board):
+    """
+    Hide the board until the purge worker deletes it.
+    """
+
+    with transaction.atomic():
+        # Before the board is hidden: notify() bumps the version through
+        # Board.objects, which no longer sees deleted boards.
+        notify(board.id, 'board.deleted')
+        Board.objects.filter(id=board.id).update(deleted_date=timezone.now())
+        members = BoardMembers.objects.filter(board_id=board.id).values_list('members_id', flat=True)
+        invalidate_dashboards(board.author_id, *members)
+
+
+def pending_boards():
+    return Board.all_objects.filter(deleted_date__isnull=False).order_by('deleted_date', 'id')
+
+
+def delete_batch(table, where, params, batch_size):
+    """
+    Delete at most 'batch_size' rows of 'table' matching 'where' in their own
+    transaction. Returns the number of rows deleted.
+    """
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE {where} LIMIT %s)'.format(table=table, where=where),
+            params + [batch_size],
+        )
+        return cursor.rowcount
+
+
+def purge_cards(board_id, batch_size):
+    """
+    Delete the cards of the board a batch at a time, releasing their images.
+    """
+
+    card_table = Card._meta.db_table
+    list_table = List._meta.db_table
+    deleted = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT c.id, c.image FROM {card} c JOIN {list} l ON l.id = c.board_list_id '
+                'WHERE l.board_id = %s LIMIT %s'.format(card=card_table, list=list_table),
+                [board_id, batch_size],
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                return deleted
+            images = [image for pk, image in rows if image]
+            release(*images)
+            cursor.execute(
+                'DELETE FROM {card} WHERE id IN ({ids})'.format(card=card_table, ids=', '.join(['%s'] * len(rows))),
+                [pk for pk, image in rows],
+            )
+        deleted += len(rows)
+
+        unused = set(images) - referenced_images(images)
+        delete_images(sorted(unused))
+        yield deleted
+
+
+def purge_board(board_id, batch_size=PURGE_BATCH_SIZE, pause=0):
+    """
+    Delete a board marked for deletion and everything on it. Yields the
+    number of rows deleted so far after every batch; 'pause' seconds are
+    slept between batches to leave room to other writers.
+    """
+
+    deleted = 0
+    for deleted in purge_cards(board_id, batch_size):
+        yield deleted
+        time.sleep(pause)
+
+    for model in (List, BoardMembers, BoardInvite, BoardChange, BoardSnapshot):
+        while True:
+            count = delete_batch(model._meta.db_table, 'board_id = %s', [board_id], batch_size)
+            if not count:
+                break
+            deleted += count
+            yield deleted
+            time.sleep(pause)
+
+    Board.all_objects.filter(id=board_id, deleted_date__isnull=False).delete()
+    yield deleted + 1
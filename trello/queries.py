@@ -0,0 +1,263 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from .models import Board, BoardMembers, Card, List, dashboard_cache_key
+
+
+DASHBOARD_TIMEOUT = 60 * 60
+
+
+@contextmanager
+def read_transaction(using=None):
+    """
+    A transaction for reads that must see one consistent state of the
+    database. Our SQLite backend starts transactions with BEGIN IMMEDIATE,
+    which takes the write lock; this one starts with a plain BEGIN, so
+    polling readers never queue behind writers or block them.
+    """
+
+    connection = transaction.get_connection(using)
+    connection.begin_deferred = True
+    try:
+        with transaction.atomic(using=using):
+            connection.begin_deferred = False
+            yield
+    finally:
+        connection.begin_deferred = False
+
+
+def visible_cards():
+    """
+    Non archived cards in the order they are displayed in a list.
+    """
+
+    return Card.objects.filter(archived=False).order_by('rank', 'id')
+
+
+def visible_lists():
+    """
+    Non archived lists in the order they are displayed in a board.
+    """
+
+    return List.objects.filter(archived=False).order_by('rank', 'id')
+
+
+def live_lists():
+    """
+    Lists of the boards not marked for deletion. Writes look lists up here,
+    so nothing is added to a board the purge worker is deleting.
+    """
+
+    return List.objects.filter(board__deleted_date__isnull=True)
+
+
+def live_cards():
+    """
+    Cards of the boards not marked for deletion, see live_lists().
+    """
+
+    return Card.objects.filter(board_list__board__deleted_date__isnull=True)
+
+
+def active_members(board):
+    """
+    Active members of the board joined with their user row, so reading
+    'member.members.username' does not hit the database again.
+    """
+
+    return BoardMembers.objects.filter(board=board, deactivate=False).select_related('members').order_by('id')
+
+
+def load_board(board_id):
+    """
+    The board and its active members, in two queries. The lists and cards
+    are rendered from the fragment cache, which loads them only when the
+    board changed (see trello/fragments.py).
+    """
+
+    board = get_object_or_404(Board, id=board_id)
+    board_members = list(active_members(board))
+    return board, board_members
+
+
+def load_dashboard(user):
+    """
+    Boards listed on the user's dashboard as plain dicts: 'board' are the
+    boards the user made, 'templates' the templates among them and
+    'invited_boards' the boards the user joined. Built with two queries and
+    cached per user; the signals in models.py drop the cached copy whenever
+    a board or membership changes.
+    """
+
+    key = dashboard_cache_key(user.id)
+    dashboard = cache.get(key)
+    if dashboard is None:
+        boards = Board.objects.filter(author=user, archived=False).order_by('id').values_list('id', 'title', 'is_template')
+        invited = BoardMembers.objects.filter(members=user, deactivate=False, owner=False, board__deleted_date__isnull=True).order_by('id').values_list(
+            'board_id', 'board__title'
+        )
+        boards = list(boards)
+        dashboard = {
+            'board': [{'id': pk, 'title': title} for pk, title, is_template in boards if not is_template],
+            'templates': [{'id': pk, 'title': title} for pk, title, is_template in boards if is_template],
+            'invited_boards': [{'id': pk, 'title': title} for pk, title in invited],
+        }
+        cache.set(key, dashboard, DASHBOARD_TIMEOUT)
+    return dashboard
+
+
+MAX_ID = 2 ** 63 - 1
+
+
+def parse_id(value):
+    """
+    Row id sent by a client. Raises ValueError unless it is a positive
+    integer that fits SQLite's 64 bit INTEGER, bigger ones would make the
+    query itself fail with an OverflowError.
+    """
+
+    pk = int(value)
+    if not 0 < pk <= MAX_ID:
+        raise ValueError('Id out of range: {}'.format(value))
+    return pk
+
+
+ARCHIVE_PAGE_SIZE = 50
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_cursor(created_date, pk):
+    microseconds = (created_date - EPOCH) // timedelta(microseconds=1)
+    return '{}-{}'.format(microseconds, pk)
+
+
+def decode_cursor(cursor):
+    """
+    Inverse of encode_cursor, raises ValueError on a malformed cursor.
+    """
+
+    microseconds, pk = cursor.split('-')
+    pk = int(pk)
+    try:
+        created_date = EPOCH + timedelta(microseconds=int(microseconds))
+    except OverflowError:
+        created_date = None
+    if created_date is None or not 0 <= pk < 2 ** 63:
+        raise ValueError('Cursor out of range: {}'.format(cursor))
+    return created_date, pk
+
+
+def keyset_page(queryset, after=None, limit=ARCHIVE_PAGE_SIZE):
+    """
+    One page of 'queryset' (values rows with 'id' and 'created_date')
+    ordered by (created_date, id), starting after the 'after' cursor.
+
+    The page is found by seeking the (author, archived, created_date)
+    index to the cursor instead of skipping rows with OFFSET, so the last
+    page costs as much as the first. Returns the rows and the cursor of
+    the next page, None on the last page.
+    """
+
+    queryset = queryset.order_by('created_date', 'id')
+    if after:
+        created_date, pk = decode_cursor(after)
+        queryset = queryset.filter(
+            Q(created_date__gt=created_date) | Q(created_date=created_date, id__gt=pk),
+            created_date__gte=created_date,
+        )
+
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1]['created_date'], rows[-1]['id'])
+
+
+def board_snapshot(board):
+    """
+    Plain data version of what load_board returns, built from values()
+    rows so no model instances are created. 'board' is a dict with at
+    least 'id', 'title' and 'version'.
+    """
+
+    image_storage = Card._meta.get_field('image').storage
+    lists = visible_lists().filter(board_id=board['id']).values_list('id', 'list_title', 'rank')
+    cards = visible_cards().filter(board_list__board_id=board['id'], board_list__archived=False).values_list(
+        'id', 'board_list_id', 'card_title', 'rank', 'image', 'thumbnail'
+    )
+    members = active_members(board['id']).values_list('members_id', 'members__username', 'members__email', 'owner')
+
+    return {
+        'id': board['id'],
+        'title': board['title'],
+        'version': board['version'],
+        'lists': [
+            {'id': pk, 'title': title, 'rank': rank}
+            for pk, title, rank in lists
+        ],
+        'cards': [
+            {
+                'id': pk, 'list': list_id, 'title': title, 'rank': rank,
+                'image': image_storage.url(image) if image else None,
+                'thumbnail': image_storage.url(thumbnail) if thumbnail else None,
+            }
+            for pk, list_id, title, rank, image, thumbnail in cards
+        ],
+        'members': [
+            {'id': pk, 'username': username, 'email': email, 'owner': owner}
+            for pk, username, email, owner in members
+        ],
+    }
+
+
+def bulk_create_ids(objects, **scope):
+    """
+    bulk_create 'objects' (all of one model) and return their new ids in
+    order. SQLite does not return the ids of bulk inserted rows, so they
+    are read back: 'scope' must select rows only the current transaction
+    adds to, e.g. the lists of a board being created.
+    """
+
+    if not objects:
+        return []
+    model = type(objects[0])
+    with transaction.atomic():
+        last_id = model.objects.filter(**scope).order_by('-id').values_list('id', flat=True).first() or 0
+        model.objects.bulk_create(objects)
+        return list(model.objects.filter(id__gt=last_id, **scope).order_by('id').values_list('id', flat=True))
+
+
+UPDATE_BATCH_SIZE = 300
+
+
+def update_in_bulk(queryset, values, **fields):
+    """
+    Write a different value per row with a few UPDATE statements instead of
+    one save() per object.
+
+    'values' maps a field name to a dict of {id: value}. Rows are updated in
+    batches of UPDATE_BATCH_SIZE ids, each with a CASE expression per field,
+    so SQLite's limit on query parameters is never reached. Extra keyword
+    arguments are applied to every updated row as is.
+    Returns the number of updated rows.
+    """
+
+    ids = sorted(set().union(*[per_id.keys() for per_id in values.values()])) if values else []
+    updated = 0
+
+    for start in range(0, len(ids), UPDATE_BATCH_SIZE):
+        batch = ids[start:start + UPDATE_BATCH_SIZE]
+        updates = dict(fields)
+        for name, per_id in values.items():
+            field = queryset.model._meta.get_field(name)
+            output_field = field.target_field if field.is_relation else field
+            whens = [When(id=pk, then=Value(per_id[pk])) for pk in batch if pk in per_id]
+            updates[name] = Case(*whens, default=F(field.attname), output_field=output_field)
+        updated += queryset.filter(id__in=batch).update(**updates)
+    return updated
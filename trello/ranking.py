@@ -0,0 +1,254 @@
+"""
+Lexicographic fractional ranks used to order cards inside a list and lists
+inside a board.
+
+A rank is a string of base 62 digits. Ranks compare with plain string
+comparison, which is what SQLite does for an ORDER BY on a text column, so
+a card can be moved between two neighbours by writing a single row with a
+rank that sorts between theirs. Ranks never end with the lowest digit, so
+there is always room for another rank in front of any existing one.
+
+Repeated moves into the same gap make ranks longer. 'rebalance_cards' and
+'rebalance_lists' rewrite a whole list or board with short, evenly spaced
+ranks; the 'rebalance_ranks' command runs them for every list or board
+whose ranks grew past REBALANCE_LENGTH. A move that would need a rank
+longer than MAX_LENGTH, the size of the rank columns, rebalances its list
+or board right away.
+"""
+
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Length
+
+from .models import Card, List
+from .queries import update_in_bulk
+
+
+DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+BASE = len(DIGITS)
+MAX_LENGTH = 64
+REBALANCE_LENGTH = 24
+
+
+def encode(value, width):
+    digits = ''
+    for _ in range(width):
+        value, digit = divmod(value, BASE)
+        digits = DIGITS[digit] + digits
+    return digits.rstrip(DIGITS[0])
+
+
+def decode(rank, width):
+    value = 0
+    for digit in rank.ljust(width, DIGITS[0])[:width]:
+        value = value * BASE + DIGITS.index(digit)
+    return value
+
+
+def rank_after(before=None):
+    """
+    Return the next rank after 'before', counting up at a width of at least
+    two digits. Appending to the end of a list is the common case, and
+    counting keeps those ranks short where bisecting the open end would add
+    a digit every few cards.
+    """
+
+    before = before or ''
+    width = max(len(before), 2)
+    while decode(before, width) + 1 >= BASE ** width:
+        width += 1
+    return encode(decode(before, width) + 1, width)
+
+
+def rank_between(before=None, after=None):
+    """
+    Return a rank that sorts after 'before' and before 'after'.
+    Either side can be None (or blank) to mean the start or the end.
+    """
+
+    before = before or ''
+    after = after or None
+
+    if after is None:
+        return rank_after(before)
+    if before >= after:
+        raise ValueError('Rank {!r} must sort before {!r}.'.format(before, after))
+
+    rank = ''
+    i = 0
+    while True:
+        low = DIGITS.index(before[i]) if i < len(before) else 0
+        high = DIGITS.index(after[i]) if after is not None and i < len(after) else BASE
+
+        if high - low > 1:
+            return rank + DIGITS[(low + high) // 2]
+
+        rank += DIGITS[low]
+        if high - low == 1:
+            # The prefix is now strictly below 'after', whatever follows.
+            after = None
+        i += 1
+
+
+def ranks_between(before=None, after=None, count=1):
+    """
+    Return 'count' ascending ranks between 'before' and 'after', spread by
+    bisecting the gap so the ranks stay as short as possible. At the end of
+    a list the ranks simply count up from 'before'.
+    """
+
+    if count <= 0:
+        return []
+    if not after:
+        ranks = []
+        for _ in range(count):
+            before = rank_after(before)
+            ranks.append(before)
+        return ranks
+    middle = rank_between(before, after)
+    left = count // 2
+    return ranks_between(before, middle, left) + [middle] + ranks_between(middle, after, count - left - 1)
+
+
+def spread_ranks(count):
+    """
+    Return 'count' ascending ranks of equal length, evenly spaced over the
+    lower half of the key space so there is room left for appending. Used
+    when (re)numbering a complete list or board.
+    """
+
+    width = 2
+    while BASE ** width < 2 * (count + 1) * BASE:
+        width += 1
+    step = BASE ** width // (2 * (count + 1))
+    return [encode(position * step, width) for position in range(1, count + 1)]
+
+
+def next_card_rank(board_list_id):
+    """
+    Rank that puts a new card at the bottom of the list.
+    """
+
+    last = Card.objects.filter(board_list_id=board_list_id).aggregate(rank=Max('rank'))['rank']
+    return rank_between(last, None)
+
+
+def next_list_rank(board_id):
+    """
+    Rank that puts a new list at the end of the board.
+    """
+
+    last = List.objects.filter(board_id=board_id).aggregate(rank=Max('rank'))['rank']
+    return rank_between(last, None)
+
+
+def neighbour_rank(queryset, before_id=None, after_id=None):
+    """
+    Rank for an object dropped between the rows 'before_id' and 'after_id'
+    of 'queryset'. Ids that are missing from the queryset are ignored.
+    Returns None when the neighbours are out of order, which happens when
+    ranks collide, or when the rank would be longer than MAX_LENGTH; the
+    siblings need a rebalance first.
+    """
+
+    ids = [pk for pk in (before_id, after_id) if pk]
+    ranks = dict(queryset.filter(id__in=ids).values_list('id', 'rank')) if ids else {}
+    before = ranks.get(int(before_id)) if before_id else None
+    after = ranks.get(int(after_id)) if after_id else None
+
+    if '' in (before, after):
+        # Rows created before ranks existed, they need a rebalance.
+        return None
+    if before is None and after is None:
+        before = queryset.aggregate(rank=Max('rank'))['rank']
+    try:
+        rank = rank_between(before, after)
+    except ValueError:
+        return None
+    return rank if len(rank) <= MAX_LENGTH else None
+
+
+def rebalance_cards(board_list_id):
+    """
+    Give every card of the list a short, evenly spaced rank, keeping the
+    current order.
+    """
+
+    with transaction.atomic():
+        ids = list(Card.objects.filter(board_list_id=board_list_id).order_by('rank', 'id').values_list('id', flat=True))
+        update_in_bulk(Card.objects.all(), {'rank': dict(zip(ids, spread_ranks(len(ids))))})
+
+
+def rebalance_lists(board_id):
+    """
+    Give every list of the board a short, evenly spaced rank, keeping the
+    current order.
+    """
+
+    with transaction.atomic():
+        ids = list(List.objects.filter(board_id=board_id).order_by('rank', 'id').values_list('id', flat=True))
+        update_in_bulk(List.objects.all(), {'rank': dict(zip(ids, spread_ranks(len(ids))))})
+
+
+def lists_to_rebalance(length=REBALANCE_LENGTH):
+    """
+    Ids of the lists holding a card whose rank is longer than 'length'.
+    """
+
+    return Card.objects.annotate(rank_length=Length('rank')).filter(rank_length__gt=length).values_list('board_list_id', flat=True).distinct()
+
+
+def boards_to_rebalance(length=REBALANCE_LENGTH):
+    """
+    Ids of the boards holding a list whose rank is longer than 'length'.
+    """
+
+    return List.objects.annotate(rank_length=Length('rank')).filter(rank_length__gt=length).values_list('board_id', flat=True).distinct()
+
+
+def plan_moves(siblings, moves):
+    """
+    Work out the new rank of every moved card in a batch move.
+
+    'siblings' maps a list id to the ordered ranks of the cards that stay
+    in that list. 'moves' is a list of (card_id, list_id, position) where
+    position is the index the card should end up at in its target list,
+    or None for the bottom. Consecutive moved cards get ranks spread inside
+    the gap between their kept neighbours.
+
+    Returns {card_id: rank}. Raises ValueError when two neighbouring ranks
+    collide or a rank would be longer than MAX_LENGTH, the list needs a
+    rebalance first.
+    """
+
+    by_list = {}
+    for index, (card_id, list_id, position) in enumerate(moves):
+        by_list.setdefault(list_id, []).append((position, index, card_id))
+
+    planned = {}
+    for list_id, dropped in by_list.items():
+        ranks = siblings.get(list_id, [])
+        if '' in ranks:
+            raise ValueError('List {} has unranked cards.'.format(list_id))
+
+        sequence = [(rank, None) for rank in ranks]
+        at_bottom = [card_id for position, index, card_id in dropped if position is None]
+        placed = sorted((position, index, card_id) for position, index, card_id in dropped if position is not None)
+        for position, index, card_id in placed:
+            sequence.insert(max(0, min(position, len(sequence))), (None, card_id))
+        sequence.extend((None, card_id) for card_id in at_bottom)
+
+        before = None
+        run = []
+        for rank, card_id in sequence + [(None, None)]:
+            if card_id is not None:
+                run.append(card_id)
+                continue
+            if run:
+                run_ranks = ranks_between(before, rank, len(run))
+                if any(len(run_rank) > MAX_LENGTH for run_rank in run_ranks):
+                    raise ValueError('List {} needs a rebalance.'.format(list_id))
+                planned.update(zip(run, run_ranks))
+                run = []
+            before = rank
+    return planned
@@ -0,0 +1,91 @@
+"""
+Reads of the read-only pages from the replica databases.
+
+ReplicaMiddleware lets the GET requests of the views named in
+settings.REPLICA_URL_NAMES (the dashboard, board, archive and card pages
+and the board snapshot and changes endpoints) read from one of the
+databases in settings.REPLICA_DATABASES, picked at random per request.
+Every other request, and every write, uses 'default', the primary.
+
+Replicas lag behind the primary, so a browser that just wrote would not
+see its own change. Any request writing to the primary sets a cookie
+that keeps the browser's requests on the primary for
+settings.REPLICA_STICKY_SECONDS.
+
+Without REPLICA_DATABASES everything uses the primary. With SQLite, the
+replicas are copies of the database file refreshed by 'manage.py
+sync_replicas'.
+"""
+
+import random
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+STICKY_COOKIE = 'primary_db'
+STICKY_SECONDS = 5
+
+_state = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'REPLICA_DATABASES', [])
+
+
+class ReplicaRouter:
+    """
+    Send the reads to the replica picked for the current request, if any,
+    and everything else to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        replica = getattr(_state, 'replica', None)
+        if replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    """
+    Needs request.resolver_match, so the replica is picked in process_view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.replica = None
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+            wrote = _state.wrote
+        finally:
+            _state.replica = None
+            _state.wrote = False
+
+        if wrote:
+            seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', STICKY_SECONDS)
+            response.set_cookie(STICKY_COOKIE, '1', max_age=seconds, httponly=True)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            replicas()
+            and request.method in ('GET', 'HEAD')
+            and STICKY_COOKIE not in request.COOKIES
+            and request.resolver_match.url_name in getattr(settings, 'REPLICA_URL_NAMES', ())
+        ):
+            _state.replica = random.choice(replicas())
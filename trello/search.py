@@ -0,0 +1,102 @@
+"""
+Full-text search over card titles and descriptions with SQLite FTS5.
+
+'trello_card_search' is an external content FTS5 table: it stores only the
+index, the text itself stays in trello_card. Triggers on trello_card keep
+the index in sync with every insert, delete and title or description
+change, whether made by save(), update() or raw SQL. Searches are ranked
+with bm25, title matches weighing more than description matches, and
+limited to the boards the user can open.
+
+The table and its triggers are created by migration 0012_card_search.
+"""
+
+import re
+
+from django.db import connection, transaction
+
+
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+RESULTS = 20
+
+SEARCH_SQL = """
+    SELECT c.id, c.card_title, c.archived, l.id, l.list_title, b.id, b.title,
+           snippet(trello_card_search, -1, '[', ']', '...', 12)
+    FROM trello_card_search
+    JOIN trello_card c ON c.id = trello_card_search.rowid
+    JOIN trello_list l ON l.id = c.board_list_id
+    JOIN trello_board b ON b.id = l.board_id
+    WHERE trello_card_search MATCH %s
+      AND b.deleted_date IS NULL
+      AND (b.author_id = %s OR b.id IN (
+          SELECT board_id FROM trello_boardmembers WHERE members_id = %s AND deactivate = 0
+      ))
+      {archived}
+    ORDER BY bm25(trello_card_search, {title_weight}, {description_weight})
+    LIMIT %s
+"""
+
+
+def match_expression(text):
+    """
+    FTS5 query matching cards containing every word of 'text', the last
+    word as a prefix so results show up while typing. Words are quoted, so
+    FTS5 operators typed by users are searched as plain words.
+    """
+
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = ['"{}"'.format(word) for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_cards(user, text, include_archived=False, limit=RESULTS):
+    """
+    Cards of the boards the user made or joined that match 'text', best
+    match first.
+    """
+
+    expression = match_expression(text)
+    if expression is None:
+        return []
+
+    sql = SEARCH_SQL.format(
+        archived='' if include_archived else 'AND c.archived = 0 AND l.archived = 0 AND b.archived = 0',
+        title_weight=TITLE_WEIGHT,
+        description_weight=DESCRIPTION_WEIGHT,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [expression, user.id, user.id, limit])
+        rows = cursor.fetchall()
+
+    return [
+        {
+            'id': card_id, 'title': title, 'archived': bool(archived),
+            'list': list_id, 'list_title': list_title,
+            'board': board_id, 'board_title': board_title,
+            'snippet': snippet,
+        }
+        for card_id, title, archived, list_id, list_title, board_id, board_title, snippet in rows
+    ]
+
+
+def rebuild_index():
+    """
+    Re-index every card with FTS5's 'rebuild' command, which reads the
+    whole of trello_card, in one write transaction: the triggers of other
+    writers wait for it, so no edit is lost, and searches keep reading the
+    old index (WAL) until the new one is committed. Returns the number of
+    cards indexed.
+    """
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("INSERT INTO trello_card_search (trello_card_search) VALUES ('rebuild')")
+        cursor.execute('SELECT COUNT(*) FROM trello_card')
+        indexed = cursor.fetchone()[0]
+
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO trello_card_search (trello_card_search) VALUES ('optimize')")
+    return indexed
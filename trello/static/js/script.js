@@ -1,20 +1,24 @@
 'use strict'
 
 $(document).ready(function (){
+    csrfSetup();
     archieveView();
     editBoard();
     editList();
     editCard();
     archiveBoard();
+    copyBoard();
     archiveList();
     createCard();
     createList();
     createCardDescription();
     cardDraggable();
+    selectCards();
     leaveBoard();
     mouseoutBoard();
     uploadCoverImage();
     deleteCardCover();
+    boardEvents();
     // uploadCardImage()
 
 
@@ -46,47 +50,99 @@ $(document).ready(function (){
     });
 });
 
-function createList(){
-    $('#list-form').on('submit', function(e){
-        $.ajax({
-            url: $(this).attr('action'),
-            data: $(this).serialize(),
-            method: 'POST'
-        }).done(function(data){
-            var template = `
+function getCookie(name){
+    var match = document.cookie.match('(^|;)\\s*' + name + '=([^;]*)');
+    return match ? decodeURIComponent(match[2]) : null;
+}
+
+// Cached board fragments carry no CSRF token, the AJAX calls send it in a header.
+function csrfSetup(){
+    $.ajaxSetup({
+        beforeSend: function(xhr, settings){
+            if (!/^(GET|HEAD|OPTIONS|TRACE)$/i.test(settings.type) && !settings.crossDomain){
+                xhr.setRequestHeader('X-CSRFToken', getCookie('csrftoken'));
+            }
+        }
+    });
+}
+
+// Titles come from other collaborators, they are only ever set as text or
+// attribute values, never parsed as HTML.
+function listTemplate(id, title){
+    var list = $(`
                         <div class="cc">
                         <span id="cc-span">
                         <p id="list-error" style="visibility:hidden; margin: auto; font-weight: normal; color:#FF0000; font-size: 12px;">Cannot accept empty list!.</p>
                         </span>
-                        <div class="card p-1 ml-4 mt-5 list-content-${data.id}" data-id=${data.id}>
+                        <div class="card p-1 ml-4 mt-5">
                         <div class="card-title pt-3 pb-0 d-flex justify-content-between">
-                        <span class="list-span" value="${data.board_list}" contenteditable="true" data-title="${data.board_list}" data-id="${data.id}"><b>${data.board_list}</b></span> 
-                        <a href="/edit-list/${data.id}/"></a>
+                        <span class="list-span" contenteditable="true"><b></b></span> 
+                        <a class="edit-list-link"></a>
                         <div class="dropdown p-0 float-right" id="list-dropdown">
                         <button class="btn " type="button" id="dropdownMenuButton" data-toggle="dropdown" aria-haspopup="true" aria-expanded="false">
                             ...
                         </button>
                         <div class="dropdown-menu" aria-labelledby="dropdownMenuButton">
-                            <a class="archive-list-{{ list.id }} text-dark ml-5" id="archive-list" href="" data-title=${data.board_list} data-id=${data.id}>Archive List</a>
+                            <a class="text-dark ml-5" id="archive-list" href="">Archive List</a>
                         </div>
                         </div>
                         </div>
                         <div class="card-body pb-0">
-                        
-                        <form class="create-card mt-3" method="POST" draggable="false" action="/board/${data.id}/list/">
+                        <form class="create-card mt-3" method="POST" draggable="false">
                             <input type="text" class="input-card" name="card_title" placeholder="+ Add Card">
                         </form>
                         </div>
-                        </form>
-                        </div>
                         </div>
                         </div>
-                        `;  
+                        `);
+    id = parseInt(id, 10);
+    list.find('.card').addClass(`list-content-${id}`).attr('data-id', id);
+    list.find('.list-span').attr({'value': title, 'data-title': title, 'data-id': id});
+    list.find('.list-span b').text(title);
+    list.find('.edit-list-link').attr('href', `/edit-list/${id}/`);
+    list.find('#archive-list').addClass(`archive-list-${id}`).attr({'data-title': title, 'data-id': id});
+    list.find('.create-card').attr('action', `/board/${id}/list/`);
+    return list;
+}
+
+function cardTemplate(id, title, rank){
+    var card = $(`
+                                <li class="list-unstyled m-0 ui-sortable-handle ui-draggable ui-draggable-handle" droppable="true" draggable="true">
+                                <a class="drag-link">
+                                <a href="" data-toggle="modal" data-target="#modal-card">
+                                <h4 class="addcard w-100 pt-3" id="card">
+                                    <span id="card-text"></span>
+                                <button class="btn float-right" id="description">
+                                    <span class="glyphicon glyphicon-pencil" id="pencil"></span>
+                                </button>
+                                </h4>
+                                </a>
+                                </a>
+                                </li>
+                                `);
+    id = parseInt(id, 10);
+    card.addClass(`card-content-${id}`).attr({'data-id': id, 'data-rank': rank});
+    card.find('.drag-link').attr('href', `/drag-and-drop/${id}/`);
+    card.find('[data-toggle="modal"]').attr('data-remote', `/description/${id}`);
+    card.find('h4').attr('data-id', id);
+    card.find('#card-text').text(title);
+    return card;
+}
+
+function createList(){
+    $('#list-form').on('submit', function(e){
+        $.ajax({
+            url: $(this).attr('action'),
+            data: $(this).serialize(),
+            method: 'POST'
+        }).done(function(data){
+            var template = listTemplate(data.id, data.board_list);
             $('#list-board').append(template);
             $('#list-form').trigger('reset');
             
             archiveList();
             createCard();
+            cardDraggable();
         }).fail(function(data){
             console.log("error")
         });
@@ -104,20 +160,7 @@ function createCard(){
             data: $(this).serialize(),
             method: 'POST'
         }).done(function(data){
-            var card_template = `
-                                <li class="list-unstyled card-content-${data.id} m-0 ui-sortable-handle ui-draggable ui-draggable-handle" droppable="true" draggable="true" data-id="${data.id}">
-                                <a href="/drag-and-drop/${data.id}/">
-                                <a href="" data-toggle="modal" data-remote="/description/${data.id}" data-target="#modal-card">
-                                <h4 class="addcard w-100 pt-3" data-id="${data.id}" id="card">
-                                    <span id="card-text">${data.card}</span>
-                                <button class="btn float-right" id="description">
-                                    <span class="glyphicon glyphicon-pencil" id="pencil"></span>
-                                </button>
-                                </h4>
-                                </a>
-                                </a>
-                                </li>
-                                `;
+            var card_template = cardTemplate(data.id, data.card, data.rank);
             
             var listContent = $(`.list-content-${parent_list}`);
             $(listContent).find('.create-card').before(card_template);
@@ -156,23 +199,181 @@ function updateCard(){
                 method: 'POST'
             }).done(function(data){
                 $('.card-title-description').show();
-                $('header').find('.card-title-description').html(data.card);
+                $('header').find('.card-title-description').text(data.card);
                 $('#id_card_title').hide();
 
-                $.ajax({
-                    url: '/board/'+data.board,
-                    method: 'Get'
-                }).done(function(res){
-                    var card_con = $(`.card-content-${data.id}`);
-                    $('body').find('.card-body').find(card_con).find('h4').find('#card-text').html(data.card);
-                    $('.card-title-description').html(data.card);
-                    $('#card-error').hide();
-                });
+                refreshBoard(data.board);
+                $('.card-title-description').text(data.card);
+                $('#card-error').hide();
             });
         }
     });
 }
 
+function refreshBoard(board){
+    // The browser revalidates with If-None-Match, unchanged boards answer 304.
+    $.ajax({
+        url: '/board/' + board + '/snapshot.json',
+        method: 'Get',
+        dataType: 'json'
+    }).done(function(snapshot){
+        // Lists and cards missing from the page, e.g. just restored, are added.
+        var added = false;
+        $.each(snapshot.lists, function(i, list){
+            if(!$(`.list-content-${list.id}`).length){
+                $('#list-board').append(listTemplate(list.id, list.title));
+                added = true;
+            }
+            $(`.list-content-${list.id}`).find('.list-span b').text(list.title);
+        });
+        $.each(snapshot.cards, function(i, card){
+            if(!$(`.card-content-${card.id}`).length){
+                placeCard($(cardTemplate(card.id, card.title, card.rank)), card.list, card.rank);
+                added = true;
+            }
+            $(`.card-content-${card.id}`).find('#card-text').text(card.title);
+        });
+        if(added){
+            createCard();
+            cardDraggable();
+        }
+    });
+}
+
+function placeCard(card, list_id, rank){
+    // Insert the card in the list before the first card with a higher rank.
+    var body = $(`.list-content-${list_id}`).find('.card-body');
+    var next = body.children('li').filter(function(){
+        return $(this).data('id') != card.data('id') && String($(this).data('rank')) > rank;
+    }).first();
+
+    card.attr('data-rank', rank).data('rank', rank);
+    if(next.length){
+        next.before(card);
+    }else{
+        body.find('.create-card').before(card);
+    }
+}
+
+var CHANGES_POLL_INTERVAL = 3000;
+
+function boardEvents(){
+    var board = $('#list-board').data('board');
+    if(!board){
+        return;
+    }
+
+    var handlers = {};
+    var on = function(name, handler){
+        handlers[name] = handler;
+    };
+    var dispatch = function(name, data){
+        if(handlers[name]){
+            handlers[name](data);
+        }
+    };
+
+    on('list.created', function(data){
+        if(!$(`.list-content-${data.id}`).length){
+            $('#list-board').append(listTemplate(data.id, data.title));
+            createCard();
+            cardDraggable();
+        }
+    });
+    on('list.renamed', function(data){
+        $(`.list-content-${data.id}`).find('.list-span b').text(data.title);
+    });
+    $.each(['list.archived', 'list.deleted'], function(i, name){
+        on(name, function(data){
+            $(`.list-content-${data.id}`).parents('.cc').remove();
+        });
+    });
+    on('card.created', function(data){
+        if(!$(`.card-content-${data.id}`).length){
+            placeCard($(cardTemplate(data.id, data.title, data.rank)), data.list, data.rank);
+            cardDraggable();
+        }
+    });
+    on('card.updated', function(data){
+        $(`.card-content-${data.id}`).find('#card-text').text(data.title);
+    });
+    on('card.moved', function(data){
+        placeCard($(`.card-content-${data.id}`), data.list, data.rank);
+    });
+    on('cards.moved', function(data){
+        $.each(data.cards, function(i, card){
+            placeCard($(`.card-content-${card.id}`), card.list, card.rank);
+        });
+    });
+    $.each(['card.archived', 'card.deleted'], function(i, name){
+        on(name, function(data){
+            $(`.card-content-${data.id}`).remove();
+        });
+    });
+    on('cards.archived', function(data){
+        $.each(data.ids, function(i, id){
+            $(`.card-content-${id}`).remove();
+        });
+    });
+    on('lists.archived', function(data){
+        $.each(data.ids, function(i, id){
+            $(`.list-content-${id}`).parents('.cc').remove();
+        });
+    });
+    $.each(['cards.restored', 'lists.restored'], function(i, name){
+        on(name, function(data){
+            refreshBoard(board);
+        });
+    });
+    on('board.deleted', function(data){
+        window.location = '/dashboard/';
+    });
+    on('board.renamed', function(data){
+        $('header').find('.board-title').text(data.title);
+    });
+
+    // The event stream needs a server that does not block a worker per
+    // open board (see trello/events.py), the change log works everywhere.
+    if($('#list-board').data('stream') && window.EventSource){
+        var source = new EventSource('/board/' + board + '/events/');
+        $.each(handlers, function(name){
+            source.addEventListener(name, function(e){
+                dispatch(name, JSON.parse(e.data));
+            });
+        });
+    }else{
+        pollChanges(board, $('#list-board').data('cursor'), dispatch);
+    }
+}
+
+function pollChanges(board, cursor, dispatch){
+    // Replay the board's change log since 'cursor', every few seconds
+    // while the tab is visible.
+    var poll = function(){
+        if(document.hidden){
+            setTimeout(poll, CHANGES_POLL_INTERVAL);
+            return;
+        }
+        $.ajax({
+            url: '/board/' + board + '/changes/',
+            data: {since: cursor},
+            dataType: 'json'
+        }).done(function(result){
+            if(result.snapshot){
+                refreshBoard(board);
+            }
+            $.each(result.changes, function(i, change){
+                dispatch(change.event, change.data);
+            });
+            cursor = result.cursor;
+            setTimeout(poll, result.has_more ? 0 : CHANGES_POLL_INTERVAL);
+        }).fail(function(){
+            setTimeout(poll, CHANGES_POLL_INTERVAL * 5);
+        });
+    };
+    setTimeout(poll, CHANGES_POLL_INTERVAL);
+}
+
 function createCardDescription(){
     $('.card').on('click', function(e){
         $('.card2').hide();
@@ -195,7 +396,7 @@ function addCardDescription(){
             method: 'POST'
         }).done(function(data){
             $('.card2').show();
-            $('body').find('.card2').html(data.card_description);
+            $('body').find('.card2').text(data.card_description);
             $('#description_form').hide();
         }).fail(function(err){
             console.log(err);
@@ -203,33 +404,99 @@ function addCardDescription(){
     });
 }
 
-function cardDraggable(){
-    $('.card-body').sortable({
-        cancel: 'form'
+function selectCards(){
+    // Ctrl/Cmd+click picks cards, dragging one of them moves them all.
+    $('#list-board').on('click', '.card-body li', function(e){
+        if(!(e.ctrlKey || e.metaKey)){
+            return;
+        }
+        e.preventDefault();
+        e.stopPropagation();
+        $(this).toggleClass('card-selected');
     });
+}
 
-    $('li').draggable({
-        connectToSortable: '.card-body'
+function moveSelectedCards(card, group){
+    // Put the other picked cards around the dropped one, in their page
+    // order, then save the whole move with one batch request.
+    var index = group.index(card);
+    card.before(group.slice(0, index).show());
+    card.after(group.slice(index + 1).show());
+
+    var moves = group.map(function(){
+        var item = $(this);
+        return {
+            card: item.data('id'),
+            list: item.parents('.card').data('id'),
+            position: item.parent().children('li').index(item)
+        };
+    }).get();
+
+    $.ajax({
+        url: '/drag-and-drop/batch/',
+        method: 'POST',
+        contentType: 'application/json',
+        data: JSON.stringify({moves: moves})
+    }).done(function(data){
+        $.each(data.cards, function(i, moved){
+            $(`.card-content-${moved.card}`).attr('data-rank', moved.rank).data('rank', moved.rank);
+        });
+        group.removeClass('card-selected');
     });
+}
 
-    $('.card-body').droppable({
-        accepts: 'li', 
-        revert: 'false',
-        drop: function(event, ui){
-            event.preventDefault();
-
-            var list_id = $(this).prev().find('span').data('id');
-            var card_id = $(ui.draggable).data("id");
+function cardDraggable(){
+    $('.card-body').sortable({
+        cancel: 'form',
+        items: 'li',
+        connectWith: '.card-body',
+        start: function(event, ui){
+            var card = $(ui.item);
+            var group = card.hasClass('card-selected') ? $('.card-selected') : $();
+            card.data('group', group);
+            group.not(card).hide();
+        },
+        stop: function(event, ui){
+            var card = $(ui.item);
+            var list_id = card.parents('.card').data('id');
+            var group = card.data('group');
+            card.removeData('group');
+            if(group && group.length > 1){
+                moveSelectedCards(card, group);
+                return;
+            }
 
             $.ajax({
-                url: $(ui.draggable).find('a').attr('href'),
+                url: card.find('a').attr('href'),
                 method: 'POST',
-                data: {blist: list_id, card: card_id}
+                data: {
+                    blist: list_id,
+                    card: card.data('id'),
+                    before: card.prevAll('li').first().data('id') || '',
+                    after: card.nextAll('li').first().data('id') || ''
+                }
             }).done(function(data){
                 console.log(data);
             });
         }
     });
+
+    $('#list-board').sortable({
+        items: '.cc',
+        handle: '.card-title',
+        stop: function(event, ui){
+            var list = $(ui.item).find('.card').first();
+
+            $.ajax({
+                url: '/drag-list/' + list.data('id') + '/',
+                method: 'POST',
+                data: {
+                    before: $(ui.item).prevAll('.cc').first().find('.card').data('id') || '',
+                    after: $(ui.item).nextAll('.cc').first().find('.card').data('id') || ''
+                }
+            });
+        }
+    });
 }
 
 function editList(){
@@ -297,12 +564,70 @@ function archieveView(){
     $('#modal').on('shown.bs.modal', function () {       
         var modal = $(this);
 
-        $.ajax({
-            'method': 'get',
-            'url': '/archive/',
-        }).done(function(response){
-            modal.find('.modal-body').html(response);
+        loadArchive(modal, '/archive/');
+    });
+
+    $('#modal').on('click', '#archive-tabs a', function(e){
+        e.preventDefault();
+        loadArchive($('#modal'), $(this).attr('href'));
+    });
+
+    $('#modal .modal-body').on('scroll', function(){
+        var body = $(this);
+        if (body.scrollTop() + body.innerHeight() >= this.scrollHeight - 100) {
+            loadMoreArchive();
+        }
+    });
+}
+
+function loadArchive(modal, url){
+    $.ajax({
+        'method': 'get',
+        'url': url,
+    }).done(function(response){
+        modal.find('.modal-body').html(response);
+    });
+}
+
+function archiveItemTemplate(item){
+    var created = new Date(item.created_date).toLocaleString();
+    return `<li class="list-unstyled">
+                <div class="row">
+                    <div class="col-9 pt-3 border-bottom">${created}: ${$('<div>').text(item.title).html()}</div>
+                    <div class="col-1 pb-1 border-bottom">
+                        <a class="text-secondary" href="${item.delete}">
+                            <span class="glyphicon glyphicon-trash mt-3 ml-2">&nbsp</span>
+                        </a>
+                    </div>
+                    <div class="col-1 pb-1 pr-0 pl-3 border-bottom">
+                        <a class="text-secondary" href="${item.restore}">
+                            <span class="glyphicon glyphicon-repeat mt-3"></span>
+                        </a>
+                    </div>
+                </div>
+            </li>`;
+}
+
+function loadMoreArchive(){
+    // Next page of the open tab, fetched as JSON once the list is scrolled to its end.
+    var items = $('#archive-items');
+    var next = items.data('next');
+    if (!next || items.data('loading')) {
+        return;
+    }
+    items.data('loading', true);
+
+    $.ajax({
+        'method': 'get',
+        'url': '/archive/',
+        'data': {'type': items.data('type'), 'after': next, 'format': 'json'},
+    }).done(function(response){
+        $.each(response.items, function(i, item){
+            items.append(archiveItemTemplate(item));
         });
+        items.data('next', response.next || '');
+    }).always(function(){
+        items.data('loading', false);
     });
 }
 
@@ -331,7 +656,7 @@ function updateBoard(){
             }).done(function(data){
                 e.preventDefault();
                 $('.board-title').show();
-                $('header').find('.board-title').html(data.board)
+                $('header').find('.board-title').text(data.board)
                 $('#edit-board').hide();
                 $('#board-error').hide();
                 $('#board-edit-form').parents('h2').attr('value', data.board)
@@ -431,6 +756,22 @@ function archiveBoard(){
     });
 }
 
+function copyBoard(){
+    $(document).on('click', '.copy-board', function(e){
+        e.preventDefault();
+
+        $.ajax({
+            url: $(this).attr('href'),
+            method: 'POST',
+            data: {template: $(this).data('template') || ''}
+        }).done(function(data){
+            window.location.href = '/board/' + data.board + '/';
+        }).fail(function(err){
+            console.log(err);
+        });
+    });
+}
+
 function archiveList(){
     $('#archive-list').on('click', function(e){
         e.preventDefault();
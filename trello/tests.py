@@ -1,3 +1,1232 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from concurrent.futures import Future
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, router, transaction
+from django.http import HttpResponse
+from django.core.cache import caches
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from PIL import Image
+
+from . import events, images, metrics, outbox, profiling, ranking, timing
+from .activity import compact_changes
+from .fragments import board_key, render_board_lists
+from .images import derivative_name
+from .management.commands.check_query_plans import is_table_scan
+from .blobs import image_storage, referenced_images, release, store_upload
+from .models import Board, BoardChange, BoardInvite, BoardMembers, Card, ImageBlob, List, OutgoingEmail
+from .queries import decode_cursor, encode_cursor, keyset_page, load_dashboard, read_transaction, update_in_bulk
+from .ranking import plan_moves, rank_after, rank_between, ranks_between, spread_ranks
+from .routing import STICKY_COOKIE, ReplicaMiddleware
+from .timing import fingerprint
+from .transfer import import_board
+
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+    'fragments': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-fragments'},
+}
+
+
+class TempFilesMixin:
+    """
+    Keeps the files the app writes (media, metrics, board events, caches)
+    in a temporary directory.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp(prefix='trello-tests-')
+        cls.temp_settings = override_settings(
+            MEDIA_ROOT=os.path.join(cls.temp_dir, 'media'),
+            METRICS_DIR=os.path.join(cls.temp_dir, 'metrics'),
+            PROFILE_DIR=os.path.join(cls.temp_dir, 'profiles'),
+            BOARD_EVENTS_DB=os.path.join(cls.temp_dir, 'board_events.sqlite3'),
+            CACHES=TEST_CACHES,
+        )
+        cls.temp_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.temp_settings.disable()
+        shutil.rmtree(cls.temp_dir, ignore_errors=True)
+
+
+class TrelloTestCase(TempFilesMixin, TestCase):
+    """
+    Adds helpers building boards.
+    """
+
+    def setUp(self):
+        # Ids are reused once a test rolls back, so are cache keys.
+        for alias in ('default', 'fragments'):
+            caches[alias].clear()
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.client.force_login(self.user)
+
+    def make_board(self, lists=1, cards=0, author=None):
+        """
+        A board of 'lists' lists holding 'cards' cards each, ranked in order.
+        """
+
+        author = author or self.user
+        board = Board.objects.create(author=author, title='Board')
+        BoardMembers.objects.create(board=board, members=author, owner=True, deactivate=False)
+        for list_rank in spread_ranks(lists):
+            board_list = List.objects.create(board=board, author=author, list_title='List', rank=list_rank)
+            Card.objects.bulk_create([
+                Card(board_list=board_list, author=author, card_title='Card {}'.format(number), rank=rank)
+                for number, rank in enumerate(spread_ranks(cards))
+            ])
+        return board
+
+    def card_ids(self, board_list):
+        return list(Card.objects.filter(board_list=board_list).order_by('rank', 'id').values_list('id', flat=True))
+
+
+class RankingTests(TrelloTestCase):
+
+    def test_rank_between_sorts_between_its_neighbours(self):
+        for before, after in [(None, None), ('V', None), (None, 'V'), ('V', 'W'), ('V', 'V1'), ('Vz', 'W')]:
+            rank = rank_between(before, after)
+            self.assertGreater(rank, before or '')
+            if after:
+                self.assertLess(rank, after)
+            self.assertFalse(rank.endswith('0'))
+
+    def test_rank_between_rejects_neighbours_out_of_order(self):
+        with self.assertRaises(ValueError):
+            rank_between('W', 'V')
+        with self.assertRaises(ValueError):
+            rank_between('V', 'V')
+
+    def test_repeated_inserts_into_the_same_gap_stay_ordered(self):
+        before, after = 'V', 'W'
+        for _ in range(200):
+            rank = rank_between(before, after)
+            self.assertTrue(before < rank < after)
+            after = rank
+
+    def test_ranks_between_are_ascending_inside_the_gap(self):
+        for before, after, count in [('V', 'W', 50), (None, 'V', 10), ('V', None, 10), (None, None, 3)]:
+            ranks = ranks_between(before, after, count)
+            self.assertEqual(len(ranks), count)
+            self.assertEqual(ranks, sorted(set(ranks)))
+            self.assertGreater(ranks[0], before or '')
+            if after:
+                self.assertLess(ranks[-1], after)
+        self.assertEqual(ranks_between('V', 'W', 0), [])
+
+    def test_spread_ranks_are_ascending_and_short(self):
+        ranks = spread_ranks(5000)
+        self.assertEqual(ranks, sorted(set(ranks)))
+        self.assertLessEqual(max(len(rank) for rank in ranks), 4)
+
+    def test_drag_and_drop_writes_a_rank_between_the_neighbours(self):
+        board = self.make_board(cards=3)
+        board_list = board.list_set.get()
+        first, second, third = self.card_ids(board_list)
+
+        response = self.client.post('/drag-and-drop/{}/'.format(third), {
+            'blist': board_list.id, 'card': third, 'before': first, 'after': second,
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.card_ids(board_list), [first, third, second])
+
+    def test_drops_into_the_same_gap_keep_ranks_within_the_column(self):
+        board = self.make_board(cards=2)
+        board_list = board.list_set.get()
+        first, last = self.card_ids(board_list)
+        dropped = []
+
+        # Every card is dropped right below the first one, halving the gap,
+        # with a short limit so the list is rebalanced several times.
+        with mock.patch.object(ranking, 'MAX_LENGTH', 8):
+            for number in range(120):
+                card = Card.objects.create(board_list=board_list, author=self.user, card_title='New', rank=rank_after('z'))
+                response = self.client.post('/drag-and-drop/{}/'.format(card.id), {
+                    'blist': board_list.id, 'card': card.id, 'before': first, 'after': dropped[-1] if dropped else last,
+                })
+                self.assertEqual(response.status_code, 200)
+                dropped.append(card.id)
+
+        ranks = Card.objects.filter(board_list=board_list).values_list('rank', flat=True)
+        self.assertLessEqual(max(len(rank) for rank in ranks), 8)
+        self.assertEqual(self.card_ids(board_list), [first] + dropped[::-1] + [last])
+
+    def test_neighbours_out_of_order_drop_the_card_at_the_bottom(self):
+        board = self.make_board(cards=3)
+        board_list = board.list_set.get()
+        first, second, third = self.card_ids(board_list)
+
+        response = self.client.post('/drag-and-drop/{}/'.format(first), {
+            'blist': board_list.id, 'card': first, 'before': third, 'after': second,
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.card_ids(board_list), [second, third, first])
+
+    def test_lists_with_neighbours_out_of_order_go_to_the_end(self):
+        board = self.make_board(lists=3)
+        first, second, third = board.list_set.order_by('rank').values_list('id', flat=True)
+
+        response = self.client.post('/drag-list/{}/'.format(first), {'before': third, 'after': second})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(board.list_set.order_by('rank').values_list('id', flat=True)), [second, third, first])
+
+    def test_drag_and_drop_rejects_malformed_ids(self):
+        board = self.make_board(cards=2)
+        board_list = board.list_set.get()
+        first, second = self.card_ids(board_list)
+
+        for data in [
+            {'blist': board_list.id, 'card': 'x'},
+            {'blist': 'x', 'card': first},
+            {'blist': board_list.id, 'card': first, 'before': '1.5'},
+            {'blist': board_list.id, 'card': first, 'after': 10 ** 30},
+            {'blist': board_list.id},
+        ]:
+            response = self.client.post('/drag-and-drop/{}/'.format(first), data)
+            self.assertEqual(response.status_code, 400, data)
+        response = self.client.post('/drag-list/{}/'.format(board_list.id), {'before': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.card_ids(board_list), [first, second])
+
+
+class UpdateInBulkTests(TrelloTestCase):
+
+    def test_writes_a_value_per_row_in_batches(self):
+        board = self.make_board(lists=2, cards=400)
+        source, target = board.list_set.order_by('rank')
+        ids = self.card_ids(source)
+        moved = ids[:350]
+        ranks = dict(zip(moved, ranks_between(None, None, len(moved))))
+
+        updated = update_in_bulk(
+            Card.objects.all(), {'rank': ranks, 'board_list': {pk: target.id for pk in moved}}, archived=True
+        )
+
+        self.assertEqual(updated, 350)
+        self.assertEqual(Card.objects.filter(id__in=moved, board_list=target).count(), 350)
+        rows = dict(Card.objects.filter(id__in=moved).values_list('id', 'rank'))
+        self.assertEqual(rows, ranks)
+        self.assertEqual(Card.objects.filter(archived=True).count(), 350)
+        self.assertEqual(self.card_ids(source), ids[350:])
+
+    def test_nothing_to_update(self):
+        self.assertEqual(update_in_bulk(Card.objects.all(), {}), 0)
+
+
+class BatchMoveTests(TrelloTestCase):
+
+    def post_moves(self, moves):
+        return self.client.post('/drag-and-drop/batch/', json.dumps({'moves': moves}), content_type='application/json')
+
+    def test_plan_moves_spreads_consecutive_cards_inside_the_gap(self):
+        siblings = {1: ['A', 'B', 'C'], 2: []}
+        planned = plan_moves(siblings, [(10, 1, 1), (11, 1, 2), (12, 2, None), (13, 1, None)])
+
+        self.assertTrue('A' < planned[10] < planned[11] < 'B')
+        self.assertGreater(planned[13], 'C')
+        self.assertIn(12, planned)
+
+    def test_plan_moves_needs_ranked_siblings(self):
+        with self.assertRaises(ValueError):
+            plan_moves({1: ['A', '']}, [(10, 1, 0)])
+
+    def test_moves_cards_to_their_positions(self):
+        board = self.make_board(lists=2, cards=3)
+        source, target = board.list_set.order_by('rank')
+        first, second, third = self.card_ids(source)
+        kept = self.card_ids(target)
+
+        response = self.post_moves([
+            {'card': first, 'list': target.id, 'position': 1},
+            {'card': third, 'list': target.id, 'position': 2},
+            {'card': second, 'list': target.id},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.card_ids(source), [])
+        self.assertEqual(self.card_ids(target), [kept[0], first, third, kept[1], kept[2], second])
+        self.assertEqual(board.boardchange_set.filter(event='cards.moved').count(), 1)
+
+    def test_unknown_ids_move_nothing(self):
+        board = self.make_board(cards=2)
+        board_list = board.list_set.get()
+        ids = self.card_ids(board_list)
+
+        unknown = ids[-1] + 1000
+        response = self.post_moves([{'card': ids[1], 'list': board_list.id, 'position': 0}, {'card': unknown, 'list': board_list.id}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['cards'], [unknown])
+        self.assertEqual(self.card_ids(board_list), ids)
+
+    def test_malformed_moves_are_rejected(self):
+        bodies = ['{"moves": "x"}', '{"moves": [1, 2]}', '{"moves": {"card": 1}}', '{"moves": []}',
+                  '{"moves": [{"card": "x", "list": 1}]}', '[1]', 'nope',
+                  '{"moves": [{"card": 1000000000000000000000000000000, "list": 1}]}',
+                  '{"moves": [{"card": 1, "list": -1}]}']
+        for body in bodies:
+            with self.subTest(body=body):
+                response = self.client.post('/drag-and-drop/batch/', body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+
+
+class KeysetPageTests(TrelloTestCase):
+
+    def setUp(self):
+        super().setUp()
+        board = self.make_board(cards=25)
+        cards = Card.objects.filter(board_list__board=board)
+        cards.update(archived=True)
+        # Ties on created_date are broken by id.
+        start = timezone.now() - timedelta(days=1)
+        for index, pk in enumerate(cards.order_by('id').values_list('id', flat=True)):
+            cards.filter(id=pk).update(created_date=start + timedelta(minutes=index // 3))
+        self.archived = Card.objects.filter(author=self.user, archived=True).values('id', 'created_date')
+
+    def test_cursor_round_trip(self):
+        created_date = datetime(2019, 9, 16, 12, 47, 1, 123456, tzinfo=timezone.utc)
+        self.assertEqual(decode_cursor(encode_cursor(created_date, 42)), (created_date, 42))
+
+    def test_malformed_cursors(self):
+        for cursor in ['', 'x', '1', '1-2-3', 'x-1', '1-x', '99999999999999999999999-1', '1-99999999999999999999999']:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(ValueError):
+                    decode_cursor(cursor)
+
+    def test_pages_walk_every_row_once_in_order(self):
+        expected = list(self.archived.order_by('created_date', 'id').values_list('id', flat=True))
+        seen = []
+        cursor = None
+        while True:
+            rows, cursor = keyset_page(self.archived, cursor, limit=4)
+            seen.extend(row['id'] for row in rows)
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_archive_continues_after_the_cursor(self):
+        expected = list(self.archived.order_by('created_date', 'id').values_list('id', flat=True))
+        rows, cursor = keyset_page(self.archived, limit=10)
+
+        response = self.client.get('/archive/', {'type': 'cards', 'format': 'json', 'after': cursor})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['items']], expected[10:])
+        self.assertIsNone(response.json()['next'])
+
+    def test_archive_rejects_bad_cursors(self):
+        for cursor in ['x-1', '99999999999999999999999-1', '1-99999999999999999999999']:
+            with self.subTest(cursor=cursor):
+                response = self.client.get('/archive/', {'type': 'cards', 'after': cursor})
+                self.assertEqual(response.status_code, 400)
+
+
+class FlakyConnection:
+    """
+    Email connection failing for the recipients in 'failing'.
+    """
+
+    def __init__(self, failing=(), reachable=True):
+        self.failing = set(failing)
+        self.reachable = reachable
+        self.sent = []
+
+    def open(self):
+        if not self.reachable:
+            raise OSError('Connection refused')
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0] in self.failing:
+                raise OSError('Mailbox unavailable')
+            self.sent.extend(message.to)
+
+
+class OutboxTests(TrelloTestCase):
+
+    def setUp(self):
+        super().setUp()
+        outbox.enqueue_many([('Invite', 'Join us', '{}@example.com'.format(name)) for name in 'abc'])
+
+    def make_due(self):
+        OutgoingEmail.objects.filter(sent_date__isnull=True).update(next_attempt=timezone.now())
+
+    def test_sends_due_emails_once(self):
+        connection = FlakyConnection()
+        self.assertEqual(outbox.send_batch(connection=connection), (3, 0))
+        self.assertEqual(outbox.send_batch(connection=connection), (0, 0))
+        self.assertEqual(sorted(connection.sent), ['a@example.com', 'b@example.com', 'c@example.com'])
+        self.assertEqual(outbox.pending(), 0)
+
+    def test_failed_emails_are_retried_with_a_growing_delay(self):
+        connection = FlakyConnection(failing=['b@example.com'])
+        self.assertEqual(outbox.send_batch(connection=connection), (2, 1))
+
+        email = OutgoingEmail.objects.get(to_email='b@example.com')
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('Mailbox unavailable', email.last_error)
+        self.assertGreater(email.next_attempt, timezone.now() + outbox.backoff(1) - timedelta(seconds=5))
+        self.assertEqual(outbox.send_batch(connection=connection), (0, 0))
+        self.assertLess(outbox.backoff(1), outbox.backoff(2))
+        self.assertEqual(outbox.backoff(50), timedelta(seconds=outbox.MAX_BACKOFF))
+
+        connection.failing.clear()
+        self.make_due()
+        self.assertEqual(outbox.send_batch(connection=connection), (1, 0))
+
+    def test_gives_up_after_max_attempts(self):
+        connection = FlakyConnection(reachable=False)
+        for _ in range(outbox.MAX_ATTEMPTS):
+            self.make_due()
+            self.assertEqual(outbox.send_batch(connection=connection), (0, 3))
+        self.make_due()
+        self.assertEqual(outbox.send_batch(connection=connection), (0, 0))
+        self.assertEqual(outbox.pending(), 0)
+        self.assertFalse(OutgoingEmail.objects.filter(sent_date__isnull=False).exists())
+
+    def test_claimed_emails_are_skipped_by_other_workers(self):
+        claimed = outbox.claim(2)
+        self.assertEqual(len(claimed), 2)
+
+        connection = FlakyConnection()
+        self.assertEqual(outbox.send_batch(connection=connection), (1, 0))
+        self.assertNotIn(claimed[0].to_email, connection.sent)
+        self.assertEqual(outbox.pending(), 2)
+
+
+class ImageBlobTests(TrelloTestCase):
+
+    def upload(self, data=b'cover image', filename='cover.png'):
+        return store_upload(SimpleUploadedFile(filename, data))
+
+    def test_identical_uploads_are_stored_once(self):
+        name = self.upload()
+        self.assertEqual(self.upload(filename='copy.PNG'), name)
+        self.assertNotEqual(self.upload(b'another image'), name)
+
+        blob = ImageBlob.objects.get(name=name)
+        self.assertEqual(blob.refcount, 2)
+        self.assertTrue(image_storage().exists(name))
+        self.assertEqual(ImageBlob.objects.count(), 2)
+
+    def test_release_drops_references(self):
+        name = self.upload()
+        self.upload()
+        release(name, name)
+        self.assertEqual(ImageBlob.objects.get(name=name).refcount, 0)
+        self.assertEqual(referenced_images([name]), set())
+
+    def test_cards_keep_their_image_referenced(self):
+        name = self.upload()
+        release(name)
+        board = self.make_board(cards=1)
+        Card.objects.filter(board_list__board=board).update(image=name)
+        self.assertEqual(referenced_images([name]), {name})
+
+    def test_concurrent_blob_insert_falls_back_to_the_existing_row(self):
+        name = self.upload()
+        with mock.patch.object(type(ImageBlob.objects), 'get_or_create', side_effect=IntegrityError):
+            self.assertEqual(self.upload(), name)
+        self.assertEqual(ImageBlob.objects.get(name=name).refcount, 2)
+
+    def test_collect_images_deletes_unreferenced_files_only(self):
+        kept = self.upload()
+        dropped = self.upload(b'another image')
+        release(dropped)
+
+        call_command('collect_images', grace_minutes=0, stdout=io.StringIO())
+
+        self.assertTrue(image_storage().exists(kept))
+        self.assertFalse(image_storage().exists(dropped))
+        self.assertFalse(ImageBlob.objects.filter(name=dropped).exists())
+
+
+class InlineExecutor:
+    """
+    Runs the derivative jobs right away, in the test's thread.
+    """
+
+    def submit(self, function, *args):
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+
+class CoverDerivativeTests(TrelloTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.board = self.make_board(cards=1)
+        self.card = Card.objects.get(board_list__board=self.board)
+        jpeg = io.BytesIO()
+        Image.new('RGB', (1600, 1200), 'teal').save(jpeg, 'JPEG')
+        self.image = store_upload(SimpleUploadedFile('cover.jpg', jpeg.getvalue()))
+        Card.objects.filter(id=self.card.id).update(image=self.image)
+
+    def assertDerivativesSaved(self):
+        card = Card.objects.get(id=self.card.id)
+        self.assertEqual(card.thumbnail.name, derivative_name(self.image, 'thumbnail'))
+        self.assertEqual(card.preview.name, derivative_name(self.image, 'preview'))
+        with Image.open(card.thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.size, (320, 240))
+        change = BoardChange.objects.filter(board=self.board, event='card.cover').get()
+        self.assertEqual(json.loads(change.data)['id'], self.card.id)
+
+    def test_queued_derivatives_are_saved_and_announced(self):
+        with mock.patch.object(transaction, 'on_commit', side_effect=lambda function: function()), \
+                mock.patch.object(images, 'get_executor', return_value=InlineExecutor()):
+            images.queue_derivatives(self.card.id, self.image)
+        self.assertDerivativesSaved()
+        self.assertEqual(images.pending(), 0)
+
+    def test_command_backfills_covers_without_thumbnail(self):
+        out = io.StringIO()
+        call_command('build_thumbnails', stdout=out)
+        self.assertDerivativesSaved()
+        self.assertIn('Built thumbnails of 1 covers, 0 failed.', out.getvalue())
+
+        call_command('build_thumbnails', stdout=out)
+        self.assertIn('Built thumbnails of 0 covers', out.getvalue())
+
+
+class PurgeTests(TrelloTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.board = self.make_board(lists=2, cards=30)
+        self.image = store_upload(SimpleUploadedFile('cover.png', b'cover image'))
+        Card.objects.filter(id=self.card_ids(self.board.list_set.first())[0]).update(image=self.image)
+
+    def delete_board(self):
+        response = self.client.get('/board/{}/delete-board/'.format(self.board.id))
+        self.assertEqual(response.status_code, 302)
+
+    def test_deleted_board_is_hidden_and_notified(self):
+        self.delete_board()
+
+        self.assertFalse(Board.objects.filter(id=self.board.id).exists())
+        board = Board.all_objects.get(id=self.board.id)
+        self.assertEqual(board.version, self.board.version + 1)
+        self.assertTrue(BoardChange.objects.filter(board=board, event='board.deleted').exists())
+        self.assertEqual(self.client.get('/board/{}/'.format(board.id)).status_code, 404)
+
+    def test_writes_to_a_deleted_board_are_rejected(self):
+        board_list = self.board.list_set.first()
+        card_id = self.card_ids(board_list)[0]
+        self.delete_board()
+
+        response = self.client.post('/board/{}/list/'.format(board_list.id), {'card_title': 'Late card'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post('/description/{}/'.format(card_id), {'card_title': 'Late title'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(
+            '/drag-and-drop/batch/', json.dumps({'moves': [{'card': card_id, 'list': board_list.id}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Card.objects.filter(board_list=board_list).count(), 30)
+
+    def test_purge_deletes_everything_in_batches(self):
+        other = self.make_board(cards=5)
+        self.delete_board()
+
+        call_command('purge_boards', batch_size=7, pause=0, stdout=io.StringIO())
+
+        self.assertFalse(Board.all_objects.filter(id=self.board.id).exists())
+        self.assertFalse(List.objects.filter(board_id=self.board.id).exists())
+        self.assertFalse(BoardChange.objects.filter(board_id=self.board.id).exists())
+        self.assertFalse(Card.objects.filter(board_list__board_id=self.board.id).exists())
+        self.assertEqual(Card.objects.filter(board_list__board=other).count(), 5)
+        self.assertFalse(image_storage().exists(self.image))
+        self.assertFalse(ImageBlob.objects.filter(name=self.image).exists())
+
+
+class TransferTests(TrelloTestCase):
+
+    def board_contents(self, board):
+        lists = List.objects.filter(board=board).order_by('rank', 'id')
+        return {
+            'title': board.title,
+            'members': sorted(BoardMembers.objects.filter(board=board).values_list('members__email', 'deactivate', 'owner')),
+            'lists': [
+                (board_list.list_title, board_list.rank, board_list.archived, list(
+                    board_list.card_set.order_by('rank', 'id').values_list(
+                        'card_title', 'card_description', 'rank', 'archived', 'image', 'author__email'
+                    )
+                ))
+                for board_list in lists
+            ],
+        }
+
+    def test_export_import_round_trip(self):
+        member = User.objects.create_user('member', 'member@example.com', 'password')
+        board = self.make_board(lists=3, cards=20)
+        BoardMembers.objects.create(board=board, members=member, deactivate=False)
+        board_list = board.list_set.order_by('rank').first()
+        List.objects.filter(id=board.list_set.order_by('rank').last().id).update(archived=True)
+        first, second = self.card_ids(board_list)[:2]
+        image = store_upload(SimpleUploadedFile('cover.png', b'cover image'))
+        Card.objects.filter(id=first).update(image=image, card_description='With a cover', author=member)
+        Card.objects.filter(id=second).update(archived=True)
+
+        response = self.client.get('/board/{}/export.ndjson'.format(board.id), {'images': '1'})
+        self.assertEqual(response.status_code, 200)
+        lines = list(response.streaming_content)
+
+        importer = import_board(lines, member, batch_size=7)
+
+        self.assertEqual(importer.counts, {'member': 2, 'list': 3, 'card': 60, 'image': 1})
+        self.assertEqual(importer.skipped_members, [])
+        self.assertNotEqual(importer.board.id, board.id)
+        self.assertEqual(self.board_contents(importer.board), self.board_contents(board))
+        self.assertEqual(ImageBlob.objects.get(name=image).refcount, 2)
+        self.assertTrue(Board.objects.filter(id=importer.board.id).exists())
+
+    def test_members_without_an_account_are_skipped_and_reported(self):
+        member = User.objects.create_user('member', 'member@example.com', 'password')
+        board = self.make_board()
+        BoardMembers.objects.create(board=board, members=member, deactivate=False)
+        export = self.client.get('/board/{}/export.ndjson'.format(board.id)).streaming_content
+        lines = [line.decode().replace('member@example.com', 'gone@example.com') for line in export]
+
+        out = io.StringIO()
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as source:
+            source.writelines(lines)
+            source.flush()
+            call_command('import_board', source.name, '--user', 'owner', stdout=out)
+
+        board = Board.objects.order_by('-id').first()
+        self.assertEqual(list(board.boardmembers_set.values_list('members__email', flat=True)), ['owner@example.com'])
+        self.assertEqual(out.getvalue().splitlines(), [
+            'Imported board {} with 1 lists, 0 cards, 1 members and 0 images.'.format(board.id),
+            'Skipped 1 members without an account here: gone@example.com.',
+        ])
+
+    def test_import_rejects_other_files(self):
+        with self.assertRaises(ValueError):
+            import_board(['{"type": "card"}'], self.user)
+        with self.assertRaises(ValueError):
+            import_board([], self.user)
+
+
+class MetricsTests(TrelloTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # A file of this process in the directory of this test case.
+        patcher = mock.patch.object(metrics, '_values', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.directory = metrics.metrics_dir()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def exited_process_file(self, pid=2 ** 22 + 1):
+        # Above the largest pid Linux hands out, so never running.
+        values = metrics.MappedValues(os.path.join(self.directory, 'metrics-{}.db'.format(pid)))
+        values.add(metrics.metric_key('trello_http_requests_total', {'view': 'board', 'method': 'GET', 'status': '200'}), 5)
+        values.set(metrics.metric_key('trello_image_queue_depth', {}), 7)
+        values.close()
+
+    def test_files_of_exited_processes_are_merged_once(self):
+        self.exited_process_file()
+        metrics.inc('trello_http_requests_total', view='board', method='GET', status='200')
+        metrics.set_gauge('trello_image_queue_depth', 2)
+        key = ('trello_http_requests_total', (('method', 'GET'), ('status', '200'), ('view', 'board')))
+
+        for _ in range(2):
+            totals = metrics.collect()
+            self.assertEqual(totals[key], 6)
+            self.assertEqual(totals['trello_image_queue_depth', ()], 2)
+        files = sorted(name for name in os.listdir(self.directory) if name.endswith('.db'))
+        self.assertEqual(files, sorted(['metrics-{}.db'.format(os.getpid()), metrics.MERGED_FILE]))
+
+    def test_metrics_view(self):
+        self.client.get('/dashboard/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('trello_http_requests_total{method="GET",status="200",view="dashboard"} 1', response.content.decode())
+        self.assertIn('trello_email_outbox_depth 0', response.content.decode())
+
+
+class DashboardCacheTests(TempFilesMixin, TransactionTestCase):
+    """
+    The cached dashboards are dropped once the transaction commits, which
+    the TestCase transaction never does.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.other = User.objects.create_user('other', 'other@example.com', 'password')
+        self.client.force_login(self.user)
+        self.board = Board.objects.create(author=self.user, title='Own board')
+        BoardMembers.objects.create(board=self.board, members=self.user, owner=True)
+        self.shared = Board.objects.create(author=self.other, title='Shared board')
+        BoardMembers.objects.create(board=self.shared, members=self.other, owner=True)
+        BoardMembers.objects.create(board=self.shared, members=self.user, owner=False, deactivate=False)
+
+    def dashboard(self):
+        response = self.client.get('/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_dashboard_is_served_from_the_cache(self):
+        load_dashboard(self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual([board['title'] for board in load_dashboard(self.user)['board']], ['Own board'])
+
+    def test_created_boards_show_up(self):
+        self.assertNotIn('New board', self.dashboard())
+        self.client.post('/create-board/', {'title': 'New board'})
+        self.assertIn('New board', self.dashboard())
+
+    def test_renamed_boards_show_up(self):
+        self.assertIn('Own board', self.dashboard())
+        self.client.post('/board/{}/edit-board/'.format(self.board.id), {'board_title': 'Renamed board'})
+        page = self.dashboard()
+        self.assertIn('Renamed board', page)
+        self.assertNotIn('Own board', page)
+
+    def test_boards_left_are_dropped(self):
+        self.assertIn('Shared board', self.dashboard())
+        self.client.get('/leave-board/{}/'.format(self.shared.id))
+        self.assertNotIn('Shared board', self.dashboard())
+
+    def test_deleted_boards_are_dropped_for_every_member(self):
+        self.client.force_login(self.other)
+        self.client.get('/dashboard/')
+        self.client.force_login(self.user)
+        self.assertIn('Shared board', self.dashboard())
+
+        self.client.force_login(self.other)
+        self.client.get('/board/{}/delete-board/'.format(self.shared.id))
+        self.assertNotIn('Shared board', self.dashboard())
+        self.client.force_login(self.user)
+        self.assertNotIn('Shared board', self.dashboard())
+
+
+class BenchCommandsTests(TempFilesMixin, TransactionTestCase):
+    """
+    The bench threads use connections of their own, so the seeded rows
+    must be committed.
+    """
+
+    def seed(self):
+        out = io.StringIO()
+        call_command('seed_scale', users=3, boards=2, lists=3, cards=4, members=1, prefix='seeded', stdout=out)
+        self.assertIn('Created 3 users, 6 boards, 18 lists and 72 cards.', out.getvalue())
+
+    def test_bench_runs_against_seeded_data(self):
+        self.seed()
+        out = io.StringIO()
+        call_command('bench', threads=1, requests=2, prefix='seeded', seed=1, stdout=out)
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['threads'], 1)
+        self.assertEqual(report['total']['requests'], 2)
+        self.assertEqual(report['total']['errors'], 0, report['failures'])
+
+    def test_view_queries_use_indexes_on_seeded_data(self):
+        self.seed()
+        out = io.StringIO()
+        call_command('check_query_plans', verbose_plans=True, stdout=out)
+
+        self.assertTrue(out.getvalue().endswith('All querysets use an index.\n'))
+        plans = [line.strip() for line in out.getvalue().splitlines() if line.startswith('    ')]
+        self.assertTrue(plans)
+        self.assertEqual([plan for plan in plans if is_table_scan(plan)], [])
+        self.assertNotIn('FULL SCAN', out.getvalue())
+
+    def test_seeding_twice_needs_another_prefix(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            call_command('seed_scale', users=1, prefix='seeded', stdout=io.StringIO())
+
+
+class BoardPageTests(TrelloTestCase):
+
+    def board_queries(self, board):
+        caches['fragments'].clear()
+        with self.assertNumQueries(7):
+            response = self.client.get('/board/{}/'.format(board.id))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_queries_do_not_grow_with_the_board(self):
+        small = self.make_board(lists=1, cards=1)
+        big = self.make_board(lists=5, cards=20)
+        Card.objects.filter(board_list__board=big, id__in=self.card_ids(big.list_set.first())[:3]).update(archived=True)
+
+        self.board_queries(small)
+        response = self.board_queries(big)
+
+        self.assertEqual(response.content.decode().count('draggable="true" data-id='), 97)
+
+
+class RequestTimingTests(TrelloTestCase):
+
+    def test_server_timing_reports_the_queries_and_the_time(self):
+        board = self.make_board(cards=2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/board/{}/'.format(board.id))
+
+        entries = [entry.split(';') for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual([entry[0] for entry in entries], ['db', 'tpl', 'view', 'total'])
+        self.assertEqual(entries[0][2], 'desc="{} queries"'.format(len(queries)))
+        durations = [float(entry[1][len('dur='):]) for entry in entries]
+        self.assertGreater(durations[1], 0)
+        self.assertGreaterEqual(durations[3], max(durations[:3]))
+
+    def test_fingerprints_collapse_the_values(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM card WHERE id IN (1, 2, 3) AND title = 'it''s'  AND rank > %s"),
+            'SELECT * FROM card WHERE id IN (...) AND title = ? AND rank > ?',
+        )
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_their_queries(self):
+        board = self.make_board(cards=2)
+        with self.assertLogs('trello.slow', 'WARNING') as logs:
+            self.client.get('/board/{}/'.format(board.id))
+
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry['method'], entry['url_name'], entry['status']), ('GET', 'board', 200))
+        self.assertEqual(sum(group['count'] for group in entry['query_groups']), entry['queries'])
+        self.assertIn(
+            {'sql': 'SELECT MAX("trello_boardchange"."id") AS "cursor" FROM "trello_boardchange" WHERE "trello_boardchange"."board_id" = ?', 'count': 1},
+            [{'sql': group['sql'], 'count': group['count']} for group in entry['query_groups']],
+        )
+
+    def test_fast_requests_are_not_logged(self):
+        with mock.patch.object(timing.logger, 'warning') as warning:
+            self.client.get('/dashboard/')
+        self.assertFalse(warning.called)
+
+
+class ProfilingTests(TrelloTestCase):
+
+    def profiles(self):
+        directory = profiling.profile_dir()
+        return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+    def test_staff_requests_with_the_header_are_profiled(self):
+        User.objects.filter(id=self.user.id).update(is_staff=True)
+        response = self.client.get('/dashboard/', HTTP_X_PROFILE='1')
+
+        self.assertEqual(self.profiles(), [response['X-Profile-File']])
+        self.assertEqual(profiling.view_of(response['X-Profile-File']), 'dashboard')
+
+    def test_other_users_are_never_profiled(self):
+        response = self.client.get('/dashboard/', HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-File', response)
+        self.assertEqual(self.profiles(), [])
+
+    def test_user_is_not_loaded_unless_a_profile_is_asked_for(self):
+        request = RequestFactory().get('/dashboard/')
+        request.user = SimpleLazyObject(lambda: self.fail('request.user was loaded'))
+        self.assertFalse(profiling.wants_profile(request))
+
+
+class BoardSnapshotTests(TrelloTestCase):
+
+    def test_unchanged_board_answers_not_modified(self):
+        board = self.make_board(lists=2, cards=3)
+        url = '/board/{}/snapshot.json'.format(board.id)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((len(data['lists']), len(data['cards']), len(data['members'])), (2, 6, 1))
+        etag = response['ETag']
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        board_list = board.list_set.first()
+        self.client.post('/board/{}/list/'.format(board_list.id), {'card_title': 'New card'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()['cards']), 7)
+
+
+class BoardChangesTests(TrelloTestCase):
+
+    def changes(self, board, since=''):
+        response = self.client.get('/board/{}/changes/'.format(board.id), {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def add_card(self, board_list, title):
+        self.client.post('/board/{}/list/'.format(board_list.id), {'card_title': title})
+
+    def test_clients_catch_up_from_their_cursor(self):
+        board = self.make_board()
+        board_list = board.list_set.get()
+        first = self.changes(board)
+        self.assertIn('snapshot', first)
+
+        self.add_card(board_list, 'One')
+        self.add_card(board_list, 'Two')
+        delta = self.changes(board, first['cursor'])
+
+        self.assertNotIn('snapshot', delta)
+        self.assertEqual([change['data']['title'] for change in delta['changes']], ['One', 'Two'])
+        self.assertEqual(self.changes(board, delta['cursor'])['changes'], [])
+
+    def test_clients_behind_compacted_changes_get_the_snapshot(self):
+        board = self.make_board()
+        board_list = board.list_set.get()
+        self.add_card(board_list, 'One')
+        self.add_card(board_list, 'Two')
+
+        self.assertEqual(compact_changes(board.id, timezone.now() + timedelta(seconds=1)), 2)
+        caught_up = self.changes(board, 0)
+
+        self.assertEqual(len(caught_up['snapshot']['cards']), 2)
+        self.assertEqual(caught_up['changes'], [])
+
+    def test_rejects_bad_cursors(self):
+        board = self.make_board()
+        for since in ['-1', 'x', str(10 ** 30)]:
+            response = self.client.get('/board/{}/changes/'.format(board.id), {'since': since})
+            self.assertEqual(response.status_code, 400, since)
+
+
+@override_settings(BOARD_EVENTS_STREAM=True)
+class BoardEventsTests(TempFilesMixin, TransactionTestCase):
+    """
+    Events are written once the transaction commits, which the TestCase
+    transaction never does.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.client.force_login(self.user)
+        self.board = Board.objects.create(author=self.user, title='Board')
+
+    def published(self, after_id=0):
+        return [(event, json.loads(data)) for event_id, event, data in events.read_events(self.board.id, after_id)]
+
+    def test_events_are_published_once_committed(self):
+        with transaction.atomic():
+            events.publish(self.board.id, 'card.created', {'id': 1})
+            self.assertEqual(self.published(), [])
+        self.assertEqual(self.published(), [('card.created', {'id': 1})])
+
+        try:
+            with transaction.atomic():
+                events.publish(self.board.id, 'card.created', {'id': 2})
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.assertEqual(self.published(), [('card.created', {'id': 1})])
+
+    def test_nothing_is_written_while_the_stream_is_off(self):
+        with override_settings(BOARD_EVENTS_STREAM=False), mock.patch.object(events, 'get_connection') as get_connection:
+            events.publish(self.board.id, 'card.created', {'id': 1})
+            response = self.client.get('/board/{}/events/'.format(self.board.id))
+        self.assertFalse(get_connection.called)
+        self.assertEqual(response.status_code, 404)
+
+    def test_stream_resumes_after_the_last_event_id(self):
+        for card_id in (1, 2, 3):
+            events.publish(self.board.id, 'card.created', {'id': card_id})
+        first_id = events.read_events(self.board.id, 0)[0][0]
+
+        response = self.client.get('/board/{}/events/'.format(self.board.id), HTTP_LAST_EVENT_ID=str(first_id))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = response.streaming_content
+        chunks = [next(content).decode() for _ in range(3)]
+        response.close()
+
+        self.assertEqual(chunks[0], 'retry: 2000\n\n')
+        self.assertEqual(chunks[1:], [
+            'id: {}\nevent: card.created\ndata: {{"id":{}}}\n\n'.format(first_id + offset, offset + 1)
+            for offset in (1, 2)
+        ])
+
+    def test_malformed_last_event_ids_start_from_now(self):
+        events.publish(self.board.id, 'card.created', {'id': 1})
+        response = self.client.get('/board/{}/events/'.format(self.board.id), HTTP_LAST_EVENT_ID=str(10 ** 30))
+        content = response.streaming_content
+        self.assertEqual(next(content).decode(), 'retry: 2000\n\n')
+
+        events.publish(self.board.id, 'card.created', {'id': 2})
+        self.assertIn('data: {"id":2}', next(content).decode())
+        response.close()
+
+
+class InviteMembersTests(TrelloTestCase):
+
+    def invite(self, board, emails):
+        return self.client.post(
+            '/invite-members/{}/'.format(board.id), json.dumps({'emails': emails}), content_type='application/json'
+        )
+
+    def test_members_and_invites_are_added_once(self):
+        board = self.make_board()
+        member = User.objects.create_user('member', 'member@example.com', 'password')
+
+        response = self.invite(board, ['member@example.com', 'new@example.com', 'owner@example.com'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'members': [member.id], 'invited': ['new@example.com'], 'skipped': ['owner@example.com'],
+        })
+        self.assertEqual(OutgoingEmail.objects.count(), 2)
+
+        response = self.invite(board, ['member@example.com', 'new@example.com'])
+        self.assertEqual(response.json()['skipped'], ['member@example.com', 'new@example.com'])
+        self.assertEqual(BoardInvite.objects.filter(board=board).count(), 1)
+        self.assertEqual(OutgoingEmail.objects.count(), 2)
+
+    def test_invalid_emails_invite_nobody(self):
+        board = self.make_board()
+        response = self.invite(board, ['new@example.com', 'not an email'])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['emails'], ['not an email'])
+        self.assertFalse(BoardInvite.objects.exists())
+
+    def test_rejects_malformed_bodies(self):
+        board = self.make_board()
+        for body in ['{"emails": "new@example.com"}', '{"emails": [1]}', '{"emails": []}', '[1]', 'nope']:
+            with self.subTest(body=body):
+                response = self.client.post('/invite-members/{}/'.format(board.id), body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+
+
+class SearchTests(TrelloTestCase):
+
+    def search(self, text, **params):
+        response = self.client.get('/search/', dict(params, q=text))
+        self.assertEqual(response.status_code, 200)
+        return [card['title'] for card in response.json()['cards']]
+
+    def test_finds_cards_of_the_user_boards_by_word_prefix(self):
+        board = self.make_board()
+        board_list = board.list_set.get()
+        Card.objects.create(board_list=board_list, author=self.user, card_title='Release notes', rank='a')
+        Card.objects.create(board_list=board_list, author=self.user, card_title='Budget', card_description='Notes on release', rank='b')
+        archived = Card.objects.create(board_list=board_list, author=self.user, card_title='Old release', rank='c')
+        Card.objects.filter(id=archived.id).update(archived=True)
+        stranger = User.objects.create_user('stranger', 'stranger@example.com', 'password')
+        other = self.make_board(author=stranger)
+        Card.objects.create(board_list=other.list_set.get(), author=stranger, card_title='Release party', rank='a')
+
+        # Title matches rank first.
+        self.assertEqual(self.search('relea'), ['Release notes', 'Budget'])
+        self.assertEqual(self.search('release', archived='1'), ['Release notes', 'Old release', 'Budget'])
+        self.assertEqual(self.search('notes release'), ['Release notes', 'Budget'])
+
+    def test_rebuild_reindexes_every_card(self):
+        board = self.make_board()
+        card = Card.objects.create(board_list=board.list_set.get(), author=self.user, card_title='Release notes', rank='a')
+        with connection.cursor() as cursor:
+            # Index drift, e.g. rows changed while the triggers were off.
+            cursor.execute(
+                "INSERT INTO trello_card_search (trello_card_search, rowid, card_title, card_description) VALUES ('delete', %s, %s, %s)",
+                [card.id, card.card_title, card.card_description],
+            )
+        self.assertEqual(self.search('release'), [])
+
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertEqual(out.getvalue(), 'Rebuilt the search index of 1 cards.\n')
+        self.assertEqual(self.search('release'), ['Release notes'])
+
+    def test_search_syntax_is_searched_as_words(self):
+        self.assertEqual(self.search('"release" OR NEAR('), [])
+        self.assertEqual(self.search(''), [])
+
+
+class ArchiveSelectionTests(TrelloTestCase):
+
+    def post_selection(self, url, selection):
+        return self.client.post(url, json.dumps(selection), content_type='application/json')
+
+    def test_archives_and_restores_a_selection(self):
+        board = self.make_board(lists=2, cards=2)
+        first, second = board.list_set.order_by('rank')
+        cards = self.card_ids(first)
+        stranger = User.objects.create_user('stranger', 'stranger@example.com', 'password')
+        foreign = self.card_ids(self.make_board(cards=1, author=stranger).list_set.get())
+
+        response = self.post_selection('/archive/selection/', {'cards': cards + foreign, 'lists': [second.id]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['cards'], cards)
+        self.assertEqual(response.json()['lists'], [second.id])
+        self.assertEqual(Card.objects.filter(archived=True).count(), 2)
+        self.assertTrue(List.objects.get(id=second.id).archived)
+        self.assertEqual(BoardChange.objects.filter(board=board, event='cards.archived').count(), 1)
+
+        response = self.post_selection('/restore/selection/', {'cards': cards, 'lists': [second.id]})
+        self.assertEqual(response.json()['cards'], cards)
+        self.assertFalse(Card.objects.filter(archived=True).exists())
+        self.assertFalse(List.objects.filter(archived=True).exists())
+
+    def test_archives_every_list_of_a_board(self):
+        board = self.make_board(lists=3)
+        response = self.client.post('/board/{}/archive-lists/'.format(board.id))
+        self.assertEqual(len(response.json()['lists']), 3)
+        self.assertEqual(self.client.post('/board/{}/archive-lists/'.format(board.id)).json()['lists'], [])
+
+    def test_rejects_malformed_selections(self):
+        for selection in [{'cards': 'x'}, {'cards': {'1': 1}}, {'lists': [None]}, {'boards': 1}, [1], 'x',
+                          {'cards': [10 ** 30]}, {'lists': [0]}, {'boards': [-1]}]:
+            with self.subTest(selection=selection):
+                response = self.post_selection('/archive/selection/', selection)
+                self.assertEqual(response.status_code, 400)
+
+
+class CopyBoardTests(TrelloTestCase):
+
+    def test_copies_visible_lists_and_cards(self):
+        member = User.objects.create_user('member', 'member@example.com', 'password')
+        board = self.make_board(lists=3, cards=4)
+        BoardMembers.objects.create(board=board, members=member, deactivate=False)
+        first, second, third = board.list_set.order_by('rank')
+        List.objects.filter(id=third.id).update(archived=True)
+        Card.objects.filter(id=self.card_ids(first)[0]).update(archived=True)
+        image = store_upload(SimpleUploadedFile('cover.png', b'cover image'))
+        Card.objects.filter(id=self.card_ids(second)[0]).update(image=image)
+
+        response = self.client.post('/board/{}/copy/'.format(board.id), {'members': '1', 'template': '1'})
+
+        self.assertEqual(response.status_code, 200)
+        copy = Board.objects.get(id=response.json()['board'])
+        self.assertEqual((copy.title, copy.is_template, copy.author), ('Copy of Board', True, self.user))
+        self.assertEqual(sorted(copy.boardmembers_set.values_list('members__username', flat=True)), ['member', 'owner'])
+        copied = [
+            list(board_list.card_set.order_by('rank').values_list('card_title', 'rank'))
+            for board_list in copy.list_set.order_by('rank')
+        ]
+        original = [
+            list(board_list.card_set.filter(archived=False).order_by('rank').values_list('card_title', 'rank'))
+            for board_list in (first, second)
+        ]
+        self.assertEqual(copied, original)
+        self.assertEqual(ImageBlob.objects.get(name=image).refcount, 2)
+
+    def test_cannot_copy_boards_of_others(self):
+        stranger = User.objects.create_user('stranger', 'stranger@example.com', 'password')
+        board = self.make_board(author=stranger)
+        self.assertEqual(self.client.post('/board/{}/copy/'.format(board.id)).status_code, 404)
+
+
+class FragmentCacheTests(TrelloTestCase):
+
+    def render(self, board_id):
+        return render_board_lists(Board.objects.get(id=board_id))
+
+    def test_unchanged_board_is_served_from_the_cache(self):
+        board = self.make_board(lists=2, cards=3)
+        html = self.render(board.id)
+        board = Board.objects.get(id=board.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(render_board_lists(board), html)
+
+    def test_changes_show_up_and_replace_the_cached_board(self):
+        board = self.make_board(lists=2, cards=3)
+        self.render(board.id)
+        card_id = self.card_ids(board.list_set.order_by('rank').first())[0]
+
+        self.client.post('/description/{}/'.format(card_id), {'card_title': 'Renamed card', 'card_description': ''})
+
+        board = Board.objects.get(id=board.id)
+        self.assertIn('Renamed card', render_board_lists(board))
+        version, html = caches['fragments'].get(board_key(board))
+        self.assertEqual(version, board.version)
+
+    def test_titles_are_escaped(self):
+        board = self.make_board()
+        Card.objects.create(board_list=board.list_set.get(), author=self.user, card_title='<b>bold</b>', rank='a')
+        html = self.render(board.id)
+        self.assertIn('&lt;b&gt;bold&lt;/b&gt;', html)
+        self.assertNotIn('csrfmiddlewaretoken', html)
+
+
+class TransactionModeTests(TransactionTestCase):
+
+    def begins(self, block):
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            if sql.startswith('BEGIN'):
+                statements.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            with block():
+                Board.objects.count()
+        return statements
+
+    def test_writes_take_the_lock_up_front(self):
+        self.assertEqual(self.begins(transaction.atomic), ['BEGIN IMMEDIATE'])
+
+    def test_reads_do_not(self):
+        self.assertEqual(self.begins(read_transaction), ['BEGIN'])
+        self.assertEqual(self.begins(transaction.atomic), ['BEGIN IMMEDIATE'])
+
+
+@override_settings(REPLICA_DATABASES=['replica1'], REPLICA_URL_NAMES={'board'})
+class ReplicaRoutingTests(SimpleTestCase):
+
+    def route(self, method, path, write=False, cookies=None):
+        """
+        The database the request reads from, and its response.
+        """
+
+        request = getattr(RequestFactory(), method)(path)
+        request.COOKIES.update(cookies or {})
+        request.resolver_match = resolve(path)
+        used = []
+
+        def view(request):
+            middleware.process_view(request, None, (), {})
+            used.append(router.db_for_read(Board))
+            if write:
+                router.db_for_write(Board)
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(view)
+        response = middleware(request)
+        return used[0], response
+
+    def test_read_only_pages_read_from_a_replica(self):
+        self.assertEqual(self.route('get', '/board/1/')[0], 'replica1')
+        self.assertEqual(self.route('get', '/board/1/snapshot.json')[0], 'default')
+        self.assertEqual(self.route('post', '/board/1/')[0], 'default')
+        self.assertEqual(router.db_for_read(Board), 'default')
+
+    def test_writers_stick_to_the_primary(self):
+        database, response = self.route('post', '/board/1/list/', write=True)
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertNotIn(STICKY_COOKIE, self.route('get', '/board/1/')[1].cookies)
+        self.assertEqual(self.route('get', '/board/1/', cookies={STICKY_COOKIE: '1'})[0], 'default')
@@ -0,0 +1,165 @@
+"""
+Per-request timing of the database, the templates and the view.
+
+RequestTimingMiddleware counts the queries run by the request and their
+time through a database execute wrapper, and the time spent rendering
+templates, then reports them with the total in a 'Server-Timing' header,
+shown by the browser's network panel:
+
+    Server-Timing: db;dur=12.1;desc="9 queries", tpl;dur=4.0, view;dur=8.3, total;dur=24.4
+
+'view' is the time left to Python: the view, forms and the middlewares.
+
+Requests slower than settings.SLOW_REQUEST_MS are logged to 'trello.slow'
+as one JSON object with the queries grouped by fingerprint (the SQL with
+its literals and IN lists collapsed), most repeated first, so an N+1 loop
+shows up as one fingerprint run once per row.
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import Template
+from django.urls import Resolver404, resolve
+
+
+logger = logging.getLogger('trello.slow')
+
+SLOW_REQUEST_MS = 500
+SLOW_QUERY_GROUPS = 20
+
+_current = threading.local()
+
+FINGERPRINT_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint(sql):
+    """
+    The SQL with the values replaced, so the same query run with other
+    parameters or IN lists of other lengths gives the same fingerprint.
+    """
+
+    for pattern, replacement in FINGERPRINT_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.fingerprints = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        """
+        Execute wrapper, see connection.execute_wrapper().
+        """
+
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db_time += elapsed
+            key = fingerprint(sql)
+            count, total = self.fingerprints.get(key, (0, 0.0))
+            self.fingerprints[key] = (count + 1, total + elapsed)
+
+    def grouped_queries(self, limit=SLOW_QUERY_GROUPS):
+        groups = sorted(self.fingerprints.items(), key=lambda item: (-item[1][0], -item[1][1]))
+        return [
+            {'sql': sql, 'count': count, 'ms': round(total * 1000, 1)}
+            for sql, (count, total) in groups[:limit]
+        ]
+
+
+def render_timed(render):
+    def timed(self, *args, **kwargs):
+        stats = getattr(_current, 'stats', None)
+        if stats is None:
+            return render(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            stats.template_time += time.perf_counter() - started
+    timed.timed = True
+    return timed
+
+
+# Only the top-level render of each template is counted, the includes it
+# renders are part of it.
+if not getattr(Template.render, 'timed', False):
+    Template.render = render_timed(Template.render)
+
+
+def url_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+    return match.url_name
+
+
+class RequestTimingMiddleware:
+    """
+    Put it first in MIDDLEWARE, after trello.metrics.MetricsMiddleware only,
+    so the time of the others is counted too. The stats are left on the
+    request as 'request.timing'.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        request.timing = stats
+        _current.stats = stats
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _current.stats = None
+        total = time.perf_counter() - started
+
+        view_time = max(total - stats.db_time - stats.template_time, 0)
+        response['Server-Timing'] = ', '.join([
+            'db;dur={:.1f};desc="{} queries"'.format(stats.db_time * 1000, stats.queries),
+            'tpl;dur={:.1f}'.format(stats.template_time * 1000),
+            'view;dur={:.1f}'.format(view_time * 1000),
+            'total;dur={:.1f}'.format(total * 1000),
+        ])
+
+        if total * 1000 >= getattr(settings, 'SLOW_REQUEST_MS', SLOW_REQUEST_MS):
+            logger.warning(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'url_name': url_name(request),
+                'status': response.status_code,
+                'total_ms': round(total * 1000, 1),
+                'db_ms': round(stats.db_time * 1000, 1),
+                'template_ms': round(stats.template_time * 1000, 1),
+                'view_ms': round(view_time * 1000, 1),
+                'queries': stats.queries,
+                'query_groups': stats.grouped_queries(),
+            }))
+        return response
@@ -0,0 +1,260 @@
+"""
+Export and import of whole boards as NDJSON, one JSON record per line.
+
+The export streams the board, its members, lists and cards straight from
+values() iterators read in chunks, so memory stays flat whatever the board
+size, all within one read transaction. Records reference each other by their ids in the source database and
+users by email. With images, each stored cover is written once as an
+'image' record (base64) before the first card that uses it.
+
+The import reads the records one line at a time and inserts them with
+bulk_create in batches. The new board is kept pending deletion until the
+last batch is in, so a failed import is never shown and is cleaned up by
+the purge_boards worker.
+"""
+
+import base64
+import hashlib
+import json
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import router, transaction
+from django.utils import timezone
+
+from .blobs import acquire, blob_name, image_storage
+from .images import DERIVATIVES, derivative_name
+from .models import Board, BoardMembers, Card, ImageBlob, List, invalidate_dashboards
+from .queries import bulk_create_ids, read_transaction
+
+
+FORMAT = 1
+EXPORT_CHUNK_SIZE = 2000
+IMPORT_BATCH_SIZE = 500
+
+
+def dump(record):
+    return json.dumps(record, separators=(',', ':'), default=str) + '\n'
+
+
+def export_board(board, images=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the NDJSON lines of the board. With 'images', the cover files are
+    included too.
+    """
+
+    yield dump({
+        'type': 'board', 'format': FORMAT, 'id': board.id, 'title': board.title,
+        'archived': board.archived, 'author': board.author.email, 'created_date': board.created_date,
+    })
+
+    # One read transaction, so members, lists and cards are read from the
+    # same state of the board even when it changes during a long export.
+    with read_transaction(using=router.db_for_read(Board)):
+        members = BoardMembers.objects.filter(board=board).order_by('id').values_list(
+            'members__email', 'deactivate', 'owner'
+        )
+        for email, deactivate, owner in members.iterator(chunk_size=chunk_size):
+            yield dump({'type': 'member', 'user': email, 'deactivate': deactivate, 'owner': owner})
+
+        lists = List.objects.filter(board=board).order_by('rank', 'id').values_list(
+            'id', 'list_title', 'rank', 'archived', 'author__email', 'created_date'
+        )
+        for pk, title, rank, archived, author, created_date in lists.iterator(chunk_size=chunk_size):
+            yield dump({
+                'type': 'list', 'id': pk, 'title': title, 'rank': rank, 'archived': archived,
+                'author': author, 'created_date': created_date,
+            })
+
+        cards = Card.objects.filter(board_list__board=board).order_by('board_list_id', 'rank', 'id').values_list(
+            'id', 'board_list_id', 'card_title', 'card_description', 'rank', 'archived', 'image', 'author__email', 'created_date'
+        )
+        exported_images = set()
+        for pk, list_id, title, description, rank, archived, image, author, created_date in cards.iterator(chunk_size=chunk_size):
+            if images and image and image not in exported_images:
+                exported_images.add(image)
+                line = image_record(image)
+                if line:
+                    yield line
+            yield dump({
+                'type': 'card', 'id': pk, 'list': list_id, 'title': title, 'description': description,
+                'rank': rank, 'archived': archived, 'image': image or None, 'author': author, 'created_date': created_date,
+            })
+
+
+def image_record(name):
+    storage = image_storage()
+    if not storage.exists(name):
+        return None
+    with storage.open(name, 'rb') as image:
+        data = image.read()
+    return dump({'type': 'image', 'name': name, 'data': base64.b64encode(data).decode('ascii')})
+
+
+class BoardImporter:
+    """
+    Rebuild a board from export_board records, fed one at a time to add().
+    Users are matched by email; unknown authors become 'user', unknown
+    members are skipped and their emails listed in 'skipped_members'.
+    """
+
+    def __init__(self, user, batch_size=IMPORT_BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.board = None
+        self.users = {}
+        self.list_ids = {}
+        self.image_names = {}
+        self.members = []
+        self.lists = []
+        self.cards = []
+        self.counts = {'member': 0, 'list': 0, 'card': 0, 'image': 0}
+        self.skipped_members = []
+
+    def add(self, record):
+        kind = record.get('type')
+        if self.board is None:
+            if kind != 'board' or record.get('format') != FORMAT:
+                raise ValueError('Not a board export.')
+            self.create_board(record)
+        elif kind == 'member':
+            self.members.append(record)
+            if len(self.members) >= self.batch_size:
+                self.flush_members()
+        elif kind == 'list':
+            self.lists.append(record)
+            if len(self.lists) >= self.batch_size:
+                self.flush_lists()
+        elif kind == 'card':
+            self.flush_lists()
+            self.cards.append(record)
+            if len(self.cards) >= self.batch_size:
+                self.flush_cards()
+        elif kind == 'image':
+            self.store_image(record)
+        else:
+            raise ValueError('Unknown record {!r}.'.format(kind))
+
+    def finish(self):
+        if self.board is None:
+            raise ValueError('Empty export.')
+        self.flush_members()
+        self.flush_lists()
+        self.flush_cards()
+        Board.all_objects.filter(id=self.board.id).update(deleted_date=None)
+        members = BoardMembers.objects.filter(board=self.board).values_list('members_id', flat=True)
+        invalidate_dashboards(self.board.author_id, *members)
+        return self.board
+
+    def resolve_users(self, emails):
+        missing = set(emails) - set(self.users)
+        if missing:
+            for pk, email in User.objects.filter(email__in=missing).values_list('id', 'email'):
+                self.users.setdefault(email, pk)
+            for email in missing:
+                self.users.setdefault(email, None)
+
+    def author_id(self, email):
+        return self.users.get(email) or self.user.id
+
+    def create_board(self, record):
+        self.resolve_users([record['author']])
+        self.board = Board.all_objects.create(
+            title=record['title'], archived=record['archived'], author_id=self.author_id(record['author']),
+            deleted_date=timezone.now(),
+        )
+
+    def flush_members(self):
+        if not self.members:
+            return
+        self.resolve_users([record['user'] for record in self.members])
+        members = [
+            BoardMembers(board=self.board, members_id=self.users[record['user']],
+                         deactivate=record['deactivate'], owner=record['owner'])
+            for record in self.members if self.users[record['user']]
+        ]
+        BoardMembers.objects.bulk_create(members)
+        self.skipped_members += [record['user'] for record in self.members if not self.users[record['user']]]
+        self.counts['member'] += len(members)
+        self.members = []
+
+    def flush_lists(self):
+        """
+        The exported list ids are mapped to the new ones, for the cards.
+        """
+
+        if not self.lists:
+            return
+        self.resolve_users([record['author'] for record in self.lists])
+        new_ids = bulk_create_ids([
+            List(board=self.board, list_title=record['title'], rank=record['rank'],
+                 archived=record['archived'], author_id=self.author_id(record['author']))
+            for record in self.lists
+        ], board=self.board)
+        for record, new_id in zip(self.lists, new_ids):
+            self.list_ids[record['id']] = new_id
+        self.counts['list'] += len(self.lists)
+        self.lists = []
+
+    def flush_cards(self):
+        if not self.cards:
+            return
+        self.resolve_users([record['author'] for record in self.cards])
+        storage = image_storage()
+        cards = []
+        for record in self.cards:
+            if record['list'] not in self.list_ids:
+                raise ValueError('Card {} is on unknown list {}.'.format(record['id'], record['list']))
+            card = Card(
+                board_list_id=self.list_ids[record['list']], card_title=record['title'],
+                card_description=record['description'], rank=record['rank'], archived=record['archived'],
+                author_id=self.author_id(record['author']),
+            )
+            image = self.image_names.get(record['image'], record['image'])
+            if image and storage.exists(image):
+                card.image = image
+                # Derivatives are shared by identical images, reuse them when present.
+                derivatives = {kind: derivative_name(image, kind) for kind in DERIVATIVES}
+                if all(storage.exists(name) for name in derivatives.values()):
+                    card.thumbnail = derivatives['thumbnail']
+                    card.preview = derivatives['preview']
+            cards.append(card)
+        with transaction.atomic():
+            Card.objects.bulk_create(cards)
+            acquire(*[card.image.name for card in cards if card.image])
+        self.counts['card'] += len(self.cards)
+        self.cards = []
+
+    def store_image(self, record):
+        """
+        Store the file under its content hash unless it is there already.
+        References are taken when the cards using it are inserted.
+        """
+
+        data = base64.b64decode(record['data'])
+        digest = hashlib.sha256(data).hexdigest()
+        name = blob_name(digest, record['name'])
+        storage = image_storage()
+        if not storage.exists(name):
+            storage.save(name, ContentFile(data))
+        ImageBlob.objects.get_or_create(digest=digest, defaults={'name': name, 'size': len(data)})
+        self.image_names[record['name']] = ImageBlob.objects.filter(digest=digest).values_list('name', flat=True).get()
+        self.counts['image'] += 1
+
+
+def import_board(lines, user, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Import the board exported in the NDJSON 'lines' (any iterable of lines,
+    e.g. an open file). Returns the importer, with the new board in
+    'importer.board', the counts of what was created in 'importer.counts'
+    and the emails of the members left out in 'importer.skipped_members'.
+    """
+
+    importer = BoardImporter(user, batch_size)
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if line.strip():
+            importer.add(json.loads(line))
+    importer.finish()
+    return importer
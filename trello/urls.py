@@ -7,10 +7,17 @@ from trello.views import (
         DashBoardView,
         LogoutView,
         BoardView,
+        BoardSnapshotView,
+        BoardEventsView,
+        BoardExportView,
+        CopyBoardView,
+        BoardChangesView,
         CreateBoardView,
         AddCardView,
         CardDescriptionView,
         CardDragAndDropView,
+        CardBatchMoveView,
+        ListDragAndDropView,
         UpdateBoard,
         UpdateListView,
         DeleteBoardView,
@@ -20,7 +27,13 @@ from trello.views import (
         BoardArchiveView,
         ListArchiveView,
         CardArchiveView,
+        ListCardsArchiveView,
+        BoardListsArchiveView,
+        SelectionArchiveView,
         InviteMemberView,
+        InviteMembersView,
+        SearchView,
+        MetricsView,
         LeaveBoardView,
         RestoreArchivedBoard,
         RestoreArchivedList,
@@ -49,10 +62,18 @@ urlpatterns = [
     path('create-board/', CreateBoardView.as_view(), name='create-board'),
     path('board/<int:id>/', BoardView.as_view(), name='board'),
     path('board/<int:id>/list/', AddCardView.as_view(), name='add-card'),
+    path('board/<int:id>/snapshot.json', BoardSnapshotView.as_view(), name='board-snapshot'),
+    path('board/<int:id>/events/', BoardEventsView.as_view(), name='board-events'),
+    path('board/<int:id>/export.ndjson', BoardExportView.as_view(), name='board-export'),
+    path('board/<int:id>/copy/', CopyBoardView.as_view(), name='copy-board'),
+    path('board/<int:id>/changes/', BoardChangesView.as_view(), name='board-changes'),
     path('invite-member/<int:id>/', InviteMemberView.as_view(), name='invite-member'),
+    path('invite-members/<int:id>/', InviteMembersView.as_view(), name='invite-members'),
     path('leave-board/<int:id>/', LeaveBoardView.as_view(), name='leave-board'),
     path('description/<int:id>/', CardDescriptionView.as_view(), name='description'),
     path('drag-and-drop/<int:id>/', CardDragAndDropView.as_view(), name='drag-and-drop'),
+    path('drag-and-drop/batch/', CardBatchMoveView.as_view(), name='batch-move'),
+    path('drag-list/<int:id>/', ListDragAndDropView.as_view(), name='drag-list'),
 
     path('board/<int:id>/edit-board/', UpdateBoard.as_view(), name='edit-board'),
     path('edit-list/<int:id>/', UpdateListView.as_view(), name='edit-list'),
@@ -62,6 +83,14 @@ urlpatterns = [
     path('board/<int:id>/delete-board/', DeleteBoardView.as_view(), name='delete-board'),
 
     path('archive/', ArchiveView.as_view(), name='archive'),
+    path('list/<int:id>/archive-cards/', ListCardsArchiveView.as_view(), name='archive-list-cards'),
+    path('list/<int:id>/restore-cards/', ListCardsArchiveView.as_view(archived=False), name='restore-list-cards'),
+    path('board/<int:id>/archive-lists/', BoardListsArchiveView.as_view(), name='archive-board-lists'),
+    path('board/<int:id>/restore-lists/', BoardListsArchiveView.as_view(archived=False), name='restore-board-lists'),
+    path('archive/selection/', SelectionArchiveView.as_view(), name='archive-selection'),
+    path('restore/selection/', SelectionArchiveView.as_view(archived=False), name='restore-selection'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     path('board-archive/<int:id>/', BoardArchiveView.as_view(), name='board-archive'),
     path('list-archive/<int:id>/', ListArchiveView.as_view(), name='list-archive'),
     path('card-archive/<int:id>/', CardArchiveView.as_view(), name='card-archive'),
@@ -8,10 +8,13 @@ from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth import update_session_auth_hash
 from django.contrib import messages
-from django.core.mail import send_mail
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
+from django.utils.http import parse_etags
+from django.db import router, transaction
 from django.utils import timezone
 from django.conf import settings
 
@@ -35,8 +38,40 @@ from .models import (
     BoardInvite,  
     UserProfile
 )
+from .activity import changes_since, latest_change, notify
+from .archiving import accessible_boards, archive_boards, archive_cards, archive_lists
+from .blobs import release, store_upload
+from .copying import copy_board
+from .fragments import render_board_lists
+from .images import queue_derivatives
+from .purge import mark_deleted
+from . import events, metrics, outbox
+from .queries import (
+    MAX_ID,
+    board_snapshot,
+    keyset_page,
+    live_cards,
+    live_lists,
+    load_board,
+    load_dashboard,
+    parse_id,
+    read_transaction,
+    update_in_bulk,
+    visible_cards,
+)
+from .ranking import (
+    neighbour_rank,
+    next_card_rank,
+    next_list_rank,
+    plan_moves,
+    rebalance_cards,
+    rebalance_lists,
+)
+from .search import search_cards
+from .transfer import export_board
 
 import json
+from collections import OrderedDict
 
 
 """
@@ -138,10 +173,7 @@ class DashBoardView(LoginRequiredMixin, TemplateView):
     form = AddBoardTitleForm
 
     def get(self, *args, **kwargs):
-        board = Board.objects.filter(author=self.request.user, archived=False).order_by('id')
-        board_member = BoardMembers.objects.filter(members=self.request.user).order_by('id')
-        board_owner = BoardMembers.objects.filter(owner=True)
-        context = {'board':board, 'board_member':board_member, 'board_owner':board_owner}
+        context = load_dashboard(self.request.user)
         return render(self.request, self.template_name, context)
  
 
@@ -199,10 +231,15 @@ class BoardView(LoginRequiredMixin, TemplateView):
         """
 
         form = self.form()
-        board = get_object_or_404(Board, id=kwargs.get("id")) 
-        board_members = BoardMembers.objects.filter(board=board).order_by('id')
+        board, board_members = load_board(kwargs.get('id'))
         board_form = self.board_form(self.request.POST, instance=board)
-        context = {'board':board, 'board_members':board_members, 'form':form, 'board_form':board_form}
+        # Read before the lists, changes made meanwhile are replayed by the page.
+        changes_cursor = latest_change(board.id)
+        context = {
+            'board':board, 'board_members':board_members, 'form':form, 'board_form':board_form,
+            'board_lists':render_board_lists(board), 'changes_cursor':changes_cursor,
+            'events_stream':events.stream_enabled(),
+        }
         return render(self.request, self.template_name, context)    
 
     def post(self, *args, **kwargs):
@@ -211,7 +248,9 @@ class BoardView(LoginRequiredMixin, TemplateView):
             board_list = form.save(commit=False)
             board_list.board = get_object_or_404(Board, id=kwargs.get('id'))
             board_list.author = self.request.user
+            board_list.rank = next_list_rank(board_list.board.id)
             board_list.save()
+            notify(board_list.board.id, 'list.created', id=board_list.id, title=board_list.list_title, rank=board_list.rank)
             return JsonResponse({'board_list':board_list.list_title, 'id':board_list.id})
         else: 
             return HttpResponse(status=400)
@@ -227,10 +266,12 @@ class AddCardView(LoginRequiredMixin, TemplateView):
     """
 
     def post(self, request, *args, **kwargs):
-        card_list = get_object_or_404(List, id=kwargs.get('id'))
+        card_list = get_object_or_404(live_lists(), id=kwargs.get('id'))
         title = self.request.POST.get('card_title')
-        card = Card.objects.create(card_title=title, board_list=card_list, author=self.request.user)
-        return JsonResponse({'card':card.card_title, 'id':card.id})
+        rank = next_card_rank(card_list.id)
+        card = Card.objects.create(card_title=title, board_list=card_list, author=self.request.user, rank=rank)
+        notify(card_list.board_id, 'card.created', id=card.id, list=card_list.id, title=card.card_title, rank=rank)
+        return JsonResponse({'card':card.card_title, 'id':card.id, 'rank':rank})
 
 
 class CardDescriptionView(LoginRequiredMixin, TemplateView):
@@ -245,7 +286,7 @@ class CardDescriptionView(LoginRequiredMixin, TemplateView):
     title_form = EditCardTitleForm
 
     def get(self, *args, **kwargs):
-        card = get_object_or_404(Card, id=kwargs.get('id'))
+        card = get_object_or_404(live_cards(), id=kwargs.get('id'))
         form = self.form()
         title_form = self.title_form(instance=card)
         context = {'form':form, 'title_form':title_form, 'card':card}
@@ -253,7 +294,7 @@ class CardDescriptionView(LoginRequiredMixin, TemplateView):
 
     def post(self, *args, **kwargs):
         #import pdb; pdb.set_trace()
-        card = get_object_or_404(Card, id=kwargs.get('id'))
+        card = get_object_or_404(live_cards(), id=kwargs.get('id'))
         title_form = self.title_form(self.request.POST, instance=card)
 
         if title_form.is_valid():
@@ -261,34 +302,277 @@ class CardDescriptionView(LoginRequiredMixin, TemplateView):
            
             if update_card.card_title is None:
                 update_card.card_title = card.card_title
-                print('WALA')
 
-            print(card.card_title)
             update_card.author = self.request.user 
             update_card.board_list = card.board_list 
             update_card.save()
-            return JsonResponse({'card': update_card.card_title, 'id': update_card.id, 'card_description': update_card.card_description, 'board': update_card.board_list.board.id})
+            notify(update_card.board_list.board_id, 'card.updated', id=update_card.id, title=update_card.card_title)
+            return JsonResponse({'card': update_card.card_title, 'id': update_card.id, 'card_description': update_card.card_description, 'board': update_card.board_list.board_id})
         return render(self.request, self.template_name, {'form':title_form})
 
 
+class BoardSnapshotView(LoginRequiredMixin, View):
+    """
+    Return the visible lists, cards and members of a board as compact JSON.
+
+    The ETag is the board version, which every mutation bumps. A client
+    sending it back in If-None-Match gets an empty 304 for the cost of
+    reading one board row while nothing changed.
+    """
+
+    def get(self, *args, **kwargs):
+        # One read transaction, on the replica serving the request if any.
+        with read_transaction(using=router.db_for_read(Board)):
+            board = get_object_or_404(Board.objects.values('id', 'title', 'version'), id=kwargs.get('id'))
+            etag = '"{}.{}"'.format(board['id'], board['version'])
+
+            if etag in parse_etags(self.request.META.get('HTTP_IF_NONE_MATCH', '')):
+                response = HttpResponse(status=304)
+            else:
+                response = JsonResponse(board_snapshot(board), json_dumps_params={'separators': (',', ':')})
+
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class BoardChangesView(LoginRequiredMixin, View):
+    """
+    Return the changes made to a board after the cursor given in 'since'.
+    Clients that were idle for hours catch up with a small delta instead
+    of the whole board; see activity.changes_since for the format.
+    """
+
+    def get(self, *args, **kwargs):
+        board = get_object_or_404(Board.objects.values('id', 'title', 'version'), id=kwargs.get('id'))
+        since = self.request.GET.get('since', '')
+        if since and not (since.isdigit() and int(since) <= MAX_ID):
+            return JsonResponse({'error':'Invalid cursor.'}, status=400)
+
+        changes = changes_since(board, int(since) if since else None)
+        return JsonResponse(changes, json_dumps_params={'separators': (',', ':')})
+
+
+class CopyBoardView(LoginRequiredMixin, View):
+    """
+    Copy the board with its non-archived lists and cards, see
+    trello/copying.py
+    'title' is the title of the copy, the original's by default.
+    'members=1' makes the board's members members of the copy too.
+    'template=1' saves the copy as a template.
+    """
+
+    def post(self, *args, **kwargs):
+        board = get_object_or_404(accessible_boards(self.request.user), id=kwargs.get('id'))
+        title = self.request.POST.get('title', '').strip()
+        if not title:
+            title = board.title if board.is_template else 'Copy of {}'.format(board.title)
+        copy = copy_board(
+            board, self.request.user, title[:200],
+            members=self.request.POST.get('members') == '1',
+            is_template=self.request.POST.get('template') == '1',
+        )
+        return JsonResponse({'board':copy.id})
+
+
+class BoardExportView(LoginRequiredMixin, View):
+    """
+    Download the board as NDJSON, see trello/transfer.py
+    'images=1' includes the cover image files.
+    """
+
+    def get(self, *args, **kwargs):
+        board = get_object_or_404(accessible_boards(self.request.user).select_related('author'), id=kwargs.get('id'))
+        lines = export_board(board, images=self.request.GET.get('images') == '1')
+        response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="board-{}.ndjson"'.format(board.id)
+        return response
+
+
+class MetricsView(View):
+    """
+    Metrics of all the workers in the Prometheus text format, see
+    trello/metrics.py. Only served to settings.METRICS_ALLOWED_IPS.
+    """
+
+    def get(self, *args, **kwargs):
+        if self.request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1']):
+            return HttpResponse(status=403)
+        text = metrics.render({'trello_email_outbox_depth': outbox.pending()})
+        return HttpResponse(text, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class BoardEventsView(LoginRequiredMixin, View):
+    """
+    Stream the changes of a board as Server-Sent Events (card created,
+    moved, renamed or archived, list renamed, ...) so collaborators see
+    each other's changes without reloading the board.
+
+    A stream lasts about a minute, then the browser reconnects and sends
+    the Last-Event-ID it got, so no event is missed in between. A stream
+    holds its worker all along, so it is only served with
+    settings.BOARD_EVENTS_STREAM, see trello/events.py; otherwise the
+    board page polls BoardChangesView.
+    """
+
+    def get(self, *args, **kwargs):
+        if not events.stream_enabled():
+            return HttpResponse(status=404)
+        board = get_object_or_404(Board.objects.values('id'), id=kwargs.get('id'))
+        last_id = self.request.META.get('HTTP_LAST_EVENT_ID') or self.request.GET.get('last_id')
+        after_id = int(last_id) if last_id and last_id.isdigit() and int(last_id) <= MAX_ID else None
+
+        response = StreamingHttpResponse(events.stream(board['id'], after_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+def neighbour_ids(data):
+    """
+    The 'before' and 'after' ids of a drop, None when left blank.
+    """
+
+    return tuple(parse_id(data[name]) if data.get(name) else None for name in ('before', 'after'))
+
+
 class CardDragAndDropView(LoginRequiredMixin, View):
     """
-    Drag and drop card to a list and update it's list.
-    1. Get the value of the dragged and dropped card, and the value of 
-       the list it was dropped.
-    2. Set the new list value of card with the value of the list it was
-       dropped.
-    3. Save.
+    Drag and drop card to a list and update it's list and position.
+    1. Get the value of the dragged and dropped card, the value of 
+       the list it was dropped and the cards it was dropped between
+       ('before' is the card above it, 'after' the card below it).
+    2. Compute a rank that sorts between the two neighbours. Without
+       neighbours the card goes to the bottom of the list.
+    3. Update only the dropped card, its siblings are never renumbered.
     """
 
     def post (self, *args, **kwargs):
-        drop_list = self.request.POST.get('blist')
-        card = self.request.POST.get('card')
-        current_card = Card.objects.get(id=card)
-        current_list = List.objects.get(id=drop_list)
-        current_card.board_list = current_list
-        current_card.save()
-        return JsonResponse({'card':current_card.id})
+        try:
+            drop_list = parse_id(self.request.POST.get('blist'))
+            card = parse_id(self.request.POST.get('card'))
+            before, after = neighbour_ids(self.request.POST)
+        except (ValueError, TypeError):
+            return JsonResponse({'error':'Invalid card or list.'}, status=400)
+        current_list = get_object_or_404(live_lists(), id=drop_list)
+        siblings = Card.objects.filter(board_list=current_list).exclude(id=card)
+
+        rank = neighbour_rank(siblings, before, after)
+        if rank is None:
+            rebalance_cards(current_list.id)
+            rank = neighbour_rank(siblings, before, after)
+        if rank is None:
+            # The neighbours are out of order, e.g. sent by a client that
+            # missed a concurrent move. The card goes to the bottom and the
+            # card.moved event puts it there on every open page.
+            rank = neighbour_rank(siblings)
+
+        moved = live_cards().filter(id=card).update(board_list=current_list, rank=rank, updated_date=timezone.now())
+        if not moved:
+            return HttpResponse(status=404)
+        notify(current_list.board_id, 'card.moved', id=card, list=current_list.id, rank=rank)
+        return JsonResponse({'card':card, 'rank':rank})
+
+
+class CardBatchMoveView(LoginRequiredMixin, View):
+    """
+    Move many cards in one request, e.g. after a multi select drag or when
+    clearing a column.
+
+    The body is JSON (or a 'moves' form field holding JSON):
+        {"moves": [{"card": 1, "list": 2, "position": 0}, ...]}
+    'position' is the index the card ends up at among the visible cards of
+    the target list, leave it out to drop the card at the bottom.
+
+    All moves are validated together; if any card or list is unknown
+    nothing is moved and a 400 lists the offending ids. Otherwise every
+    card gets its new list and rank in one transaction, with a constant
+    number of queries no matter how many cards are moved.
+    """
+
+    def post(self, *args, **kwargs):
+        try:
+            moves = self.parse_moves()
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({'error':'Invalid moves.'}, status=400)
+
+        card_ids = [card_id for card_id, list_id, position in moves]
+        list_ids = set(list_id for card_id, list_id, position in moves)
+        found_cards = dict(live_cards().filter(id__in=card_ids).values_list('id', 'board_list__board_id'))
+        found_lists = dict(live_lists().filter(id__in=list_ids, archived=False).values_list('id', 'board_id'))
+        missing_cards = sorted(set(card_ids) - set(found_cards))
+        missing_lists = sorted(list_ids - set(found_lists))
+        if len(card_ids) != len(set(card_ids)) or missing_cards or missing_lists:
+            return JsonResponse({'error':'Invalid moves.', 'cards':missing_cards, 'lists':missing_lists}, status=400)
+
+        with transaction.atomic():
+            try:
+                ranks = plan_moves(self.sibling_ranks(list_ids, card_ids), moves)
+            except ValueError:
+                for list_id in list_ids:
+                    rebalance_cards(list_id)
+                ranks = plan_moves(self.sibling_ranks(list_ids, card_ids), moves)
+
+            targets = {card_id: list_id for card_id, list_id, position in moves}
+            update_in_bulk(Card.objects.all(), {'board_list': targets, 'rank': ranks}, updated_date=timezone.now())
+            for board_id in set(found_cards.values()) | set(found_lists.values()):
+                moved = [
+                    {'id':card_id, 'list':targets[card_id], 'rank':ranks[card_id]}
+                    for card_id in card_ids if board_id in (found_cards[card_id], found_lists[targets[card_id]])
+                ]
+                notify(board_id, 'cards.moved', cards=moved)
+
+        return JsonResponse({'cards':[{'card':card_id, 'list':targets[card_id], 'rank':ranks[card_id]} for card_id in card_ids]})
+
+    def parse_moves(self):
+        if self.request.content_type == 'application/json':
+            data = json.loads(self.request.body.decode('utf-8'))
+        else:
+            data = {'moves':json.loads(self.request.POST.get('moves', '[]'))}
+
+        if not isinstance(data['moves'], list) or not all(isinstance(move, dict) for move in data['moves']):
+            raise ValueError('Moves must be a list of objects.')
+        moves = []
+        for move in data['moves']:
+            position = move.get('position')
+            moves.append((parse_id(move['card']), parse_id(move['list']), None if position is None else int(position)))
+        if not moves:
+            raise ValueError('No moves.')
+        return moves
+
+    def sibling_ranks(self, list_ids, moved_ids):
+        siblings = {list_id: [] for list_id in list_ids}
+        rows = visible_cards().filter(board_list_id__in=list_ids).exclude(id__in=moved_ids).values_list('board_list_id', 'rank')
+        for list_id, rank in rows:
+            siblings[list_id].append(rank)
+        return siblings
+
+
+class ListDragAndDropView(LoginRequiredMixin, View):
+    """
+    Drag and drop a list inside its board, works like CardDragAndDropView
+    with 'before' and 'after' being the neighbouring lists.
+    """
+
+    def post(self, *args, **kwargs):
+        try:
+            before, after = neighbour_ids(self.request.POST)
+        except ValueError:
+            return JsonResponse({'error':'Invalid list.'}, status=400)
+        board_list = get_object_or_404(live_lists(), id=kwargs.get('id'))
+        siblings = List.objects.filter(board_id=board_list.board_id).exclude(id=board_list.id)
+
+        rank = neighbour_rank(siblings, before, after)
+        if rank is None:
+            rebalance_lists(board_list.board_id)
+            rank = neighbour_rank(siblings, before, after)
+        if rank is None:
+            # Neighbours out of order, see CardDragAndDropView.
+            rank = neighbour_rank(siblings)
+
+        List.objects.filter(id=board_list.id).update(rank=rank, updated_date=timezone.now())
+        notify(board_list.board_id, 'list.moved', id=board_list.id, rank=rank)
+        return JsonResponse({'board_list':board_list.id, 'rank':rank})
 
 
 class UpdateBoard(LoginRequiredMixin, TemplateView):
@@ -304,6 +588,7 @@ class UpdateBoard(LoginRequiredMixin, TemplateView):
         current_board = Board.objects.get(id=board.id)
         current_board.title = update_board 
         current_board.save()
+        notify(current_board.id, 'board.renamed', title=current_board.title)
         return JsonResponse({'board':current_board.title})
 
 
@@ -319,9 +604,10 @@ class UpdateListView(LoginRequiredMixin, TemplateView):
     def post(self, *args, **kwargs):
         edit_list = self.request.POST.get('list_data')     
         list_id = self.request.POST.get('list_id')      
-        update_list = List.objects.get(id=list_id)
+        update_list = get_object_or_404(live_lists(), id=list_id)
         update_list.list_title = edit_list
         update_list.save()
+        notify(update_list.board_id, 'list.renamed', id=update_list.id, title=update_list.list_title)
         return JsonResponse({'board_list':update_list.id})
 
 
@@ -332,7 +618,8 @@ class DeleteBoardView(LoginRequiredMixin, DeleteView):
     
     def get(self, *args, **kwargs):
         board_to_delete = get_object_or_404(Board, id=kwargs.get('id'))
-        board_to_delete.delete()
+        # Hidden now, its lists and cards are deleted by the purge_boards worker.
+        mark_deleted(board_to_delete)
         return redirect('dashboard')
 
 
@@ -342,9 +629,14 @@ class DeleteListView(LoginRequiredMixin, DeleteView):
     """
     
     def get(self, *args, **kwargs):
-        list_to_delete = get_object_or_404(List, id=kwargs.get('id'))
+        list_to_delete = get_object_or_404(live_lists(), id=kwargs.get('id'))
         board = list_to_delete.board.id
-        list_to_delete.delete()
+        list_id = list_to_delete.id
+        images = list_to_delete.card_set.exclude(image='').values_list('image', flat=True)
+        with transaction.atomic():
+            release(*images)
+            list_to_delete.delete()
+        notify(board, 'list.deleted', id=list_id)
         return redirect('board', board)
 
 
@@ -354,9 +646,13 @@ class DeleteCardView(LoginRequiredMixin, DeleteView):
     """
 
     def get(self, *args, **kwargs):
-        card_to_delete = get_object_or_404(Card, id=kwargs.get('id'))
-        card_to_delete.delete()
-        return redirect('board', card_to_delete.board_list.board.id )
+        card_to_delete = get_object_or_404(live_cards(), id=kwargs.get('id'))
+        card_id = card_to_delete.id
+        with transaction.atomic():
+            release(card_to_delete.image.name)
+            card_to_delete.delete()
+        notify(card_to_delete.board_list.board_id, 'card.deleted', id=card_id)
+        return redirect('board', card_to_delete.board_list.board_id)
 
 
 class BoardArchiveView(LoginRequiredMixin, View):
@@ -368,6 +664,7 @@ class BoardArchiveView(LoginRequiredMixin, View):
         board = get_object_or_404(Board, id=kwargs.get('id'))
         board.archived = True 
         board.save()
+        notify(board.id, 'board.archived')
         return JsonResponse({'board':board.id})
 
 
@@ -380,6 +677,7 @@ class RestoreArchivedBoard(LoginRequiredMixin, View):
         board = get_object_or_404(Board, id=kwargs.get('id'))
         board.archived = False 
         board.save()
+        notify(board.id, 'board.restored')
         return redirect('dashboard')
 
 
@@ -389,10 +687,11 @@ class RestoreArchivedList(LoginRequiredMixin, View):
     """
 
     def get(self, *args, **kwargs):
-        board_list = get_object_or_404(List, id=kwargs.get('id'))
+        board_list = get_object_or_404(live_lists(), id=kwargs.get('id'))
         board_list.archived = False
         board_list.save()
-        return redirect('board', board_list.board.id)
+        notify(board_list.board_id, 'list.restored', id=board_list.id)
+        return redirect('board', board_list.board_id)
 
 
 class RestoreArchivedCard(LoginRequiredMixin, View):
@@ -401,10 +700,11 @@ class RestoreArchivedCard(LoginRequiredMixin, View):
     """
 
     def get(self, *args, **kwargs):
-        card = get_object_or_404(Card, id=kwargs.get('id'))
+        card = get_object_or_404(live_cards(), id=kwargs.get('id'))
         card.archived = False 
         card.save()
-        return redirect('board', card.board_list.board.id)
+        notify(card.board_list.board_id, 'card.restored', id=card.id)
+        return redirect('board', card.board_list.board_id)
 
 
 class ListArchiveView(LoginRequiredMixin, View):
@@ -413,10 +713,11 @@ class ListArchiveView(LoginRequiredMixin, View):
     """
 
     def get(self, *args, **kwargs):
-        board_list = get_object_or_404(List, id=kwargs.get('id'))
+        board_list = get_object_or_404(live_lists(), id=kwargs.get('id'))
         board_list.archived = True 
         board_list.save()
-        return JsonResponse({'board':board_list.board.id})
+        notify(board_list.board_id, 'list.archived', id=board_list.id)
+        return JsonResponse({'board':board_list.board_id})
 
 
 class CardArchiveView(LoginRequiredMixin, View):
@@ -425,33 +726,143 @@ class CardArchiveView(LoginRequiredMixin, View):
     """
 
     def get(self, *args, **kwargs):
-        card = get_object_or_404(Card, id=kwargs.get('id'))
+        card = get_object_or_404(live_cards(), id=kwargs.get('id'))
         card.archived = True 
         card.save()
-        return JsonResponse({'board':card.board_list.board.id})
+        notify(card.board_list.board_id, 'card.archived', id=card.id)
+        return JsonResponse({'board':card.board_list.board_id})
+
+
+class ListCardsArchiveView(LoginRequiredMixin, View):
+    """
+    Archive every card of the list at once, or restore them all when
+    'archived' is False. Returns the ids of the cards changed.
+    """
+
+    archived = True
+
+    def post(self, *args, **kwargs):
+        board_list = get_object_or_404(List, id=kwargs.get('id'), board__in=accessible_boards(self.request.user))
+        ids = archive_cards(board_list.card_set.all(), self.archived)
+        return JsonResponse({'list':board_list.id, 'cards':ids})
+
+
+class BoardListsArchiveView(LoginRequiredMixin, View):
+    """
+    Archive every list of the board at once, or restore them all when
+    'archived' is False. Returns the ids of the lists changed.
+    """
+
+    archived = True
+
+    def post(self, *args, **kwargs):
+        board = get_object_or_404(accessible_boards(self.request.user), id=kwargs.get('id'))
+        ids = archive_lists(board.list_set.all(), self.archived)
+        return JsonResponse({'board':board.id, 'lists':ids})
+
+
+class SelectionArchiveView(LoginRequiredMixin, View):
+    """
+    Archive (or restore when 'archived' is False) any selection of cards,
+    lists and boards in one request.
+
+    The body is JSON (or form fields holding JSON lists):
+        {"cards": [1, 2], "lists": [3], "boards": [4]}
+    Ids outside the boards the user made or joined are ignored. Returns the
+    ids changed per type.
+    """
+
+    archived = True
+    MAX_IDS = 500
+
+    def post(self, *args, **kwargs):
+        try:
+            selection = self.parse_selection()
+        except (ValueError, TypeError):
+            return JsonResponse({'error':'Invalid selection.'}, status=400)
+        if any(len(ids) > self.MAX_IDS for ids in selection.values()):
+            return JsonResponse({'error':'Too many ids.', 'max':self.MAX_IDS}, status=400)
+
+        boards = accessible_boards(self.request.user)
+        with transaction.atomic():
+            cards = archive_cards(Card.objects.filter(id__in=selection['cards'], board_list__board__in=boards), self.archived)
+            lists = archive_lists(List.objects.filter(id__in=selection['lists'], board__in=boards), self.archived)
+            board_ids = archive_boards(boards.filter(id__in=selection['boards']), self.archived)
+        return JsonResponse({'cards':cards, 'lists':lists, 'boards':board_ids})
+
+    def parse_selection(self):
+        if self.request.content_type == 'application/json':
+            data = json.loads(self.request.body.decode('utf-8'))
+        else:
+            data = {name:json.loads(self.request.POST.get(name, '[]')) for name in ('cards', 'lists', 'boards')}
+        if not isinstance(data, dict) or not all(isinstance(data.get(name, []), list) for name in ('cards', 'lists', 'boards')):
+            raise ValueError('Selection must be an object of id lists.')
+        return {name:[parse_id(pk) for pk in data.get(name, [])] for name in ('cards', 'lists', 'boards')}
 
 
 class ArchiveView(LoginRequiredMixin, TemplateView):
     """
-    Display the archive boards, lists, and cards in one template order by the date it was created.
-    1. Get all the boards with the current user as the author, and if archived is equal to true, order
-       by the date it was created.
-    2. Get all the lists with the current user as the author, and if archived is equal to true, order
-       by the date it was created.
-    3. Get all the cards with the current user as the author, and if archived is equal to true, order
-       by the date it was created.
+    Display the archived boards, lists or cards of the current user, one type
+    per tab, oldest first.
+
+    'type' is 'boards', 'lists' or 'cards'. Items come in pages of
+    ARCHIVE_PAGE_SIZE, 'after' is the cursor of the next page returned with
+    the previous one. With 'format=json' the page is returned as JSON for
+    the infinite scroll of the archive modal.
     """
 
     template_name = 'trello/board_archive.html'
+    archive_types = {
+        'boards': (Board, 'title', 'delete-board', 'restore-board'),
+        'lists': (List, 'list_title', 'delete-list', 'restore-list'),
+        'cards': (Card, 'card_title', 'delete-card', 'restore-card'),
+    }
+    # Lists and cards of boards pending deletion are hidden with their board.
+    deleted_board = {
+        'boards': {},
+        'lists': {'board__deleted_date__isnull': True},
+        'cards': {'board_list__board__deleted_date__isnull': True},
+    }
 
     def get(self, *args, **kwargs):
-        archive_boards = Board.objects.filter(author=self.request.user, archived=True).order_by('created_date')
-        archive_list = List.objects.filter(author=self.request.user, archived=True).order_by('created_date')
-        archive_card = Card.objects.filter(author=self.request.user, archived=True).order_by('created_date')
-        context = {'archive_boards':archive_boards, 'archive_list':archive_list, 'archive_card':archive_card}
+        archive_type = self.request.GET.get('type', 'boards')
+        if archive_type not in self.archive_types:
+            return JsonResponse({'error':'Unknown type.'}, status=400)
+        model, title_field, delete_url, restore_url = self.archive_types[archive_type]
+
+        archived = model.objects.filter(author=self.request.user, archived=True, **self.deleted_board[archive_type]).values(
+            'id', 'created_date', title_field
+        )
+        try:
+            items, next_cursor = keyset_page(archived, self.request.GET.get('after'))
+        except ValueError:
+            return JsonResponse({'error':'Invalid cursor.'}, status=400)
+        for item in items:
+            item['title'] = item.pop(title_field)
+            item['delete'] = reverse(delete_url, args=[item['id']])
+            item['restore'] = reverse(restore_url, args=[item['id']])
+
+        if self.request.GET.get('format') == 'json':
+            return JsonResponse({'type':archive_type, 'items':items, 'next':next_cursor})
+
+        context = {'archive_type':archive_type, 'archive_types':list(self.archive_types), 'items':items, 'next':next_cursor}
         return render(self.request, self.template_name, context)
 
 
+class SearchView(LoginRequiredMixin, View):
+    """
+    Full-text search of the cards of the boards the user made or joined.
+    'q' is the text searched, 'archived=1' includes archived cards.
+    Returns the best matches first, see trello/search.py
+    """
+
+    def get(self, *args, **kwargs):
+        query = self.request.GET.get('q', '')
+        include_archived = self.request.GET.get('archived') in ('1', 'true')
+        cards = search_cards(self.request.user, query, include_archived=include_archived)
+        return JsonResponse({'query':query, 'cards':cards})
+
+
 class InviteMemberView(LoginRequiredMixin, TemplateView):
     """
     NOT UPDATED
@@ -466,29 +877,30 @@ class InviteMemberView(LoginRequiredMixin, TemplateView):
     template_name = 'trello/board.html'
 
     def send_email_msg(self, message, to_email):
-        send_mail(
-            'Invite Member',
-            message,
-            settings.EMAIL_HOST_USER,
-            [to_email],
+        # Queued in the outbox, the send_emails worker delivers it.
+        outbox.enqueue('Invite Member', message, to_email)
+
+    def invite_message(self, board, registered):
+        return 'You are invited by {} to join board {}. Click the link below to join. http://3b8b75b8.ngrok.io/{}'.format(
+            self.request.user.username, board.title, 'dashboard' if registered else 'register'
         )
 
     def post(self, *args, **kwargs):
         member_email = self.request.POST.get('member_email')
         board = get_object_or_404(Board, id=kwargs.get('id'))
-        invite_by = self.request.user.username
         member = User.objects.filter(email=member_email)
 
         if member.exists():
-            message = 'You are invited by {} to join board {}. Click the link below to join. http://3b8b75b8.ngrok.io/dashboard'.format(invite_by, board.title)
+            message = self.invite_message(board, registered=True)
             self.send_email_msg(message, member_email)
 
             current_member = User.objects.get(email=member_email)
             new_board_member = BoardMembers.objects.create(board=board, members=current_member)
+            notify(board.id, 'member.invited', id=current_member.id, username=current_member.username)
 
             return redirect('board', board.id)
         else:
-            message = 'You are invited by {} to join board {}. Click the link below to join. http://3b8b75b8.ngrok.io/register'.format(invite_by, board.title)
+            message = self.invite_message(board, registered=False)
             self.send_email_msg(message, member_email)
             
             initial_member = BoardInvite.objects.create(board=board, email_member=member_email)
@@ -496,6 +908,80 @@ class InviteMemberView(LoginRequiredMixin, TemplateView):
             return redirect('board', board.id)
 
 
+class InviteMembersView(InviteMemberView):
+    """
+    Invite many people to the board at once, e.g. when onboarding a team.
+
+    The body is JSON (or an 'emails' form field with one address per line
+    or separated by commas):
+        {"emails": ["a@example.com", "b@example.com", ...]}
+
+    All addresses are resolved with one query. Registered users become
+    members, the others get a pending invite; people already on the board
+    or already invited are skipped. Rows are bulk inserted and the emails
+    queued in the outbox as one batch.
+    """
+
+    MAX_EMAILS = 500
+
+    def post(self, *args, **kwargs):
+        board = get_object_or_404(Board, id=kwargs.get('id'))
+        try:
+            emails = self.parse_emails()
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({'error':'Invalid emails.'}, status=400)
+
+        invalid = []
+        for email in emails:
+            try:
+                validate_email(email)
+            except ValidationError:
+                invalid.append(email)
+        if invalid or len(emails) > self.MAX_EMAILS:
+            return JsonResponse({'error':'Invalid emails.', 'emails':invalid, 'max':self.MAX_EMAILS}, status=400)
+
+        users = {}
+        for user in User.objects.filter(email__in=emails).order_by('id'):
+            users.setdefault(user.email, user)
+        members = set(BoardMembers.objects.filter(board=board, members__in=users.values()).values_list('members_id', flat=True))
+        invited = set(BoardInvite.objects.filter(board=board, email_member__in=emails).values_list('email_member', flat=True))
+
+        new_members = [user for user in users.values() if user.id not in members]
+        new_invites = [email for email in emails if email not in users and email not in invited]
+        outgoing = (
+            [('Invite Member', self.invite_message(board, registered=True), user.email) for user in new_members] +
+            [('Invite Member', self.invite_message(board, registered=False), email) for email in new_invites]
+        )
+
+        with transaction.atomic():
+            BoardMembers.objects.bulk_create([BoardMembers(board=board, members=user) for user in new_members])
+            BoardInvite.objects.bulk_create([BoardInvite(board=board, email_member=email) for email in new_invites])
+            outbox.enqueue_many(outgoing)
+            if new_members:
+                notify(board.id, 'members.invited', members=[{'id':user.id, 'username':user.username} for user in new_members])
+
+        added = set(new_invites) | set(user.email for user in new_members)
+        skipped = [email for email in emails if email not in added]
+        return JsonResponse({
+            'members':[user.id for user in new_members],
+            'invited':new_invites,
+            'skipped':skipped,
+        })
+
+    def parse_emails(self):
+        if self.request.content_type == 'application/json':
+            emails = json.loads(self.request.body.decode('utf-8'))['emails']
+        else:
+            emails = self.request.POST.get('emails', '').replace(',', '\n').splitlines()
+
+        if not isinstance(emails, list) or not all(isinstance(email, str) for email in emails):
+            raise ValueError('Emails must be a list of strings.')
+        emails = [email.strip() for email in emails if email.strip()]
+        if not emails:
+            raise ValueError('No emails.')
+        return list(OrderedDict.fromkeys(emails))
+
+
 class RegisterInvitedUser(LoginRequiredMixin, View):
     """
     NOT UPDATED
@@ -525,11 +1011,10 @@ class RegisterInvitedUser(LoginRequiredMixin, View):
 
                 new_board_member = BoardMembers.objects.create(board=board, members=user, deactivate=False, owner=False)
                 new_board_member.save()
+                notify(board.id, 'member.joined', id=user.id, username=user.username)
 
-                print('Success')
                 return redirect('login')
             else:
-                print('Fail')
                 return HttpResponse(status=400)
         form = SignUpForm()
         return render(self.request, self.template_name, {'form':form})
@@ -541,11 +1026,11 @@ class LeaveBoardView(LoginRequiredMixin, View):
     """
 
     def get(self, *args, **kwargs):
-        print(self.request.user)
         board = get_object_or_404(Board, id=kwargs.get('id'))
         board_member = BoardMembers.objects.get(board=board, members=self.request.user)
         board_member.deactivate = True
         board_member.save()
+        notify(board.id, 'member.left', id=self.request.user.id, username=self.request.user.username)
         return redirect('dashboard')
 
 
@@ -573,6 +1058,8 @@ class EditUserProfile(LoginRequiredMixin, TemplateView):
             user_profile = user_profile_form.save(commit=False)
             user_profile.user = user
             user_profile.save()
+            for board_id in BoardMembers.objects.filter(members=user).values_list('board_id', flat=True):
+                notify(board_id, 'member.updated', id=user.id, username=user.username)
             return redirect('user-profile')
         return render(self.request, self.template_name, {'user_form':user_form, 'user_profile_form':user_profile_form})
 
@@ -583,9 +1070,14 @@ class DeleteCardCoverImage(LoginRequiredMixin, DeleteView):
     """
     
     def get(self, *args, **kwargs):
-        card = get_object_or_404(Card, id=kwargs.get('id'))
-        card.image = None
-        card.save()
+        card = get_object_or_404(live_cards(), id=kwargs.get('id'))
+        with transaction.atomic():
+            release(card.image.name)
+            card.image = None
+            card.thumbnail = None
+            card.preview = None
+            card.save()
+        notify(card.board_list.board_id, 'card.cover', id=card.id, image=None)
         return JsonResponse({'card':card.id})
 
 
@@ -598,13 +1090,21 @@ class UploadImageView(LoginRequiredMixin, View):
     form = CardImageForm
 
     def post(self, *args, **kwargs):
-        parent_card = get_object_or_404(Card, id=kwargs.get('id'))
+        parent_card = get_object_or_404(live_cards(), id=kwargs.get('id'))
+        old_image = parent_card.image.name
         form = self.form(self.request.POST, self.request.FILES, instance=parent_card)
 
         if form.is_valid():
            new_image = form.save(commit=False)
            new_image.author = self.request.user
            new_image.board_list = parent_card.board_list
-           new_image.save()
-           return redirect('board', parent_card.board_list.board.id)
+           new_image.thumbnail = None
+           new_image.preview = None
+           with transaction.atomic():
+               new_image.image = store_upload(form.cleaned_data['image'])
+               release(old_image)
+               new_image.save()
+           queue_derivatives(new_image.id, new_image.image.name)
+           notify(parent_card.board_list.board_id, 'card.cover', id=parent_card.id, image=new_image.image.url)
+           return redirect('board', parent_card.board_list.board_id)
         return render(self.request, self.template_name, {'form':form})